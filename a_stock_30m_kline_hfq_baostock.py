@@ -1,3 +1,5 @@
+# 注意: get_30m_kline_data 已改为由不复权K线和复权因子(a_stock_adj_factor_baostock.py)实时计算复权价格，
+# 本脚本仅保留用于历史数据核对，无需再定期全量重下。
 import baostock as bs
 import pandas as pd
 import psycopg2
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 from common import *
+from kline_validator import validate_and_quarantine
 import baostock as bs
-import tushare as ts
+from trade_calendar import get_trade_calendar
 
 # ================================= 读取配置文件 =================================
 config = load_config()
 engine = create_engine(get_pg_connection_string(config))
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
 
 # ================================= 配置日志 =================================
 logger = setup_logger()
@@ -23,9 +22,7 @@ tmp_table  = f"temp_{table_name}_{int(time.time())}"
 # ================================= 交易日相关 =================================
 def get_trade_dates_between(start_date, end_date):
     """获取两个日期之间的所有交易日列表，按降序排列（从新到旧）"""
-    calendar = pro.trade_cal(start_date=start_date, end_date=end_date)
-    trade_dates = calendar[calendar['is_open'] == 1]['cal_date'].sort_values(ascending=False).tolist()
-    return trade_dates
+    return get_trade_calendar(engine=engine).between(start_date, end_date)[::-1]
 
 # ================================= 获取数据库中最新的记录时间 =================================
 def get_latest_record_time(engine) -> str:
@@ -127,6 +124,7 @@ def download_and_store_data(engine, stocks, start_date, end_date, batch_size=100
             if all_data:
                 final_df = pd.concat(all_data, ignore_index=True)
                 logger.info(f"日期 {current_date} 批次 {i // batch_size + 1} 共下载 {len(final_df)} 条记录")
+                final_df, _ = validate_and_quarantine(final_df, table_name, '30m', engine)
                 
                 # 使用 save_to_database 保存数据
                 if save_to_database(
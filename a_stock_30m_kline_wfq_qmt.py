@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from common import *
+from kline_validator import validate_and_quarantine
 from xtquant import xtdata
 xtdata.enable_hello = False
 data_dir = 'E:\\国金证券QMT交易端\\userdata_mini\\datadir'
@@ -24,7 +25,7 @@ data_dict = xtdata.get_local_data(stock_list = stock_list, period = period, star
 
 def process_stock_data(df: pd.DataFrame) -> pd.DataFrame:
     """处理合并后的所有股票数据"""
-    df['trade_time'] = pd.to_datetime(df['time'].apply(lambda x: datetime.fromtimestamp(x / 1000.0)))
+    df['trade_time'] = qmt_time_to_datetime(df['time']).to_numpy()
     df = df.drop(columns=['time'])
     
     df = df.rename(columns={
@@ -89,6 +90,7 @@ def main():
     df = pd.concat(df_list, axis=0).reset_index(drop=True)
     df = process_stock_data(df)
     df = df.sort_values(['ts_code', 'trade_time']).reset_index(drop=True)    
+    df, _ = validate_and_quarantine(df, table_name, '30m', engine)
 
     # 更新数据
     insert_sql = f"""
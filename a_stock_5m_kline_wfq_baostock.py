@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
 from common import *
+from kline_validator import validate_and_quarantine
 import baostock as bs
-import tushare as ts
+from trade_calendar import get_trade_calendar
 
 
 # ================================= 读取配置文件 =================================
 config = load_config()
 engine = create_engine(get_pg_connection_string(config))
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
 
 # ================================= 配置日志 =================================
 logger = setup_logger()
@@ -96,9 +95,7 @@ def download_5min_kline(ts_code: str, start_date: str, end_date: str, max_retrie
 
 def get_trade_dates_between(start_date, end_date):
     """获取两个日期之间的所有交易日列表"""
-    calendar = pro.trade_cal(start_date=start_date, end_date=end_date)
-    trade_dates = calendar[calendar['is_open'] == 1]['cal_date'].sort_values().tolist()
-    return trade_dates
+    return get_trade_calendar(engine=engine).between(start_date, end_date)
 
 def process_date_stocks(date, stocks):
     """处理指定日期的所有股票数据"""
@@ -122,6 +119,7 @@ def save_to_database_batch(df_list, engine):
     
     try:
         final_df = pd.concat(df_list, ignore_index=True)
+        final_df, _ = validate_and_quarantine(final_df, table_name, '5m', engine)
         if save_to_database(
             df=final_df,
             table_name=table_name,
@@ -10,6 +10,7 @@ A股5分钟K线数据下载与处理模块 (前复权QMT版本)
 """
 
 from common import *
+from kline_validator import validate_and_quarantine
 from xtquant import xtdata
 from multiprocessing import Pool
 
@@ -81,7 +82,7 @@ class DataProcessor:
     @staticmethod
     def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         """处理单个DataFrame的数据"""
-        df['trade_time'] = pd.to_datetime(df['time'].apply(lambda x: datetime.fromtimestamp(x / 1000.0)))
+        df['trade_time'] = qmt_time_to_datetime(df['time']).to_numpy()
         df = df.drop(columns=['time'])
         df = df.rename(columns={
             'settelementPrice': 'settelement_price',
@@ -161,6 +162,7 @@ class DatabaseManager:
             
             if df_batch is not None:
                 df_batch = df_batch.sort_values(['ts_code', 'trade_time']).reset_index(drop=True)
+                df_batch, _ = validate_and_quarantine(df_batch, self.config.table_name, '5m', self.engine)
                 tmp_table = f"temp_{self.config.table_name}_{int(time.time())}"
                 insert_sql = f"""
                     INSERT INTO {self.config.table_name}
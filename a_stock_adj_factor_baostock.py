@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+下载baostock复权因子，按(ts_code, 除权除息日)存储
+
+只保存复权事件，配合不复权K线在读取时计算前/后复权价格(见common.apply_adj_factor)，
+不再需要单独存储和定期全量重下前复权、后复权K线
+"""
+from common import *
+import baostock as bs
+
+# ================================= 读取配置文件 =================================
+config = load_config()
+engine = create_engine(get_pg_connection_string(config))
+
+# ================================= 配置日志 =================================
+logger = setup_logger()
+
+# ================================= 定义初始变量 =================================
+stock_list = pd.read_csv('沪深A股_stock_list.csv', header=None, names=['ts_code'])
+end_date   = datetime.today().strftime('%Y%m%d')
+table_name = ADJ_FACTOR_TABLE
+
+# ================================= 建表 =================================
+def create_table_if_not_exists(engine) -> None:
+    """创建复权因子表"""
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        ts_code VARCHAR(20) NOT NULL,
+        divid_operate_date DATE NOT NULL,
+        fore_adjust_factor NUMERIC(24, 12),
+        back_adjust_factor NUMERIC(24, 12),
+        adjust_factor NUMERIC(24, 12),
+        PRIMARY KEY (ts_code, divid_operate_date)
+    );
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+
+def get_latest_record_dates(engine) -> Dict[str, str]:
+    """
+    获取每只股票最新的除权除息日(YYYYMMDD)，表中没有记录的股票不在结果中
+    查询出错时记录日志并抛出异常，不当作空表全量重下
+    """
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT ts_code, MAX(divid_operate_date) FROM {table_name} GROUP BY ts_code
+            """)).fetchall()
+    except Exception as e:
+        logger.error(f"查询 {table_name} 各股票最新除权除息日时出错: {str(e)}")
+        raise
+    return {ts_code: latest.strftime('%Y%m%d') for ts_code, latest in rows if latest is not None}
+
+# ================================= 下载复权因子 =================================
+def download_adj_factor(ts_code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """下载指定股票在日期区间内的复权因子"""
+    bs_code = convert_to_baostock_code(ts_code)
+    rs = bs.query_adjust_factor(code=bs_code, start_date=convert_date_format(start_date),
+                                end_date=convert_date_format(end_date))
+    if rs.error_code != '0':
+        logger.error(f"下载 {ts_code} 复权因子时出错: {rs.error_msg}")
+        return pd.DataFrame()
+
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        data_list.append(rs.get_row_data())
+    if not data_list:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(data_list, columns=rs.fields)
+    df['ts_code'] = df['code'].apply(convert_to_tushare_code)
+    df = df.rename(columns={
+        'dividOperateDate': 'divid_operate_date',
+        'foreAdjustFactor': 'fore_adjust_factor',
+        'backAdjustFactor': 'back_adjust_factor',
+        'adjustFactor': 'adjust_factor',
+    })
+    df = df[['ts_code', 'divid_operate_date', 'fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']]
+    factor_columns = ['fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']
+    df[factor_columns] = df[factor_columns].apply(pd.to_numeric, errors='coerce')
+    return df
+
+def main():
+    """
+    主函数：逐只股票从其最新的除权除息日开始增量下载复权因子；
+    表中没有记录的股票(新上市、此前下载失败或没有返回)从19900101下载全部历史
+    """
+    bs.login()
+    try:
+        create_table_if_not_exists(engine)
+        latest_dates = get_latest_record_dates(engine)
+        ts_codes = stock_list['ts_code'].tolist()
+        logger.info(f"复权因子增量下载: 已有记录 {sum(code in latest_dates for code in ts_codes)} 只，"
+                    f"全量下载 {sum(code not in latest_dates for code in ts_codes)} 只")
+
+        results = []
+        for ts_code in tqdm(ts_codes, desc='下载复权因子'):
+            df = download_adj_factor(ts_code, latest_dates.get(ts_code, '19900101'), end_date)
+            if not df.empty:
+                results.append(df)
+
+        if results:
+            save_to_database(
+                df=pd.concat(results, ignore_index=True),
+                table_name=table_name,
+                conflict_columns=['ts_code', 'divid_operate_date'],
+                data_type='复权因子',
+                engine=engine,
+                update_columns=['fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']
+            )
+        else:
+            logger.info("没有新的复权事件")
+
+    except Exception as e:
+        logger.error(f"程序执行出错: {str(e)}")
+        raise
+    finally:
+        bs.logout()
+
+if __name__ == '__main__':
+    main()
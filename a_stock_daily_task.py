@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from common import *
-import tushare as ts
+from tushare_client import get_tushare_client
+from trade_calendar import get_trade_calendar
+from concurrent.futures import ThreadPoolExecutor
 import schedule
 
 # ================================= 定义初始变量 =================================
@@ -13,8 +15,7 @@ sleep_seconds = 600 # 等待时间
 
 # ================================= 读取配置文件 =================================
 config = load_config()
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
+pro = get_tushare_client(config)
 engine = create_engine(get_pg_connection_string(config))
 
 # ================================= 配置日志 =================================
@@ -23,15 +24,11 @@ logger = setup_logger()
 # ================================= 交易日相关 =================================
 def is_trade_date(date_str):
     """判断是否为交易日"""
-    calendar = pro.trade_cal(start_date=date_str, end_date=date_str)
-    return calendar.iloc[0]['is_open'] == 1
+    return get_trade_calendar(engine=engine).is_open(date_str)
 
 def get_latest_trade_dates(end_date, n_days):
-    """获取截至指定日期的最近N个交易日列表"""
-    start_date = (datetime.strptime(end_date, '%Y%m%d') - timedelta(days=30)).strftime('%Y%m%d')
-    calendar = pro.trade_cal(start_date=start_date, end_date=end_date)
-    trade_dates = calendar[calendar['is_open'] == 1]['cal_date'].sort_values(ascending=False)
-    return trade_dates[:n_days].tolist()
+    """获取截至指定日期的最近N个交易日列表(降序)"""
+    return get_trade_calendar(engine=engine).last_n(end_date, n_days)[::-1]
 
 # ================================= 通用数据获取函数 =================================
 def get_data_with_retry(
@@ -65,8 +62,9 @@ def get_data_with_retry(
         all_data = []
         has_today_data = False
         
-        for date in trade_dates:
-            df = api_func(trade_date=date)
+        # 各交易日并发请求，经共享客户端统一限速
+        results = pro.gather(api_func, [{'trade_date': date} for date in trade_dates])
+        for date, df in zip(trade_dates, results):
             if not df.empty:
                 if process_func:
                     df = process_func(df, **kwargs)
@@ -175,8 +173,8 @@ def get_index_dailybasic_with_retry(today, max_retries, wait_seconds):
     
     def get_index_data(trade_date):
         all_index_data = []
-        for index_code, index_name in indices:
-            df = pro.index_dailybasic(ts_code=index_code, trade_date=trade_date)
+        results = pro.map('index_dailybasic', [{'ts_code': index_code, 'trade_date': trade_date} for index_code, _ in indices])
+        for (index_code, index_name), df in zip(indices, results):
             if not df.empty:
                 df = df.rename(columns={'ts_code': 'index_code'})
                 df['index_name'] = index_name
@@ -624,9 +622,30 @@ def daily_task():
         logger.info(f"{today} 不是交易日，跳过执行")
         return
     
+    # 五类数据互不依赖，并发获取(请求经共享客户端统一限速)，等全部获取结束、收集每个结果或异常后再按原顺序依次入库
+    fetchers = {
+        'moneyflow': get_moneyflow_with_retry,
+        'industry_moneyflow': get_industry_moneyflow_with_retry,
+        'daily_basic': get_daily_basic_with_retry,
+        'daily_k': get_daily_k_with_retry,
+        'index_dailybasic': get_index_dailybasic_with_retry,
+    }
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+        futures = {name: executor.submit(func, today, max_retries, wait_seconds) for name, func in fetchers.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"获取 {name} 数据时出错: {str(e)}")
+                results[name] = None
+    failed = [name for name, df in results.items() if df is None]
+    if failed:
+        logger.error(f"以下数据获取失败: {failed}")
+    
     # 获取资金流向数据
     logger.info(f"开始获取最近{n_days}天的资金流向数据...")
-    moneyflow_df = get_moneyflow_with_retry(today, max_retries, wait_seconds)
+    moneyflow_df = results['moneyflow']
     if moneyflow_df is None:
         logger.error(f"无法获取完整的资金流向数据，请检查数据源")
         return
@@ -643,7 +662,7 @@ def daily_task():
         
     # 获取同花顺行业资金流向数据
     logger.info(f"开始获取最近{n_days}天的同花顺行业资金流向数据...")
-    industry_moneyflow_df = get_industry_moneyflow_with_retry(today, max_retries, wait_seconds)
+    industry_moneyflow_df = results['industry_moneyflow']
     if industry_moneyflow_df is None:
         logger.error(f"无法获取完整的同花顺行业资金流向数据，请检查数据源")
         return
@@ -660,7 +679,7 @@ def daily_task():
 
     # 获取每日基本面数据
     logger.info(f"开始获取最近{n_days}天的每日基本面数据...")
-    basic_df = get_daily_basic_with_retry(today, max_retries, wait_seconds)
+    basic_df = results['daily_basic']
     if basic_df is None:
         logger.error(f"无法获取完整的每日基本面数据，请检查数据源")
         return
@@ -677,7 +696,7 @@ def daily_task():
         
     # 获取日线行情数据
     logger.info(f"开始获取最近{n_days}天的日线行情数据...")
-    daily_k_df = get_daily_k_with_retry(today, max_retries, wait_seconds)
+    daily_k_df = results['daily_k']
     if daily_k_df is None:
         logger.error(f"无法获取完整的日线行情数据，请检查数据源")
         return
@@ -694,7 +713,7 @@ def daily_task():
 
     # 获取指数每日指标数据
     logger.info(f"开始获取最近{n_days}天的指数每日指标数据...")
-    index_dailybasic_df = get_index_dailybasic_with_retry(today, max_retries, wait_seconds)
+    index_dailybasic_df = results['index_dailybasic']
     if index_dailybasic_df is None:
         logger.error(f"无法获取完整的指数每日指标数据，请检查数据源")
         return
@@ -778,6 +797,7 @@ def daily_task():
     ):
         return
 
+    pro.log_stats()
     logger.info(f"{today}的任务完成!!!")
     send_notification_wecom(f"{today}的daily task完成!!!", f"{today}的daily task完成!!!")
 
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+A股K线重采样：由已入库的5分钟K线合成30分钟/60分钟/日K线
+
+- 按A股交易时段对齐(09:30-11:30, 13:00-15:00)，午休不跨桶，K线时间采用右端点标记(与baostock/QMT一致)
+- 提供NumPy向量化实现(resample_bars)与数据库内实现(build_resample_sql)两种方式
+- 合成K线写入独立的 a_stock_{freq}_kline_wfq_{source}_resampled 表，按目标表最新记录增量写入，最后一个交易日重算覆盖；
+  不写入下载脚本的同周期表，避免覆盖数据源原始K线
+- 与已下载的同周期K线(a_stock_{freq}_kline_wfq_{source})对账，输出逐股票差异报告
+
+用法:
+    python a_stock_kline_resample.py --source baostock --freq 30m 60m 1day --mode db
+    python a_stock_kline_resample.py --source baostock --freq 30m --reconcile --start-date 20240101 --end-date 20241231
+"""
+from common import *
+import argparse
+
+
+# ================================= 定义初始变量 =================================
+SOURCE_TABLE = 'a_stock_5m_kline_wfq_{source}'
+TARGET_TABLE = 'a_stock_{freq}_kline_wfq_{source}_resampled'   # 合成K线
+DOWNLOADED_TABLE = 'a_stock_{freq}_kline_wfq_{source}'         # 下载脚本写入的同周期K线，对账基准
+CHUNK_DAYS   = 30          # NumPy模式每批读取的自然日天数
+PRICE_TOL    = 1e-3        # 对账价格容差
+VOLUME_TOL   = 1e-6        # 对账成交量相对容差
+
+# 各列聚合规则：first/last按时间顺序取首尾，all表示全部为真
+AGG_RULES = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+    'amount': 'sum',
+    'adjust_flag': 'last',
+    'settelement_price': 'last',
+    'open_interest': 'last',
+    'pre_close': 'first',
+    'suspend_flag': 'all',
+}
+
+# 各数据源的表结构(列顺序与下载脚本建表一致，save_to_database按列顺序写入)
+SOURCE_COLUMNS = {
+    'baostock': ['trade_time', 'ts_code', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjust_flag'],
+    'qmt': ['trade_time', 'ts_code', 'open', 'high', 'low', 'close', 'volume', 'amount',
+            'settelement_price', 'open_interest', 'pre_close', 'suspend_flag'],
+}
+
+SQL_AGG = {
+    'first': '(ARRAY_AGG({col} ORDER BY trade_time))[1]',
+    'last': '(ARRAY_AGG({col} ORDER BY trade_time DESC))[1]',
+    'max': 'MAX({col})',
+    'min': 'MIN({col})',
+    'sum': 'SUM({col})',
+    'all': 'BOOL_AND({col})',
+}
+
+
+# ================================= 向量化重采样 =================================
+def resample_bars(df: pd.DataFrame, freq: str = '30m') -> pd.DataFrame:
+    """
+    将5分钟K线向量化重采样为指定周期
+    Args:
+        df: 5分钟K线，至少包含trade_time, ts_code, open, high, low, close, volume, amount
+        freq: 目标周期，'15m'/'30m'/'60m'/'1day'
+    Returns:
+        pd.DataFrame: 重采样后的K线，列顺序与输入一致
+    """
+    if df.empty:
+        return df.copy()
+
+    df = df.sort_values(['ts_code', 'trade_time'], kind='mergesort')
+    codes = df['ts_code'].to_numpy()
+    bucket_end = bar_bucket_end(df['trade_time'], freq)
+
+    # 数据已按(ts_code, trade_time)排序，代码或目标K线结束时间变化处即为新组的起点
+    new_group = np.empty(len(df), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (codes[1:] != codes[:-1]) | (bucket_end[1:] != bucket_end[:-1])
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], len(df)) - 1
+
+    result = {'trade_time': bucket_end[starts], 'ts_code': codes[starts]}
+    for col, rule in AGG_RULES.items():
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy()
+        if rule == 'first':
+            result[col] = values[starts]
+        elif rule == 'last':
+            result[col] = values[ends]
+        elif rule == 'max':
+            result[col] = np.maximum.reduceat(values.astype(float), starts)
+        elif rule == 'min':
+            result[col] = np.minimum.reduceat(values.astype(float), starts)
+        elif rule == 'sum':
+            result[col] = np.add.reduceat(values.astype(float), starts)
+        elif rule == 'all':
+            result[col] = np.logical_and.reduceat(values.astype(bool), starts)
+
+    result = pd.DataFrame(result)
+    result['trade_time'] = pd.to_datetime(result['trade_time'])
+    return result[[col for col in df.columns if col in result.columns]]
+
+
+# ================================= 数据库内重采样 =================================
+def build_resample_sql(source: str, freq: str, target_table: str = None, start_time: str = None,
+                       end_time: str = None, upsert: bool = True) -> str:
+    """
+    构建数据库内重采样SQL，时段分桶逻辑与bar_bucket_end一致
+    Args:
+        source: 数据源，'baostock'或'qmt'
+        freq: 目标周期
+        target_table: 目标表名，为None时只返回SELECT语句
+        start_time: 起始时间(不含)，格式YYYY-MM-DD HH:MM:SS
+        end_time: 结束时间(含)
+        upsert: 冲突时是否更新
+    """
+    n = BAR_MINUTES[freq]
+    columns = SOURCE_COLUMNS[source]
+    agg_columns = [col for col in columns if col in AGG_RULES]
+    aggs = ",\n               ".join(
+        f"{SQL_AGG[AGG_RULES[col]].format(col=col)} AS {col}" for col in agg_columns)
+
+    conditions = []
+    if start_time:
+        conditions.append(f"trade_time > '{start_time}'")
+    if end_time:
+        conditions.append(f"trade_time <= '{end_time}'")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    select_sql = f"""
+        WITH src AS (
+            SELECT *,
+                   trade_time::date AS trade_day,
+                   EXTRACT(HOUR FROM trade_time)::int * 60 + EXTRACT(MINUTE FROM trade_time)::int AS clock_min
+            FROM {SOURCE_TABLE.format(source=source)}
+            {where}
+        ), bucketed AS (
+            SELECT *,
+                   GREATEST(CEIL(LEAST(GREATEST(
+                       CASE WHEN clock_min <= {MORNING_CLOSE} THEN clock_min - {MORNING_OPEN}
+                            WHEN clock_min <= {AFTERNOON_OPEN} THEN {MORNING_MINUTES}
+                            ELSE clock_min - {AFTERNOON_OPEN} + {MORNING_MINUTES} END,
+                       0), {SESSION_MINUTES}) / {n}.0), 1)::int * {n} AS bucket_min
+            FROM src
+        )
+        SELECT trade_day + make_interval(mins => CASE WHEN LEAST(bucket_min, {SESSION_MINUTES}) <= {MORNING_MINUTES}
+                                                     THEN {MORNING_OPEN} + LEAST(bucket_min, {SESSION_MINUTES})
+                                                     ELSE {AFTERNOON_OPEN} + LEAST(bucket_min, {SESSION_MINUTES}) - {MORNING_MINUTES} END) AS trade_time,
+               ts_code,
+               {aggs}
+        FROM bucketed
+        GROUP BY ts_code, trade_day, bucket_min
+    """
+    if target_table is None:
+        return select_sql
+
+    if upsert:
+        set_clause = ", ".join(f"{col} = EXCLUDED.{col}" for col in agg_columns)
+        conflict = f"ON CONFLICT (trade_time, ts_code) DO UPDATE SET {set_clause}"
+    else:
+        conflict = "ON CONFLICT (trade_time, ts_code) DO NOTHING"
+    return f"""
+        INSERT INTO {target_table} ({', '.join(columns)})
+        {select_sql}
+        {conflict}
+    """
+
+
+# ================================= 目标表管理 =================================
+def create_table_if_not_exists(engine, source: str, table_name: str) -> None:
+    """创建重采样目标表(与下载脚本的同周期表分开存放)"""
+    extra_columns = {
+        'baostock': "adjust_flag INTEGER,",
+        'qmt': """settelement_price NUMERIC(18, 4),
+            open_interest NUMERIC(18, 4),
+            pre_close NUMERIC(18, 4),
+            suspend_flag BOOLEAN,""",
+    }[source]
+    create_table_sql = f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            trade_time TIMESTAMP NOT NULL,
+            ts_code VARCHAR(20) NOT NULL,
+            open NUMERIC(18, 4),
+            high NUMERIC(18, 4),
+            low NUMERIC(18, 4),
+            close NUMERIC(18, 4),
+            volume NUMERIC(18, 4),
+            amount NUMERIC(18, 4),
+            {extra_columns}
+            PRIMARY KEY (trade_time, ts_code)
+        );
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_ts_code ON {table_name} (ts_code);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+
+def get_resume_time(engine, table_name: str) -> str:
+    """
+    获取增量起点：目标表最新记录所在交易日的零点，最后一个交易日整体重算(可能是盘中写入的不完整数据)
+    表为空时返回'1990-01-01 00:00:00'
+    """
+    try:
+        with engine.connect() as conn:
+            latest = conn.execute(text(f"SELECT MAX(trade_time) FROM {table_name}")).scalar()
+    except Exception:
+        latest = None
+    if latest is None:
+        return '1990-01-01 00:00:00'
+    return pd.Timestamp(latest).normalize().strftime('%Y-%m-%d %H:%M:%S')
+
+def read_5m_bars(engine, source: str, start_time: str, end_time: str = None, ts_codes: list = None) -> pd.DataFrame:
+    """读取5分钟K线，时间区间为(start_time, end_time]"""
+    query = f"""
+        SELECT {', '.join(SOURCE_COLUMNS[source])}
+        FROM {SOURCE_TABLE.format(source=source)}
+        WHERE trade_time > '{start_time}'
+    """
+    if end_time:
+        query += f" AND trade_time <= '{end_time}'"
+    if ts_codes:
+        codes = "', '".join(ts_codes)
+        query += f" AND ts_code IN ('{codes}')"
+    df = pd.read_sql(query, engine)
+    numeric_columns = [col for col in ['open', 'high', 'low', 'close', 'volume', 'amount',
+                                       'settelement_price', 'open_interest', 'pre_close'] if col in df.columns]
+    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
+    return df
+
+
+# ================================= 增量写入 =================================
+def resample_incremental(engine, source: str, freq: str, mode: str = 'db', target_table: str = None) -> bool:
+    """
+    由5分钟K线增量生成目标周期K线并写入目标表
+    Args:
+        engine: SQLAlchemy引擎
+        source: 数据源，'baostock'或'qmt'
+        freq: 目标周期
+        mode: 'db'在数据库内完成聚合，'numpy'读出后向量化聚合再写回
+        target_table: 目标表名，默认a_stock_{freq}_kline_wfq_{source}_resampled
+    """
+    target_table = target_table or TARGET_TABLE.format(freq=freq, source=source)
+    create_table_if_not_exists(engine, source, target_table)
+    start_time = get_resume_time(engine, target_table)
+    logger.info(f"{target_table} 增量起点: {start_time}，模式: {mode}")
+
+    try:
+        if mode == 'db':
+            t0 = time.time()
+            with engine.begin() as conn:
+                result = conn.execute(text(build_resample_sql(source, freq, target_table, start_time)))
+            logger.info(f"数据库内重采样完成，写入 {result.rowcount} 条 {freq} K线到 {target_table}，耗时 {time.time() - t0:.1f}秒")
+            return True
+
+        # NumPy模式按自然日分批，避免一次性读入全部5分钟K线
+        with engine.connect() as conn:
+            latest = conn.execute(text(f"SELECT MAX(trade_time) FROM {SOURCE_TABLE.format(source=source)}")).scalar()
+        if latest is None:
+            logger.warning("5分钟K线表为空，跳过")
+            return True
+        update_columns = [col for col in SOURCE_COLUMNS[source] if col not in ('trade_time', 'ts_code')]
+        chunk_start = pd.Timestamp(start_time)
+        while chunk_start < pd.Timestamp(latest):
+            chunk_end = chunk_start + pd.Timedelta(days=CHUNK_DAYS)
+            df = read_5m_bars(engine, source, chunk_start.strftime('%Y-%m-%d %H:%M:%S'),
+                              chunk_end.strftime('%Y-%m-%d %H:%M:%S'))
+            if not df.empty:
+                bars = resample_bars(df, freq)
+                if not save_to_database(df=bars, table_name=target_table, conflict_columns=['trade_time', 'ts_code'],
+                                        data_type=f'{freq}重采样K线', engine=engine, update_columns=update_columns):
+                    return False
+            chunk_start = chunk_end
+        return True
+
+    except Exception as e:
+        logger.error(f"重采样 {freq} K线到 {target_table} 时出错: {str(e)}")
+        return False
+
+
+# ================================= 对账报告 =================================
+def reconcile(engine, source: str, freq: str, start_date: str, end_date: str, ts_codes: list = None,
+              downloaded_table: str = None) -> pd.DataFrame:
+    """
+    将5分钟K线合成的K线与已下载的同周期K线对账
+    Args:
+        downloaded_table: 下载K线表名，默认a_stock_{freq}_kline_wfq_{source}(不是合成K线的写入表)
+    Returns:
+        pd.DataFrame: 逐股票差异汇总，包含双方K线数量、单边缺失数量、价格/成交量不一致数量及最大偏差
+    """
+    downloaded_table = downloaded_table or DOWNLOADED_TABLE.format(freq=freq, source=source)
+    start_time = pd.to_datetime(start_date).strftime('%Y-%m-%d %H:%M:%S')
+    end_time = (pd.to_datetime(end_date) + pd.Timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+    derived = resample_bars(read_5m_bars(engine, source, start_time, end_time, ts_codes), freq)
+    query = f"""
+        SELECT trade_time, ts_code, open, high, low, close, volume, amount
+        FROM {downloaded_table}
+        WHERE trade_time > '{start_time}' AND trade_time <= '{end_time}'
+    """
+    if ts_codes:
+        codes = "', '".join(ts_codes)
+        query += f" AND ts_code IN ('{codes}')"
+    downloaded = pd.read_sql(query, engine)
+    price_columns = ['open', 'high', 'low', 'close']
+    value_columns = price_columns + ['volume', 'amount']
+    downloaded[value_columns] = downloaded[value_columns].apply(pd.to_numeric, errors='coerce')
+    downloaded['trade_time'] = pd.to_datetime(downloaded['trade_time'])
+
+    merged = derived[['trade_time', 'ts_code'] + value_columns].merge(
+        downloaded, on=['trade_time', 'ts_code'], how='outer', suffixes=('_derived', '_downloaded'), indicator=True)
+    both = merged['_merge'] == 'both'
+
+    price_diff = np.column_stack([
+        (merged[f'{col}_derived'] - merged[f'{col}_downloaded']).abs().to_numpy() for col in price_columns
+    ]).max(axis=1)
+    volume_base = merged['volume_downloaded'].abs().clip(lower=1)
+    volume_diff = ((merged['volume_derived'] - merged['volume_downloaded']).abs() / volume_base).to_numpy()
+
+    merged['n_derived'] = merged['_merge'] != 'right_only'
+    merged['n_downloaded'] = merged['_merge'] != 'left_only'
+    merged['only_derived'] = merged['_merge'] == 'left_only'
+    merged['only_downloaded'] = merged['_merge'] == 'right_only'
+    merged['price_mismatch'] = both & (price_diff > PRICE_TOL)
+    merged['volume_mismatch'] = both & (volume_diff > VOLUME_TOL)
+    merged['max_price_diff'] = np.where(both, price_diff, np.nan)
+    merged['max_volume_rel_diff'] = np.where(both, volume_diff, np.nan)
+
+    report = merged.groupby('ts_code').agg(
+        n_derived=('n_derived', 'sum'),
+        n_downloaded=('n_downloaded', 'sum'),
+        only_derived=('only_derived', 'sum'),
+        only_downloaded=('only_downloaded', 'sum'),
+        price_mismatch=('price_mismatch', 'sum'),
+        volume_mismatch=('volume_mismatch', 'sum'),
+        max_price_diff=('max_price_diff', 'max'),
+        max_volume_rel_diff=('max_volume_rel_diff', 'max'),
+    ).reset_index()
+    report['match_rate'] = 1 - (report['only_derived'] + report['only_downloaded'] + report['price_mismatch']
+                                + report['volume_mismatch']) / report[['n_derived', 'n_downloaded']].max(axis=1).clip(lower=1)
+    return report.sort_values('match_rate')
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='由5分钟K线重采样生成30m/60m/日K线')
+    parser.add_argument('--source', type=str, default='baostock', choices=list(SOURCE_COLUMNS), help='数据源')
+    parser.add_argument('--freq', type=str, nargs='+', default=['30m'], choices=['15m', '30m', '60m', '1day'], help='目标周期')
+    parser.add_argument('--mode', type=str, default='db', choices=['db', 'numpy'], help='聚合方式：数据库内或NumPy')
+    parser.add_argument('--target-table', type=str, help='合成K线写入表名，默认a_stock_{freq}_kline_wfq_{source}_resampled')
+    parser.add_argument('--downloaded-table', type=str, help='对账使用的下载K线表名，默认a_stock_{freq}_kline_wfq_{source}')
+    parser.add_argument('--reconcile', action='store_true', help='只做对账，不写入')
+    parser.add_argument('--start-date', type=str, help='对账开始日期 (YYYYMMDD)')
+    parser.add_argument('--end-date', type=str, help='对账结束日期 (YYYYMMDD)')
+    parser.add_argument('--stock', type=str, nargs='*', help='对账的股票代码，默认全部')
+    args = parser.parse_args()
+
+    setup_logger()
+    config = load_config()
+    engine = create_engine(get_pg_connection_string(config))
+
+    for freq in args.freq:
+        if args.reconcile:
+            start_date = args.start_date or (datetime.today() - timedelta(days=30)).strftime('%Y%m%d')
+            end_date = args.end_date or datetime.today().strftime('%Y%m%d')
+            report = reconcile(engine, args.source, freq, start_date, end_date, args.stock, args.downloaded_table)
+            output_file = f'kline_resample_reconcile_{args.source}_{freq}_{start_date}_{end_date}.csv'
+            report.to_csv(output_file, index=False, encoding='utf-8-sig')
+            total = report[['n_derived', 'n_downloaded', 'only_derived', 'only_downloaded',
+                            'price_mismatch', 'volume_mismatch']].sum()
+            logger.info(f"{freq} 对账完成: 股票 {len(report)} 只，合成 {total['n_derived']} 根，下载 {total['n_downloaded']} 根，"
+                        f"仅合成 {total['only_derived']}，仅下载 {total['only_downloaded']}，"
+                        f"价格不一致 {total['price_mismatch']}，成交量不一致 {total['volume_mismatch']}，报告已保存到 {output_file}")
+        else:
+            resample_incremental(engine, args.source, freq, args.mode, args.target_table)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+可断点续传的K线回补调度
+
+- 将一次回补拆分为 (任务, 股票, 日期区间) 工作单元，状态(pending/running/done/failed)持久化在 backfill_unit 表
+- 多个工作进程通过 FOR UPDATE SKIP LOCKED 领取单元，互不重复；每个单元下载、校验、入库后标记为done
+- 失败单元记录错误信息，在重试次数内自动重新领取；领取时设置租约并在下载期间后台续租，
+  进程崩溃遗留的running单元租约过期后被重新领取(领取/续租/接管与参数优化任务队列共用 lease_queue)
+- 重复执行同一命令即从中断处继续，已完成的单元不会重复下载
+
+用法:
+    python backfill_orchestrator.py --job baostock_5m_wfq --start-date 20200101 --workers 4
+    python backfill_orchestrator.py --job baostock_30m_wfq --start-date 20000101 --chunk-days 365
+    python backfill_orchestrator.py --job baostock_5m_wfq --status        # 查看进度
+    python backfill_orchestrator.py --job baostock_5m_wfq --retry-failed  # 重置已达重试上限的失败单元
+"""
+from common import *
+from kline_validator import validate_and_quarantine
+from lease_queue import LeaseKeeper, LeaseQueue
+import argparse
+import socket
+from multiprocessing import Pool
+
+
+# ================================= 定义初始变量 =================================
+UNIT_TABLE = 'backfill_unit'
+STOCK_LIST_FILE = '沪深A股_stock_list.csv'
+
+# 回补任务：目标表、数据源、周期及入库冲突时的更新列
+JOBS = {
+    'baostock_5m_wfq': {'table': 'a_stock_5m_kline_wfq_baostock', 'source': 'baostock', 'freq': '5m',
+                        'update_columns': None},
+    'baostock_30m_wfq': {'table': 'a_stock_30m_kline_wfq_baostock', 'source': 'baostock', 'freq': '30m',
+                         'update_columns': ['open', 'high', 'low', 'close', 'volume', 'amount', 'adjust_flag']},
+    'qmt_5m_wfq': {'table': 'a_stock_5m_kline_wfq_qmt', 'source': 'qmt', 'freq': '5m', 'update_columns': None},
+    'qmt_30m_wfq': {'table': 'a_stock_30m_kline_wfq_qmt', 'source': 'qmt', 'freq': '30m', 'update_columns': None},
+}
+
+# 优先接管租约过期的单元，其次新单元，最后可重试的失败单元；日期从近到远
+UNITS = LeaseQueue(UNIT_TABLE, scope='job', keys=['job', 'ts_code', 'start_date'],
+                   order_by='status DESC, start_date DESC, ts_code')
+
+
+# ================================= 工作单元表 =================================
+def create_table_if_not_exists(engine) -> None:
+    """创建工作单元状态表"""
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {UNIT_TABLE} (
+        job VARCHAR(50) NOT NULL,
+        ts_code VARCHAR(20) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        rows INTEGER,
+        worker VARCHAR(100),
+        lease_until TIMESTAMP,
+        last_error TEXT,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        PRIMARY KEY (job, ts_code, start_date)
+    );
+    CREATE INDEX IF NOT EXISTS idx_{UNIT_TABLE}_status ON {UNIT_TABLE} (job, status);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+        UNITS.add_lease_column(conn)
+
+def plan_units(engine, job: str, ts_codes: List[str], start_date: str, end_date: str, chunk_days: int) -> int:
+    """
+    按股票和日期区间切分工作单元并登记，已登记的单元保持原状态(可重复执行)
+    Returns:
+        int: 新登记的单元数
+    """
+    create_table_if_not_exists(engine)
+    starts = pd.date_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq=f'{chunk_days}D')
+    ends = np.minimum(starts + pd.Timedelta(days=chunk_days - 1), pd.to_datetime(end_date))
+    codes = np.repeat(np.asarray(ts_codes), len(starts))
+    units = pd.DataFrame({
+        'job': job,
+        'ts_code': codes,
+        'start_date': np.tile(starts.date, len(ts_codes)),
+        'end_date': np.tile(pd.DatetimeIndex(ends).date, len(ts_codes)),
+    })
+    tmp_table = f"tmp_{UNIT_TABLE}_plan"
+    insert_sql = f"""
+        INSERT INTO {UNIT_TABLE} (job, ts_code, start_date, end_date)
+        SELECT job, ts_code, start_date, end_date FROM {tmp_table}
+        ON CONFLICT (job, ts_code, start_date) DO NOTHING
+    """
+    with engine.connect() as conn:
+        before = conn.execute(text(f"SELECT COUNT(*) FROM {UNIT_TABLE} WHERE job = :job"), {'job': job}).scalar()
+    upsert_data(units, UNIT_TABLE, tmp_table, insert_sql, engine)
+    with engine.connect() as conn:
+        after = conn.execute(text(f"SELECT COUNT(*) FROM {UNIT_TABLE} WHERE job = :job"), {'job': job}).scalar()
+    logger.info(f"{job} 切分 {len(units)} 个工作单元，新登记 {after - before} 个")
+    return after - before
+
+def claim_unit(engine, job: str, worker: str, max_attempts: int, lease_seconds: int) -> Optional[tuple]:
+    """领取一个单元并设置租约，无可领取单元时返回None"""
+    row = UNITS.claim(engine, job, worker, max_attempts, lease_seconds, ['ts_code', 'start_date', 'end_date'])
+    if row is None:
+        return None
+    return row[0], row[1].strftime('%Y%m%d'), row[2].strftime('%Y%m%d')
+
+def unit_key(job: str, ts_code: str, start_date: str) -> dict:
+    return {'job': job, 'ts_code': ts_code, 'start_date': pd.to_datetime(start_date).date()}
+
+def finish_unit(engine, job: str, ts_code: str, start_date: str, worker: str, rows: int = None, error: str = None) -> bool:
+    """标记单元完成或失败，返回False表示租约已被其他工作进程接管"""
+    with engine.begin() as conn:
+        return UNITS.finish(conn, unit_key(job, ts_code, start_date), worker, error, {'rows': rows})
+
+def get_progress(engine, job: str) -> pd.DataFrame:
+    """按状态汇总单元数、行数和重试次数"""
+    return pd.read_sql(text(f"""
+        SELECT status, COUNT(*) AS units, COALESCE(SUM(rows), 0) AS rows, MAX(attempts) AS max_attempts
+        FROM {UNIT_TABLE} WHERE job = :job GROUP BY status ORDER BY status
+    """), engine, params={'job': job})
+
+
+# ================================= 数据下载 =================================
+def fetch_baostock_kline(ts_code: str, start_date: str, end_date: str, freq: str) -> pd.DataFrame:
+    """下载baostock不复权分钟K线，列顺序与wfq_baostock表一致；接口报错时抛出异常以便重试"""
+    import baostock as bs
+    rs = bs.query_history_k_data_plus(
+        code=convert_to_baostock_code(ts_code),
+        fields="date,time,code,open,high,low,close,volume,amount,adjustflag",
+        start_date=convert_date_format(start_date),
+        end_date=convert_date_format(end_date),
+        frequency=str(BAR_MINUTES[freq]),
+        adjustflag="3"
+    )
+    if rs.error_code != '0':
+        raise RuntimeError(f"baostock返回错误: {rs.error_msg}")
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        data_list.append(rs.get_row_data())
+    if rs.error_code != '0':
+        raise RuntimeError(f"baostock返回错误: {rs.error_msg}")
+    if not data_list:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(data_list, columns=rs.fields)
+    df['ts_code'] = df['code'].apply(convert_to_tushare_code)
+    df['trade_time'] = pd.to_datetime(df['date'] + ' ' + df['time'].apply(format_time), format='%Y-%m-%d %H:%M:%S')
+    df = df.rename(columns={'adjustflag': 'adjust_flag'})
+    numeric_columns = ['open', 'high', 'low', 'close', 'volume', 'amount']
+    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric)
+    df['adjust_flag'] = df['adjust_flag'].astype(int)
+    return df[['trade_time', 'ts_code', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjust_flag']]
+
+def fetch_qmt_kline(ts_code: str, start_date: str, end_date: str, freq: str) -> pd.DataFrame:
+    """下载并读取QMT本地不复权分钟K线，列顺序与wfq_qmt表一致"""
+    from xtquant import xtdata
+    xtdata.enable_hello = False
+    xtdata.download_history_data(ts_code, period=freq, start_time=start_date, end_time=end_date)
+    data = xtdata.get_local_data(stock_list=[ts_code], period=freq, start_time=start_date,
+                                 end_time=f"{end_date}235959", dividend_type='none')
+    df = data.get(ts_code)
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    df = df.copy()
+    df['ts_code'] = ts_code
+    df['trade_time'] = qmt_time_to_datetime(df['time']).to_numpy()
+    df = df.rename(columns={
+        'settelementPrice': 'settelement_price',
+        'openInterest': 'open_interest',
+        'preClose': 'pre_close',
+        'suspendFlag': 'suspend_flag'
+    })
+    numeric_columns = ['open', 'high', 'low', 'close', 'volume', 'amount', 'settelement_price', 'open_interest', 'pre_close']
+    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
+    df['suspend_flag'] = df['suspend_flag'].astype(bool)
+    return df[['trade_time', 'ts_code', 'open', 'high', 'low', 'close', 'volume', 'amount',
+               'settelement_price', 'open_interest', 'pre_close', 'suspend_flag']].reset_index(drop=True)
+
+FETCHERS = {'baostock': fetch_baostock_kline, 'qmt': fetch_qmt_kline}
+
+
+# ================================= 工作进程 =================================
+def run_worker(job: str, worker_no: int, max_attempts: int, lease_seconds: int) -> int:
+    """工作进程主循环：领取单元 -> 下载 -> 校验 -> 入库 -> 标记状态，直到没有可领取的单元"""
+    setup_logger()
+    spec = JOBS[job]
+    engine = create_engine(get_pg_connection_string(load_config()))
+    worker = f"{socket.gethostname()}:{os.getpid()}:{worker_no}"
+    fetch = FETCHERS[spec['source']]
+    if spec['source'] == 'baostock':
+        import baostock as bs
+        bs.login()
+
+    done = 0
+    try:
+        while True:
+            unit = claim_unit(engine, job, worker, max_attempts, lease_seconds)
+            if unit is None:
+                UNITS.fail_expired(engine, job, max_attempts)
+                break
+            ts_code, start_date, end_date = unit
+            rows, error = None, None
+            with LeaseKeeper(UNITS, engine, unit_key(job, ts_code, start_date), worker, lease_seconds):
+                try:
+                    df = fetch(ts_code, start_date, end_date, spec['freq'])
+                    if not df.empty:
+                        df, _ = validate_and_quarantine(df, spec['table'], spec['freq'], engine)
+                        if not save_to_database(df=df, table_name=spec['table'], conflict_columns=['trade_time', 'ts_code'],
+                                                engine=engine, update_columns=spec['update_columns']):
+                            raise RuntimeError("写入数据库失败")
+                    rows = len(df)
+                except Exception as e:
+                    logger.error(f"{job} {ts_code} {start_date}-{end_date} 执行失败: {str(e)}")
+                    error = str(e)[:2000]
+            if not finish_unit(engine, job, ts_code, start_date, worker, rows, error):
+                logger.warning(f"{job} {ts_code} {start_date} 租约已被其他工作进程接管，不更新状态")
+            elif error is None:
+                done += 1
+    finally:
+        if spec['source'] == 'baostock':
+            bs.logout()
+    return done
+
+def run_backfill(engine, job: str, workers: int, max_attempts: int, lease_seconds: int, poll_seconds: int = 10) -> None:
+    """启动工作进程并定期输出进度，全部单元完成或达到重试上限后返回"""
+    total = int(get_progress(engine, job)['units'].sum())
+    with Pool(processes=workers) as pool:
+        result = pool.starmap_async(run_worker, [(job, i, max_attempts, lease_seconds) for i in range(workers)])
+        with tqdm(total=total, desc=f'{job} 回补进度') as pbar:
+            while True:
+                result.wait(poll_seconds)
+                progress = get_progress(engine, job).set_index('status')['units']
+                pbar.n = int(progress.get('done', 0))
+                pbar.set_postfix(running=int(progress.get('running', 0)), failed=int(progress.get('failed', 0)))
+                pbar.refresh()
+                if result.ready():
+                    break
+        result.get()
+    logger.info(f"{job} 本轮结束，单元状态:\n{get_progress(engine, job).to_string(index=False)}")
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='可断点续传的K线回补')
+    parser.add_argument('--job', type=str, required=True, choices=list(JOBS), help='回补任务')
+    parser.add_argument('--start-date', type=str, help='开始日期 (YYYYMMDD)，提供时按区间切分并登记工作单元')
+    parser.add_argument('--end-date', type=str, default=datetime.today().strftime('%Y%m%d'), help='结束日期 (YYYYMMDD)')
+    parser.add_argument('--ts-codes', type=str, nargs='*', help='股票代码，默认读取沪深A股股票列表')
+    parser.add_argument('--chunk-days', type=int, default=180, help='每个工作单元覆盖的自然日天数')
+    parser.add_argument('--workers', type=int, default=4, help='并发工作进程数')
+    parser.add_argument('--max-attempts', type=int, default=3, help='每个单元的最大尝试次数')
+    parser.add_argument('--stale-minutes', type=int, default=30,
+                        help='单元租约时长(分钟)，工作进程每1/3租约续租一次，崩溃遗留的running单元租约过期后被重新领取')
+    parser.add_argument('--retry-failed', action='store_true', help='重置已达重试上限的失败单元')
+    parser.add_argument('--status', action='store_true', help='只查看进度')
+    args = parser.parse_args()
+
+    setup_logger()
+    config = load_config()
+    engine = create_engine(get_pg_connection_string(config))
+    create_table_if_not_exists(engine)
+
+    if args.status:
+        logger.info(f"{args.job} 单元状态:\n{get_progress(engine, args.job).to_string(index=False)}")
+        return
+    if args.start_date:
+        ts_codes = args.ts_codes or pd.read_csv(STOCK_LIST_FILE, header=None, names=['ts_code'])['ts_code'].tolist()
+        plan_units(engine, args.job, ts_codes, args.start_date, args.end_date, args.chunk_days)
+    if args.retry_failed:
+        logger.info(f"{args.job} 重置 {UNITS.reset_failed(engine, args.job)} 个失败单元")
+    run_backfill(engine, args.job, args.workers, args.max_attempts, args.stale_minutes * 60)
+
+if __name__ == '__main__':
+    main()
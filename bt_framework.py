@@ -0,0 +1,919 @@
+# -*- coding: utf-8 -*-
+"""
+回测优化框架：策略 = 指标预计算 + 撮合引擎 + 目标函数 + 参数搜索，各bt_*脚本对应一个配置
+
+bt_ha_supertrend_mult_tscode / _optimized / _calmar_optimization / _mult_tscode_slope_optimization / _single 和
+bt_ma_adx_mult_tscode 原先各自实现了数据读取、HA/SuperTrend、数据源类、基准读取和指标计算，本模块把这些环节统一为可替换的部件，
+各脚本只保留模块级参数和命令行，由参数生成配置后调用 optimize_stock / run_config：
+- 指标预计算(INDICATORS)  HA只算一次，SuperTrend方向按(周期, 乘数)缓存并批量计算；均线按窗口、ADX按周期缓存
+- 撮合引擎(SIMULATORS)    cerebro 逐K线事件驱动，vector 数组撮合(与cerebro逐笔一致)
+- 目标函数(OBJECTIVES)    score / calmar / annualized_slope / sharpe / 胜率+盈亏比 / backtrader分析器综合评分，
+                          全部按列批量计算，一次对一批参数组合评分
+- 参数搜索(SEARCHES)      grid 全网格、ga 遗传算法(pymoo)、deap 遗传算法(MA+ADX原脚本的DEAP算子)、nsga2 多目标、
+                          bayes 高斯过程UCB，每代/每批参数一次批量评估；
+                          halving / hyperband 逐轮淘汰：先在最近一小段K线上评估全部候选，只把排名前1/eta的组合
+                          放到eta倍长的历史上继续评估，最后一轮为全历史，结果表格式不变
+- 数据与基准              K线优先读共享内存行情，基准每个进程只读一次；评估缓存、结果记录、报告生成、阶段计时沿用各模块
+
+配置(CONFIGS)只包含数据(区间、参数空间、部件名、算法参数)，可序列化，作为结果记录的配置哈希；
+可选的 max_drawdown 为全历史最大回撤上限(如0.5)，超限的参数组合目标值记为-inf；grid 搜索时按 GRID_STAGES
+先在逐步加长的历史前段上回测，前段回撤已超限的组合直接剪枝(回撤随历史加长只会变大，不会丢掉最优解)，只有剩余组合回测全历史；
+多股票时父进程载入共享行情，进程池逐只股票优化，结果写入 reports/results/{配置}_*.jsonl，可 --resume 续跑；
+运行名(结果记录、收益序列、报告)、结果表路径、列名和报告标题与各脚本原先的输出一致(配置中的 output / columns / report_title)
+
+用法:
+    python bt_framework.py --list
+    python bt_framework.py --config ha_st_mult_tscode --engine vector --processes 8
+    python bt_framework.py --config ha_st_calmar --stock 600000.SH 000001.SZ
+    python bt_framework.py --config ma_adx_mult_tscode --search grid --resume --profile
+    python bt_framework.py --config ha_st_mult_tscode --search halving
+"""
+from common import *
+import argparse
+import itertools
+import random
+import multiprocessing as mp
+from functools import partial
+from vector_backtest import (INITIAL_CASH, COMMISSION, POSITION_RATIO, ENGINES, simulate_signals, time_return_matrix,
+                             recent_start, entry_exit_returns, run_cerebro_backtest, run_cerebro_entry_exit)
+from perf_metrics import aggregate_daily_returns, compute_metrics, ha_st_score, metrics_report
+from eval_cache import data_version, open_store
+from strategy_indicators import HaSupertrendIndicators, MaAdxIndicators
+from panel_backtest import get_benchmark_returns
+from shared_market_data import SharedMarketData, attach_shared_data, get_kline
+from report_store import CODE_COLUMNS, REPORT_TOP_N, render_top_reports, save_returns
+from result_sink import ResultSink, config_hash
+
+
+# ================================= 定义初始变量 =================================
+MAX_PROCESSES = max(1, mp.cpu_count() - 1)
+EVAL_CHUNK = 200        # 一次批量回测的参数组数，内存约为 K线数 × 组数 × 8字节
+GRID_STAGES = (0.25, 0.5, 1.0)  # 设置max_drawdown时全网格按最早的这些比例的历史分阶段回测，回撤已超限的组合提前剪枝
+OPTION_KEYS = ('indicator_options', 'simulator_options', 'metrics_options')  # 计入评估缓存策略名的部件参数
+MIN_DAYS = 30           # sharpe目标要求的最少交易日，与MA+ADX优化脚本一致
+OUTPUT_DIR = 'reports'
+INDEX_UNIVERSE = ['上证50_stock_list.csv', '沪深300_stock_list.csv', '中证500_stock_list.csv', '中证1000_stock_list.csv']
+
+BASE_CONFIG = {
+    'start_date': '2000-01-01',
+    'end_date': '2024-12-31',
+    'fq_code': 'wfq',
+    'universe': ['沪深A股_stock_list.csv'],   # 股票列表文件，或在stocks中直接指定
+    'stocks': None,
+    'engine': 'cerebro',
+    'indicator_options': {},
+    'simulator_options': {},
+    'search_options': {},
+    'metrics_options': {},        # 结果指标(metrics_report)的参数，如MA+ADX的夏普按252年化
+    'calendar_days': False,       # 日收益是否补齐自然日(无交易日收益为0)
+    'align_benchmark': False,     # 评分前是否先与基准日期对齐
+    'sort_by': 'sharpe',          # 结果表的排序列，None保持股票列表顺序
+    'report_by': None,            # 选取前N名生成报告的列，None同sort_by
+    'report_title': '{code} 策略回测报告 (基准: 沪深300)',
+    'extra_metrics': None,        # 结果中附加的指标(EXTRA_METRICS)
+    'columns': {},                # 结果列改名(原脚本的列名)，改为None的列不输出
+    'output': None,               # 结果表路径(相对当前目录，与原脚本一致)
+}
+
+# 各脚本对应的配置，参数空间与算法参数取自原脚本
+CONFIGS = {
+    'ha_st_mult_tscode': {
+        'strategy': 'ha_supertrend',
+        'space': {'supertrend_period': np.arange(10, 110, 10), 'supertrend_multiplier': np.arange(1, 11, 1)},
+        'objective': 'score',
+        'search': 'ga',
+        'search_options': {'pop_size': 20, 'n_gen': 10},
+        'calendar_days': True,
+        'align_benchmark': True,
+        'extra_metrics': 'smoothness',
+        'columns': {'supertrend_period': 'period', 'supertrend_multiplier': 'multiplier', 'opt_score': 'optimization_score'},
+        'output': 'Heikin_Ashi_SuperTrend_Metrics.csv',
+    },
+    'ha_st_calmar': {
+        'strategy': 'ha_supertrend',
+        'end_date': '2025-03-01',
+        'universe': INDEX_UNIVERSE,
+        'space': {'supertrend_period': np.arange(8, 168, 8), 'supertrend_multiplier': np.arange(2, 7.5, 0.5)},
+        'objective': 'calmar',
+        'search': 'bayes',
+        'search_options': {'n_iterations': 50, 'n_candidates': 200, 'kappa': 1.5},
+        'sort_by': 'calmar',
+        'report_title': '{code} 策略回测报告(基准:沪深300)',
+        'columns': {'stock_code': 'ts_code', 'supertrend_period': 'period', 'supertrend_multiplier': 'multiplier',
+                    'opt_calmar': None},
+        'output': os.path.join('reports', 'Heikin_Ashi_SuperTrend_Metrics.csv'),
+    },
+    'ha_st_slope': {
+        'strategy': 'ha_supertrend',
+        'universe': INDEX_UNIVERSE,
+        'space': {'supertrend_period': np.arange(8, 88, 8), 'supertrend_multiplier': np.arange(2, 7, 1)},
+        'objective': 'slope',
+        'search': 'grid',
+        'metrics_options': {'sharpe_periods': 252},
+        'sort_by': None,
+        'report_by': 'annualized_slope',
+        'extra_metrics': 'slope',
+        'columns': {'stock_code': 'ts_code', 'supertrend_period': 'period', 'supertrend_multiplier': 'multiplier',
+                    'opt_annualized_slope': None},
+        'output': 'Heikin_Ashi_SuperTrend_Metrics.csv',
+    },
+    'ha_st_optimized': {
+        'strategy': 'ha_supertrend',
+        'end_date': '2025-02-10',
+        'stocks': ['601127.SH'],
+        'space': {'supertrend_period': np.arange(8, 88, 8), 'supertrend_multiplier': np.arange(2, 7, 1)},
+        'objective': 'win_rate_profit_factor',
+        'search': 'nsga2',
+        'search_options': {'pop_size': 20, 'n_offsprings': 10, 'n_gen': 10},
+        'align_benchmark': True,
+        'columns': {'supertrend_period': 'period', 'supertrend_multiplier': 'multiplier',
+                    'opt_win_rate': None, 'opt_profit_factor': None},
+        'output': os.path.join('reports', 'Heikin_Ashi_SuperTrend_NSGA2_Metrics.csv'),
+    },
+    'ha_st_single': {
+        'strategy': 'ha_supertrend',
+        'fq_code': 'qfq',
+        'stocks': ['600000.SH'],
+        # backtrader自定义SuperTrend：HA开盘价以首根开盘价为种子，HA价格成交
+        'indicator_options': {'ha_seed': 'open', 'band': 'backtrader', 'trade_prices': 'ha'},
+        'space': {'supertrend_period': np.arange(10, 51, 10), 'supertrend_multiplier': np.arange(2.0, 7.0, 1.0)},
+        'objective': 'bt_composite',
+        'search': 'grid',
+        'report_title': '{code} 回测报告',
+        'output': os.path.join('reports', 'Heikin_Ashi_SuperTrend_Single_Metrics.csv'),
+    },
+    'ma_adx_mult_tscode': {
+        'strategy': 'ma_adx',
+        'space': {'fast_ma': np.arange(5, 35, 5), 'slow_ma': np.arange(10, 70, 10),
+                  'adx_period': np.arange(10, 35, 5), 'adx_threshold': np.arange(20, 45, 5)},
+        'simulator_options': {'stop_loss_pct': 0.05, 'take_profit_pct': 0.20},
+        'metrics_options': {'sharpe_periods': 252},
+        'objective': 'sharpe',
+        'search': 'deap',
+        'search_options': {'pop_size': 50, 'n_gen': 20, 'cxpb': 0.8, 'mutpb': 0.2, 'tournsize': 3},
+        'sort_by': None,
+        'report_by': 'sharpe',
+        'report_title': '{code} MA+ADX策略回测报告 (基准: 沪深300)',
+        'columns': {'opt_sharpe': None},
+        'output': 'MA_ADX_Strategy_Metrics.csv',
+    },
+}
+
+# 数据库连接与基准收益按进程缓存
+_ENGINE = None
+_BENCHMARK = {}
+
+
+def get_config(name: str, **overrides) -> dict:
+    """合并默认值、脚本配置与命令行覆盖项，返回完整配置"""
+    config = {**BASE_CONFIG, **CONFIGS[name], 'name': name}
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+# ================================= 数据与基准 =================================
+def get_engine():
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = create_engine(get_pg_connection_string(load_config()))
+    return _ENGINE
+
+def load_bars(ts_code: str, start_date: str, end_date: str, fq_code: str = 'wfq') -> Optional[pd.DataFrame]:
+    """30分钟K线(优先共享行情)，以trade_time为索引，无数据返回None"""
+    df = get_kline(fq_code, ts_code, start_date, end_date)
+    if df is None or df.empty:
+        return None
+    df['trade_time'] = pd.to_datetime(df['trade_time'])
+    return df.set_index('trade_time')
+
+def load_benchmark_returns(start_date: str, end_date: str) -> pd.Series:
+    """沪深300日收益(优先共享行情)，同一进程内只读取一次"""
+    key = (start_date, end_date)
+    if key not in _BENCHMARK:
+        _BENCHMARK[key] = get_benchmark_returns(start_date, end_date, get_engine())
+    return _BENCHMARK[key]
+
+def load_universe(config: dict) -> List[str]:
+    """配置中的股票：stocks优先，否则合并universe中的股票列表文件并去重"""
+    if config.get('stocks'):
+        return list(config['stocks'])
+    frames = [pd.read_csv(path, header=None, names=['ts_code']) for path in config['universe']]
+    return pd.concat(frames)['ts_code'].drop_duplicates().tolist()
+
+def align_with_benchmark(daily_returns, benchmark_returns: pd.Series) -> tuple:
+    """日收益(Series或按列的DataFrame)与基准按日期对齐，去除基准或收益为NaN的日期"""
+    dates = daily_returns.index.intersection(benchmark_returns.index)
+    daily_returns = daily_returns.loc[dates]
+    benchmark_returns = benchmark_returns.loc[dates]
+    missing = daily_returns.isna() if daily_returns.ndim == 1 else daily_returns.isna().any(axis=1)
+    valid = (benchmark_returns.notna() & ~missing).to_numpy()
+    return daily_returns[valid].astype(float), benchmark_returns[valid].astype(float)
+
+
+# ================================= 撮合引擎 =================================
+def simulate_direction_vector(indicators, signals: dict, initial_cash: float = INITIAL_CASH,
+                              commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> pd.DataFrame:
+    """SuperTrend方向信号的数组撮合(vector_backtest.simulate_signals)，逐列回测"""
+    equity = np.empty(signals['direction'].shape)
+    for k, direction in enumerate(signals['direction'].T):
+        cash, position, _ = simulate_signals(indicators.trade_open, indicators.trade_close, direction,
+                                             initial_cash, commission, position_ratio)
+        equity[:, k] = cash + position * indicators.trade_close
+    return time_return_matrix(indicators.index, equity, initial_cash)
+
+def simulate_direction_cerebro(indicators, signals: dict, initial_cash: float = INITIAL_CASH,
+                               commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> pd.DataFrame:
+    """SuperTrend方向信号逐列用Cerebro回测(vector_backtest.run_cerebro_backtest)"""
+    columns = []
+    for direction in signals['direction'].T:
+        df = pd.DataFrame({'open': indicators.trade_open, 'close': indicators.trade_close, 'direction': direction},
+                          index=indicators.index)
+        columns.append(run_cerebro_backtest(df, initial_cash, commission, position_ratio)['returns'])
+    return pd.concat(columns, axis=1, keys=range(len(columns)))
+
+def simulate_entry_exit_vector(indicators, signals: dict, stop_loss_pct: float = 0.05, take_profit_pct: float = 0.20,
+                               initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                               position_ratio: float = POSITION_RATIO) -> pd.DataFrame:
+    """开仓/平仓条件 + 固定比例止损止盈的数组撮合(vector_backtest.entry_exit_returns)"""
+    df = pd.DataFrame({'open': indicators.trade_open, 'close': indicators.trade_close}, index=indicators.index)
+    return entry_exit_returns(df, signals['entry'], signals['exit'], stop_loss_pct, take_profit_pct,
+                              initial_cash, commission, position_ratio)
+
+def simulate_entry_exit_cerebro(indicators, signals: dict, stop_loss_pct: float = 0.05, take_profit_pct: float = 0.20,
+                                initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                                position_ratio: float = POSITION_RATIO) -> pd.DataFrame:
+    """开仓/平仓条件 + 固定比例止损止盈逐列用Cerebro回测(vector_backtest.run_cerebro_entry_exit)"""
+    df = pd.DataFrame({'open': indicators.trade_open, 'close': indicators.trade_close}, index=indicators.index)
+    columns = [run_cerebro_entry_exit(df, entry, exit_, stop_loss_pct, take_profit_pct, initial_cash, commission,
+                                      position_ratio)['returns']
+               for entry, exit_ in zip(signals['entry'].T, signals['exit'].T)]
+    return pd.concat(columns, axis=1, keys=range(len(columns)))
+
+
+# ================================= 目标函数(越大越好，按列批量计算) =================================
+def score_objective(daily: pd.DataFrame) -> pd.DataFrame:
+    """HA SuperTrend多股票优化的综合评分"""
+    return ha_st_score(daily)[['score']]
+
+def calmar_objective(daily: pd.DataFrame) -> pd.DataFrame:
+    return compute_metrics(daily)[['calmar']]
+
+def slope_objective(daily: pd.DataFrame) -> pd.DataFrame:
+    """累计收益率对交易日序号的线性回归斜率 × 252"""
+    cumulative = np.cumprod(1.0 + daily.to_numpy(dtype=float), axis=0) - 1.0
+    x = np.arange(len(cumulative), dtype=float)
+    x -= x.mean() if len(x) else 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = x @ (cumulative - cumulative.mean(axis=0)) / (x @ x)
+    return pd.DataFrame({'annualized_slope': slope * 252}, index=daily.columns)
+
+def sharpe_objective(daily: pd.DataFrame) -> pd.DataFrame:
+    """年化夏普(252期)，交易日不足MIN_DAYS为-inf"""
+    table = compute_metrics(daily, sharpe_periods=252)[['sharpe']].copy()
+    table.loc[(daily.notna().sum() < MIN_DAYS).to_numpy(), 'sharpe'] = -np.inf
+    return table
+
+def win_rate_profit_factor_objective(daily: pd.DataFrame) -> pd.DataFrame:
+    """NSGA2双目标：胜率与盈亏比"""
+    return compute_metrics(daily)[['win_rate', 'profit_factor']]
+
+def bt_composite_objective(daily: pd.DataFrame, riskfreerate: float = 0.01, tann: int = 252) -> pd.DataFrame:
+    """
+    bt_ha_supertrend_single 的评分 sharpe*0.5 - drawdown*0.3 + rnorm100*0.2，
+    sharpe为年度收益口径(SharpeRatio默认参数)，rnorm100同Returns分析器；回撤按日末资产计算
+    """
+    rows = []
+    for column in daily.columns:
+        r = daily[column].dropna().to_numpy(dtype=float)
+        if not len(r):
+            rows.append(np.nan)
+            continue
+        values = INITIAL_CASH * np.cumprod(1.0 + r)
+        years = daily[column].dropna().index.year.to_numpy()
+        last = np.r_[np.flatnonzero(years[1:] != years[:-1]), len(years) - 1]
+        year_value = values[last]
+        ret_free = year_value / np.r_[INITIAL_CASH, year_value[:-1]] - 1.0 - riskfreerate
+        retdev = math.sqrt(np.mean((ret_free - ret_free.mean()) ** 2))
+        sharpe = ret_free.mean() / retdev if retdev else np.nan
+        peak = np.maximum.accumulate(np.maximum(values, INITIAL_CASH))
+        drawdown = float(np.max(100.0 * (peak - values) / peak))
+        ratio = values[-1] / INITIAL_CASH
+        rnorm100 = math.expm1(math.log(ratio) / len(r) * tann) * 100.0 if ratio > 0 else -np.inf
+        rows.append(sharpe * 0.5 - drawdown * 0.3 + rnorm100 * 0.2)
+    return pd.DataFrame({'bt_composite': rows}, index=daily.columns)
+
+
+# ================================= 部件注册 =================================
+STRATEGIES = {
+    'ha_supertrend': {
+        'indicators': HaSupertrendIndicators,
+        'simulators': {'vector': simulate_direction_vector, 'cerebro': simulate_direction_cerebro},
+        'constraint': None,
+        'returns_name': 'SuperTrend',
+    },
+    'ma_adx': {
+        'indicators': MaAdxIndicators,
+        'simulators': {'vector': simulate_entry_exit_vector, 'cerebro': simulate_entry_exit_cerebro},
+        'constraint': lambda grid: grid['fast_ma'] < grid['slow_ma'],
+        'returns_name': 'MA_ADX',
+    },
+}
+
+OBJECTIVES = {
+    'score': score_objective,
+    'calmar': calmar_objective,
+    'slope': slope_objective,
+    'sharpe': sharpe_objective,
+    'win_rate_profit_factor': win_rate_profit_factor_objective,
+    'bt_composite': bt_composite_objective,
+}
+
+# 各目标函数输出的列(多目标时依次为各目标)
+OBJECTIVE_COLUMNS = {
+    'score': ['score'],
+    'calmar': ['calmar'],
+    'slope': ['annualized_slope'],
+    'sharpe': ['sharpe'],
+    'win_rate_profit_factor': ['win_rate', 'profit_factor'],
+    'bt_composite': ['bt_composite'],
+}
+
+
+# ================================= 附加指标(原脚本结果表中的列) =================================
+def smoothness_metrics(daily: pd.Series, result: dict) -> dict:
+    """bt_ha_supertrend_mult_tscode 的平滑度指标：平均/最长连续上涨天数、下行波动率、上涨/下跌比值"""
+    row = ha_st_score(daily).iloc[0]
+    return {name: row[name] for name in ['avg_up_days', 'max_up_days', 'downside_vol', 'trend_strength']}
+
+def slope_metrics(daily: pd.Series, result: dict) -> dict:
+    """bt_ha_supertrend_mult_tscode_slope_optimization 的斜率与年化斜率"""
+    return {'slope': result['opt_annualized_slope'] / 252, 'annualized_slope': result['opt_annualized_slope']}
+
+EXTRA_METRICS = {
+    'smoothness': smoothness_metrics,
+    'slope': slope_metrics,
+}
+
+
+# ================================= 回测器 =================================
+class BarWindow:
+    """指标对象一段K线[start:end]的视图(时间索引与成交价)，供撮合引擎只回测这一段"""
+
+    def __init__(self, indicators, start: int, end: int = None):
+        self.index = indicators.index[start:end]
+        self.trade_open = indicators.trade_open[start:end]
+        self.trade_close = indicators.trade_close[start:end]
+
+
+class Backtester:
+    """
+    绑定到(配置, 股票)的回测器：指标缓存、撮合引擎、目标函数和评估缓存
+    evaluate对一批参数组合返回目标值矩阵，缓存命中的组合不再回测
+    """
+
+    def __init__(self, config: dict, ts_code: str, bars: pd.DataFrame, benchmark_returns: pd.Series,
+                 use_cache: bool = True):
+        strategy = STRATEGIES[config['strategy']]
+        self.config = config
+        self.ts_code = ts_code
+        self.benchmark_returns = benchmark_returns
+        self.param_names = list(config['space'])
+        self.constraint = strategy['constraint']
+        self.simulator = strategy['simulators'][config['engine']]
+        self.objective = OBJECTIVES[config['objective']]
+        self.objective_names = OBJECTIVE_COLUMNS[config['objective']]
+        self.max_drawdown = config.get('max_drawdown')
+        self.evaluated = []     # 搜索中在全历史上评估过的参数(按评估顺序，含缓存命中)
+        with profile_stage('indicators_init'):
+            self.indicators = strategy['indicators'](bars, **config['indicator_options'])
+        # 撮合引擎不影响结果(两者逐笔一致)，不计入缓存策略名；回撤上限和指标/撮合/指标报告参数改变目标值，计入策略名
+        store_name = f"fw_{config['name']}_{config['objective']}_v2"
+        if self.max_drawdown is not None:
+            store_name += f"_dd{self.max_drawdown}"
+        store_name += '_' + config_hash({key: config[key] for key in OPTION_KEYS})[:8]
+        self.store = open_store(store_name, ts_code, data_version(bars, benchmark_returns), use_cache)
+
+    def valid(self, grid: pd.DataFrame) -> np.ndarray:
+        return np.ones(len(grid), dtype=bool) if self.constraint is None else self.constraint(grid).to_numpy()
+
+    def daily_returns(self, grid: pd.DataFrame, fidelity: float = 1.0, prefix: float = 1.0) -> pd.DataFrame:
+        """
+        一批参数组合的日收益，列顺序与grid的行相同
+        fidelity<1时只回测最近该比例的K线(指标仍在全历史上计算，窗口起点已过预热期)，从空仓开始；
+        prefix<1时只回测最早该比例的K线(网格搜索分阶段剪枝)；
+        指标给出valid时(MA+ADX)每个组合从其指标有效的第一根K线开始回测，之前的日期为NaN，
+        与原脚本去除指标为NaN的K线后回测一致，没有有效K线的组合整列为NaN
+        """
+        with profile_stage('signals'):
+            signals = self.indicators.signals(grid)
+        indicators = self.indicators
+        start = recent_start(self.indicators.index, fidelity)
+        end = int(len(self.indicators.index) * prefix) if prefix < 1 else None
+        if start or end is not None:
+            indicators = BarWindow(self.indicators, start, end)
+            signals = {name: values[start:end] for name, values in signals.items()}
+        valid = signals.pop('valid', None)
+        n_bars = len(indicators.index)
+        if valid is None:
+            first = np.zeros(len(grid), dtype=int)
+        else:
+            first = np.where(valid.any(axis=0), valid.argmax(axis=0), n_bars)
+
+        frames = []
+        for offset in np.unique(first[first < n_bars]):
+            columns = np.flatnonzero(first == offset)
+            window = BarWindow(indicators, offset) if offset else indicators
+            part = {name: values[offset:] if len(columns) == len(grid) else values[offset:, columns]
+                    for name, values in signals.items()}
+            with profile_stage('simulate'):
+                returns = self.simulator(window, part, **self.config['simulator_options'])
+            with profile_stage('daily_returns'):
+                daily = aggregate_daily_returns(returns, calendar_days=self.config['calendar_days'])
+                daily.columns = columns
+            frames.append(daily)
+        with profile_stage('daily_returns'):
+            if len(frames) == 1 and len(frames[0].columns) == len(grid):
+                daily = frames[0]
+            elif frames:
+                daily = pd.concat(frames, axis=1).reindex(columns=range(len(grid)))
+            else:
+                daily = pd.DataFrame(np.nan, index=pd.DatetimeIndex(indicators.index[:1].normalize()),
+                                     columns=range(len(grid)))
+            if self.config['align_benchmark']:
+                daily, _ = align_with_benchmark(daily, self.benchmark_returns)
+        return daily
+
+    def evaluate(self, grid: pd.DataFrame, fidelity: float = 1.0, record: bool = True) -> pd.DataFrame:
+        """
+        返回每组参数的目标值(越大越好)，违反约束、全历史回撤超过max_drawdown或无法计算的为-inf；缓存命中的组合不再回测
+        fidelity<1时为最近一段历史上的目标值(不检查回撤上限)，缓存键中带上fidelity，与全历史的结果分开；
+        record为True时全历史评估的参数记入evaluated(搜索结束后重新读取目标值时为False)
+        """
+        grid = grid.reset_index(drop=True)
+        values = np.full((len(grid), len(self.objective_names)), -np.inf)
+        records = [self.params_at(grid, i) for i in range(len(grid))]
+        keys = records if fidelity >= 1 else [{**params, 'fidelity': round(fidelity, 6)} for params in records]
+        todo = []
+        valid = np.flatnonzero(self.valid(grid))
+        if record and fidelity >= 1:
+            self.evaluated.extend(records[i] for i in valid)
+        for i in valid:
+            cached = self.store.get(keys[i]) if self.store else None
+            if cached is None:
+                todo.append(i)
+            else:
+                values[i] = cached[0]
+                profile_count('cache_hits')
+
+        for start in range(0, len(todo), EVAL_CHUNK):
+            chunk = todo[start:start + EVAL_CHUNK]
+            profile_count('backtests', len(chunk))
+            daily = self.daily_returns(grid.iloc[chunk], fidelity)
+            with profile_stage('objective'):
+                scores = self.objective(daily)[self.objective_names].to_numpy(dtype=float, copy=True)
+                if self.max_drawdown is not None and fidelity >= 1:
+                    drawdown = compute_metrics(daily)['max_drawdown'].to_numpy(dtype=float)
+                    scores[~(drawdown >= -self.max_drawdown)] = -np.inf
+            values[chunk] = np.where(np.isnan(scores), -np.inf, scores)
+            if self.store:
+                for k, i in enumerate(chunk):
+                    self.store.put(keys[i], values[i])
+        return pd.DataFrame(values, columns=self.objective_names)
+
+    def prefix_drawdown(self, grid: pd.DataFrame, prefix: float) -> np.ndarray:
+        """每组参数在最早prefix比例历史上的最大回撤(负数)，无法计算的为NaN；不读写评估缓存"""
+        grid = grid.reset_index(drop=True)
+        drawdown = np.full(len(grid), np.nan)
+        for start in range(0, len(grid), EVAL_CHUNK):
+            chunk = np.arange(start, min(start + EVAL_CHUNK, len(grid)))
+            profile_count('prefix_backtests', len(chunk))
+            daily = self.daily_returns(grid.iloc[chunk], prefix=prefix)
+            drawdown[chunk] = compute_metrics(daily)['max_drawdown'].to_numpy(dtype=float)
+        return drawdown
+
+    def params_at(self, grid: pd.DataFrame, i: int) -> dict:
+        """保持各列原始类型(整数周期、浮点乘数)的参数字典"""
+        return {name: grid[name].iloc[i].item() for name in self.param_names}
+
+
+# ================================= 参数搜索 =================================
+def full_grid(space: dict) -> pd.DataFrame:
+    return pd.DataFrame(list(itertools.product(*space.values())), columns=list(space))
+
+def pareto_middle(scores: pd.DataFrame) -> int:
+    """多目标时取非支配解按第一个目标排序后的中间解(与NSGA2脚本选择平衡解一致)，单目标取最大值"""
+    values = scores.to_numpy()
+    if values.shape[1] == 1:
+        return int(np.argmax(values[:, 0]))
+    finite = np.flatnonzero(np.isfinite(values).all(axis=1))
+    front = [i for i in finite
+             if not any((values[j] >= values[i]).all() and (values[j] > values[i]).any() for j in finite)]
+    if not front:
+        return 0
+    front.sort(key=lambda i: values[i, 0])
+    return int(front[len(front) // 2])
+
+def grid_search(backtester: Backtester, options: dict) -> tuple:
+    """
+    全网格批量评估；设置max_drawdown时先按GRID_STAGES在逐步加长的历史前段上回测，
+    前段最大回撤已超过上限的组合直接剪枝，剩余组合在全历史上评分
+    """
+    grid = full_grid(backtester.config['space'])
+    grid = grid[backtester.valid(grid)].reset_index(drop=True)
+    if backtester.max_drawdown is not None:
+        for stage in options.get('stages', GRID_STAGES):
+            if stage >= 1:
+                continue
+            with profile_stage('grid_stage'):
+                drawdown = backtester.prefix_drawdown(grid, stage)
+            alive = drawdown >= -backtester.max_drawdown
+            logger.debug(f'{backtester.ts_code} 网格搜索: 前{stage:.0%}历史评估 {len(grid)} 组，保留 {int(alive.sum())} 组')
+            grid = grid[alive].reset_index(drop=True)
+            if grid.empty:
+                return None, None
+    scores = backtester.evaluate(grid)
+    best = pareto_middle(scores)
+    return backtester.params_at(grid, best), scores.iloc[best].to_dict()
+
+def _pymoo_search(backtester: Backtester, algorithm, n_gen: int) -> tuple:
+    from pymoo.core.problem import Problem
+    from pymoo.optimize import minimize
+    from pymoo.termination import get_termination
+
+    space = backtester.config['space']
+    values = [np.asarray(v) for v in space.values()]
+    n_obj = len(backtester.objective_names)
+
+    def decode(x: np.ndarray) -> pd.DataFrame:
+        index = np.clip(np.atleast_2d(x).astype(int), 0, [len(v) - 1 for v in values])
+        return pd.DataFrame({name: v[index[:, j]] for j, (name, v) in enumerate(zip(space, values))})
+
+    class IndexProblem(Problem):
+        """参数取值的下标为决策变量，每代种群一次批量评估"""
+
+        def __init__(self):
+            super().__init__(n_var=len(values), n_obj=n_obj, n_constr=0, xl=np.zeros(len(values)),
+                             xu=np.array([len(v) - 1 for v in values]), vtype=np.int32)
+
+        def _evaluate(self, x, out, *args, **kwargs):
+            out['F'] = -backtester.evaluate(decode(x)).to_numpy()
+
+    res = minimize(IndexProblem(), algorithm, get_termination('n_gen', n_gen), seed=1, verbose=False)
+    if res.X is None:
+        return None, None
+    # 最优解集已在缓存中，重新取目标值后按pareto_middle选择(多目标为非支配解的中间解)
+    grid = decode(res.X)
+    scores = backtester.evaluate(grid, record=False)
+    best = pareto_middle(scores)
+    return backtester.params_at(grid, best), scores.iloc[best].to_dict()
+
+def ga_search(backtester: Backtester, options: dict) -> tuple:
+    """单目标遗传算法(与bt_ha_supertrend_mult_tscode相同的算子)"""
+    from pymoo.algorithms.soo.nonconvex.ga import GA
+    from pymoo.operators.sampling.rnd import FloatRandomSampling
+    from pymoo.operators.crossover.sbx import SBX
+    from pymoo.operators.mutation.pm import PM
+    algorithm = GA(pop_size=options.get('pop_size', 20), sampling=FloatRandomSampling(),
+                   crossover=SBX(prob=0.9, eta=15), mutation=PM(eta=20), eliminate_duplicates=True)
+    return _pymoo_search(backtester, algorithm, options.get('n_gen', 10))
+
+def nsga2_search(backtester: Backtester, options: dict) -> tuple:
+    """多目标NSGA2，返回最优解集中间的平衡解"""
+    from pymoo.algorithms.moo.nsga2 import NSGA2
+    from pymoo.operators.sampling.rnd import FloatRandomSampling
+    from pymoo.operators.crossover.sbx import SBX
+    from pymoo.operators.mutation.pm import PM
+    algorithm = NSGA2(pop_size=options.get('pop_size', 20), n_offsprings=options.get('n_offsprings', 10),
+                      sampling=FloatRandomSampling(), crossover=SBX(prob=0.9, eta=15), mutation=PM(eta=20),
+                      eliminate_duplicates=True)
+    return _pymoo_search(backtester, algorithm, options.get('n_gen', 10))
+
+def bayes_search(backtester: Backtester, options: dict) -> tuple:
+    """高斯过程 + UCB采集函数的贝叶斯优化(与bt_ha_supertrend_calmar_optimization相同)，仅支持单目标"""
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import Matern
+    space = backtester.config['space']
+    rng = np.random.default_rng(options.get('seed'))
+    gpr = GaussianProcessRegressor(kernel=Matern(nu=2.5), random_state=42)
+
+    def sample(n: int) -> pd.DataFrame:
+        grid = pd.DataFrame({name: rng.choice(np.asarray(values), n) for name, values in space.items()})
+        return grid[backtester.valid(grid)].reset_index(drop=True)
+
+    X = sample(options.get('n_candidates', 200)).iloc[[0]].reset_index(drop=True)
+    y = backtester.evaluate(X).iloc[:, 0].to_numpy()
+    for _ in range(options.get('n_iterations', 50) - 1):
+        finite = np.isfinite(y)
+        candidates = sample(options.get('n_candidates', 200))
+        if finite.any():
+            gpr.fit(X.to_numpy(dtype=float)[finite], y[finite])
+            mu, sigma = gpr.predict(candidates.to_numpy(dtype=float), return_std=True)
+            x_next = candidates.iloc[[int(np.argmax(mu + options.get('kappa', 1.5) * sigma))]]
+        else:
+            x_next = candidates.iloc[[0]]
+        X = pd.concat([X, x_next], ignore_index=True)
+        y = np.append(y, backtester.evaluate(x_next).iloc[0, 0])
+
+    best = int(np.argmax(y))
+    scores = backtester.evaluate(X.iloc[[best]], record=False)
+    return backtester.params_at(X, best), scores.iloc[0].to_dict()
+
+def deap_search(backtester: Backtester, options: dict) -> tuple:
+    """
+    DEAP遗传算法(与原bt_ma_adx_mult_tscode相同的算子)，仅支持单目标：个体为各参数的取值，第一个参数在全部取值中
+    随机选择，其余参数只在满足约束的取值中选择(没有时在全部取值中选择)；两点交叉、随机重选一个参数的变异、
+    锦标赛选择，eaSimple每代待评估的个体一次批量评估，返回名人堂第一名
+    """
+    from deap import algorithms, base, creator, tools
+    space = backtester.config['space']
+    names = list(space)
+    values = [np.asarray(v).tolist() for v in space.values()]
+    random.seed(options.get('seed'))
+    if not hasattr(creator, 'FitnessMax'):
+        creator.create('FitnessMax', base.Fitness, weights=(1.0,))
+    if not hasattr(creator, 'Individual'):
+        creator.create('Individual', list, fitness=creator.FitnessMax)
+
+    def draw(individual: list, j: int):
+        """第j个参数的新取值，其余参数保持individual中的值"""
+        if j == 0:
+            return random.choice(values[0])
+        candidates = pd.DataFrame([individual] * len(values[j]), columns=names)
+        candidates[names[j]] = values[j]
+        allowed = [v for v, ok in zip(values[j], backtester.valid(candidates)) if ok]
+        return random.choice(allowed or values[j])
+
+    def create_individual() -> list:
+        # 依次生成各参数，尚未生成的参数暂取第一个取值
+        individual = [v[0] for v in values]
+        for j in range(len(values)):
+            individual[j] = draw(individual, j)
+        return individual
+
+    def mutate(individual):
+        j = random.randint(0, len(individual) - 1)
+        individual[j] = draw(individual, j)
+        return individual,
+
+    def evaluate_batch(_, individuals) -> list:
+        individuals = list(individuals)
+        if not individuals:
+            return []
+        scores = backtester.evaluate(pd.DataFrame([list(ind) for ind in individuals], columns=names))
+        return [tuple(row) for row in scores.to_numpy()]
+
+    toolbox = base.Toolbox()
+    toolbox.register('individual', tools.initIterate, creator.Individual, create_individual)
+    toolbox.register('population', tools.initRepeat, list, toolbox.individual)
+    toolbox.register('evaluate', lambda individual: evaluate_batch(None, [individual])[0])
+    toolbox.register('map', evaluate_batch)
+    toolbox.register('mate', tools.cxTwoPoint)
+    toolbox.register('mutate', mutate)
+    toolbox.register('select', tools.selTournament, tournsize=options.get('tournsize', 3))
+
+    hof = tools.HallOfFame(options.get('hall_of_fame', 5))
+    algorithms.eaSimple(toolbox.population(n=options.get('pop_size', 50)), toolbox, cxpb=options.get('cxpb', 0.8),
+                        mutpb=options.get('mutpb', 0.2), ngen=options.get('n_gen', 20), halloffame=hof, verbose=False)
+    if not hof:
+        return None, None
+    grid = pd.DataFrame([list(hof[0])], columns=names)
+    return backtester.params_at(grid, 0), dict(zip(backtester.objective_names, hof[0].fitness.values))
+
+def _rung_rank(scores: pd.DataFrame) -> np.ndarray:
+    """各组参数在一轮中的名次(0最好)，多目标按各目标名次的平均值"""
+    ranks = scores.rank(ascending=False, method='min').mean(axis=1).to_numpy()
+    return np.argsort(ranks, kind='stable')
+
+def _successive_halving(backtester: Backtester, grid: pd.DataFrame, min_fidelity: float, eta: float) -> tuple:
+    """
+    逐轮淘汰：先在最近min_fidelity比例的K线上评估全部候选，保留前1/eta进入eta倍长的历史，直到全历史
+    Returns:
+        (最后一轮的候选, 其全历史目标值)
+    """
+    fidelity = min_fidelity
+    while fidelity < 1:
+        with profile_stage('halving_rung'):
+            scores = backtester.evaluate(grid, fidelity)
+        keep = max(1, math.ceil(len(grid) / eta))
+        grid = grid.iloc[_rung_rank(scores)[:keep]].reset_index(drop=True)
+        fidelity = fidelity * eta
+    return grid, backtester.evaluate(grid)
+
+def _sample(grid: pd.DataFrame, n: int = None, rng=None) -> pd.DataFrame:
+    """n小于网格大小时随机抽取n组(保持网格顺序)，否则返回整个网格"""
+    if n is not None and n < len(grid):
+        grid = grid.iloc[np.sort(rng.choice(len(grid), n, replace=False))].reset_index(drop=True)
+    return grid
+
+def _candidates(backtester: Backtester, n: int = None, rng=None) -> pd.DataFrame:
+    """满足约束的全网格，n小于网格大小时随机抽取n组"""
+    grid = full_grid(backtester.config['space'])
+    return _sample(grid[backtester.valid(grid)].reset_index(drop=True), n, rng)
+
+def halving_search(backtester: Backtester, options: dict) -> tuple:
+    """逐轮淘汰(successive halving)：短窗口粗筛全网格，只有排名靠前的组合回测更长的历史"""
+    rng = np.random.default_rng(options.get('seed', 1))
+    grid = _candidates(backtester, options.get('max_candidates'), rng)
+    grid, scores = _successive_halving(backtester, grid, options.get('min_fidelity', 1 / 9), options.get('eta', 3))
+    best = pareto_middle(scores)
+    return backtester.params_at(grid, best), scores.iloc[best].to_dict()
+
+def hyperband_search(backtester: Backtester, options: dict) -> tuple:
+    """
+    Hyperband：多组起始窗口不同的逐轮淘汰，候选多的组从短窗口开始，候选少的组直接用更长的历史，
+    各组胜出者在全历史上比较；起始窗口最短的一组覆盖全部有效网格(或 max_candidates 组)，
+    其余各组按 Hyperband 的比例 (s_max+1)/(s+1) * eta^(s-s_max) 随机抽取
+    """
+    eta = options.get('eta', 3)
+    s_max = int(round(math.log(1 / options.get('min_fidelity', 1 / 9), eta)))
+    rng = np.random.default_rng(options.get('seed', 1))
+    candidates = _candidates(backtester)
+    n_max = min(options.get('max_candidates') or len(candidates), len(candidates))
+    finalists, finalist_scores = [], []
+    for s in range(s_max, -1, -1):
+        n = math.ceil(n_max * (s_max + 1) / (s + 1) * eta ** (s - s_max))
+        grid, scores = _successive_halving(backtester, _sample(candidates, n, rng), eta ** -s, eta)
+        finalists.append(grid)
+        finalist_scores.append(scores)
+    grid = pd.concat(finalists, ignore_index=True)
+    scores = pd.concat(finalist_scores, ignore_index=True)
+    best = pareto_middle(scores)
+    return backtester.params_at(grid, best), scores.iloc[best].to_dict()
+
+SEARCHES = {'grid': grid_search, 'ga': ga_search, 'nsga2': nsga2_search, 'bayes': bayes_search,
+            'deap': deap_search, 'halving': halving_search, 'hyperband': hyperband_search}
+
+
+# ================================= 单只股票优化 =================================
+def search_stock(ts_code: str, config: dict, use_cache: bool = True) -> Optional[tuple]:
+    """
+    按配置搜索一只股票的最优参数并用其回测全历史
+    Returns:
+        (回测器, 最优参数, 目标值, 与基准对齐的日收益, 基准日收益)；没有数据或没有有效参数时返回None
+    """
+    with profile_stage('load_data'):
+        bars = load_bars(ts_code, config['start_date'], config['end_date'], config['fq_code'])
+        benchmark_returns = load_benchmark_returns(config['start_date'], config['end_date'])
+    if bars is None:
+        logger.warning(f'{ts_code} 没有K线数据')
+        return None
+    profile_count('bars', len(bars))
+
+    backtester = Backtester(config, ts_code, bars, benchmark_returns, use_cache)
+    with profile_stage('search'):
+        best_params, objectives = SEARCHES[config['search']](backtester, config['search_options'])
+    if backtester.store:
+        logger.info(f'{ts_code} {backtester.store.summary()}')
+    if best_params is None or not np.isfinite(list(objectives.values())).all():
+        logger.warning(f'{ts_code} 没有有效的参数组合')
+        return None
+
+    with profile_stage('final_backtest'):
+        daily = backtester.daily_returns(pd.DataFrame([best_params]))[0]
+        daily.name = STRATEGIES[config['strategy']]['returns_name']
+        daily, benchmark = align_with_benchmark(daily, benchmark_returns)
+    return backtester, best_params, objectives, daily, benchmark
+
+def stock_result(ts_code: str, config: dict, best_params: dict, objectives: dict, daily: pd.Series,
+                 benchmark: pd.Series) -> dict:
+    """结果行：股票代码 + 最优参数 + opt_目标值 + 附加指标 + 全部绩效指标，再按配置改为原脚本的列名"""
+    result = {'stock_code': ts_code, **best_params, **{f'opt_{name}': value for name, value in objectives.items()}}
+    if config['extra_metrics']:
+        result.update(EXTRA_METRICS[config['extra_metrics']](daily, result))
+    result.update(metrics_report(daily, benchmark, **config['metrics_options']))
+    columns = config['columns']
+    return {columns.get(name, name): value for name, value in result.items() if columns.get(name, name) is not None}
+
+@profile_stage('optimize_stock')
+def optimize_stock(ts_code: str, config: dict, use_cache: bool = True, raise_errors: bool = False) -> Optional[dict]:
+    """
+    按配置优化一只股票，保存最优参数的收益序列，返回结果行(stock_result)；没有数据或没有有效参数时返回None
+    出错时返回None，raise_errors为True时(任务队列)抛出异常以便记为失败重试
+    """
+    try:
+        found = search_stock(ts_code, config, use_cache)
+        if found is None:
+            return None
+        _, best_params, objectives, daily, benchmark = found
+        with profile_stage('save_returns'):
+            save_returns(config['name'], ts_code, daily, benchmark, config['report_title'].format(code=ts_code))
+        with profile_stage('metrics'):
+            return stock_result(ts_code, config, best_params, objectives, daily, benchmark)
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger.error(f'处理股票 {ts_code} 时发生错误: {str(e)}')
+        return None
+
+
+# ================================= 多股票运行 =================================
+def sink_config(config: dict) -> dict:
+    """结果记录的配置哈希只取影响结果的配置项(撮合引擎两者一致，不计入)"""
+    return {key: value for key, value in config.items()
+            if key not in ('engine', 'universe', 'stocks', 'output', 'report_by', 'report_title')}
+
+def result_code(result: dict) -> str:
+    """结果行中的股票代码(列名按配置可能为stock_code或ts_code)"""
+    return next(result[column] for column in CODE_COLUMNS if column in result)
+
+def write_results(results_df: pd.DataFrame, output_path: str) -> str:
+    """写出结果表，当前目录没有写入权限时改写到reports目录，返回实际路径"""
+    try:
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        results_df.to_csv(output_path, index=False)
+    except PermissionError:
+        output_path = os.path.join(OUTPUT_DIR, os.path.basename(output_path))
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        results_df.to_csv(output_path, index=False)
+    return output_path
+
+def run_config(config: dict, ts_codes: List[str], processes: int = MAX_PROCESSES, resume: bool = False,
+               report_top: int = REPORT_TOP_N, use_cache: bool = True, shared_data: bool = True) -> pd.DataFrame:
+    """
+    按配置优化一批股票，结果逐只追加到结果记录，最后输出CSV(按sort_by排序)并为report_by前report_top名生成报告；
+    结果记录、收益序列和报告均以配置名为运行名，与原脚本的RUN_NAME相同
+    """
+    run = config['name']
+    sink = ResultSink(run, sink_config(config), resume=resume)
+    completed = sink.completed()
+    pending = [code for code in ts_codes if code not in completed]
+    logger.info(f"{config['name']}: 共 {len(ts_codes)} 只股票，已完成 {len(ts_codes) - len(pending)} 只，"
+                f"待处理 {len(pending)} 只 (引擎 {config['engine']}，搜索 {config['search']}，目标 {config['objective']})")
+
+    shared = None
+    try:
+        if pending and shared_data and config['fq_code'] == 'wfq' and len(pending) > 1:
+            with profile_stage('load_shared_data'):
+                shared = SharedMarketData.load(pending, config['start_date'], config['end_date'], get_engine())
+        worker = partial(optimize_stock, config=config, use_cache=use_cache)
+        if len(pending) <= 1 or processes <= 1:
+            results = map(worker, pending)
+            pool = None
+        else:
+            pool = mp.Pool(processes=processes, initializer=attach_shared_data if shared else None,
+                           initargs=(shared.spec,) if shared else ())
+            results = pool.imap_unordered(worker, pending)
+        with tqdm(total=len(pending), desc=config['name']) as pbar:
+            for result in results:
+                pbar.update(1)
+                if result is not None:
+                    sink.append(result_code(result), result)
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if shared:
+            shared.close()
+
+    results_df = sink.to_frame(ts_codes, sort_by=config['sort_by'])
+    if results_df.empty:
+        logger.warning('没有成功处理任何股票')
+        return results_df
+    output_path = write_results(results_df, config['output'])
+    logger.info(f'结果已保存到 {output_path}，共 {len(results_df)} 只股票'
+                + (f'，按 {config["sort_by"]} 排序' if config['sort_by'] else ''))
+    render_top_reports(run, results_df, config['report_by'] or config['sort_by'], report_top)
+    return results_df
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='回测优化框架：按配置运行各bt_*脚本的参数优化')
+    parser.add_argument('--config', type=str, choices=list(CONFIGS), help='脚本配置')
+    parser.add_argument('--list', action='store_true', help='列出全部配置')
+    parser.add_argument('--stock', type=str, nargs='+', help='指定股票代码 (默认: 配置中的股票列表)')
+    parser.add_argument('--engine', type=str, choices=ENGINES, help='撮合引擎 (默认: 配置值)')
+    parser.add_argument('--search', type=str, choices=list(SEARCHES), help='参数搜索方式 (默认: 配置值)')
+    parser.add_argument('--objective', type=str, choices=list(OBJECTIVES), help='目标函数 (默认: 配置值)')
+    parser.add_argument('--start-date', type=str, help='回测开始日期 (默认: 配置值)')
+    parser.add_argument('--end-date', type=str, help='回测结束日期 (默认: 配置值)')
+    parser.add_argument('--processes', type=int, default=MAX_PROCESSES, help=f'并行进程数 (默认: {MAX_PROCESSES})')
+    parser.add_argument('--resume', action='store_true', help='续跑: 跳过相同配置下已有结果的股票')
+    parser.add_argument('--report-top', type=int, default=REPORT_TOP_N, help=f'为排序前N名生成报告，0不生成 (默认: {REPORT_TOP_N})')
+    parser.add_argument('--no-cache', action='store_true', help='禁用评估缓存')
+    parser.add_argument('--no-shared-data', action='store_true', help='禁用共享内存行情')
+    parser.add_argument('--profile', action='store_true', help='记录各阶段耗时')
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.list or not args.config:
+        for name in CONFIGS:
+            config = get_config(name)
+            space = ', '.join(f'{key}[{len(values)}]' for key, values in config['space'].items())
+            print(f"{name:<22} {config['strategy']:<14} {config['search']:<6} {config['objective']:<24} {space}")
+        return
+
+    config = get_config(args.config, engine=args.engine, search=args.search, objective=args.objective,
+                        start_date=args.start_date, end_date=args.end_date)
+    if args.profile:
+        enable_profiling(config['name'])
+    ts_codes = args.stock or load_universe(config)
+    results_df = run_config(config, ts_codes, args.processes, args.resume, args.report_top,
+                            not args.no_cache, not args.no_shared_data)
+    if not results_df.empty:
+        print(results_df.head(10).to_string(index=False))
+    collect_profile()
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,27 @@
 # -*- coding: utf-8 -*-
+"""
+Heikin Ashi SuperTrend 单股票多目标优化(胜率 + 盈亏比)
+
+bt_framework 中 ha_st_optimized 配置的命令行入口：NSGA2搜索胜率与盈亏比的非支配解，取中间的平衡解回测；
+与原先相同写出 {股票}_all_metrics.csv(搜索中评估过的全部参数)、{股票}_metrics.csv、{股票}.html 和 {股票}_trade_record.csv
+
+用法:
+    python bt_ha_supertrend_optimized.py --engine vector
+"""
 from common import *
-import backtrader as bt
-# import optuna
+import argparse
 import quantstats_lumi as qs
-from pymoo.core.problem import Problem
-from pymoo.algorithms.moo.nsga2 import NSGA2
-from pymoo.optimize import minimize
-from pymoo.termination import get_termination
-from pymoo.operators.sampling.rnd import FloatRandomSampling
-from pymoo.operators.crossover.sbx import SBX
-from pymoo.operators.mutation.pm import PM
-from pymoo.config import Config
-from collections import defaultdict
+from bt_framework import align_with_benchmark, get_config, search_stock, stock_result
+from bt_framework import optimize_stock as optimize_config
+from perf_metrics import metrics_report
+from vector_backtest import ENGINES, simulate_signals, trade_records, vector_result
 
 
 #################################
 # 参数设置
 #################################
+CONFIG_NAME = 'ha_st_optimized'
+
 # 回测标的和时间范围
 STOCK_CODE = '601127.SH'
 START_DATE = '2000-01-01'
@@ -31,404 +36,90 @@ POPULATION_SIZE = 20
 OFFSPRING_SIZE = 10
 N_GENERATIONS = 10
 
-#################################
-
-# 创建数据库连接
-config = load_config()
-engine = create_engine(get_pg_connection_string(config))
-
-# 禁用PyMoo的编译警告
-Config.warnings['not_compiled'] = False
-
-
-# 新的heikin_ashi函数
-def heikin_ashi(df):
-    df.ta.ha(append=True)
-    ha_ohlc = {"HA_open": "ha_open", "HA_high": "ha_high", "HA_low": "ha_low", "HA_close": "ha_close"}
-    df.rename(columns=ha_ohlc, inplace=True)
-    return df
-
-def supertrend(df, length, multiplier):
-    '''direction=1上涨，-1下跌'''
-    supertrend_df = ta.supertrend(df['ha_high'], df['ha_low'], df['ha_close'], length, multiplier)
-    df['supertrend'] = supertrend_df[f'SUPERT_{length}_{multiplier}.0']
-    df['direction'] = supertrend_df[f'SUPERTd_{length}_{multiplier}.0']
-    return df
-
-# HeikinAshiData类
-class HeikinAshiData(bt.feeds.PandasData):
-    lines = ('direction', 'supertrend',)
-    params = (
-        ('datetime', None),
-        ('open', 'open'),
-        ('high', 'high'),
-        ('low', 'low'),
-        ('close', 'close'),
-        ('volume', 'volume'),
-        ('direction', 'direction'),
-        ('supertrend', 'supertrend'),
-        ('openinterest', None),
-    )
-
-# 交易策略
-class HeikinAshiSuperTrendStrategy(bt.Strategy):
-    params = (
-        ('supertrend_period', 10),
-        ('supertrend_multiplier', 3),
-    )
+# 回测引擎: cerebro 逐K线事件驱动, vector 数组回测(结果与cerebro一致)
+ENGINE = 'cerebro'
 
-    def __init__(self):
-        self.direction = self.data.lines.direction
-        self.in_position = False
+# 评估缓存: 重复运行时已评估过的参数直接读取结果
+USE_CACHE = True
 
-    def next(self):
-        if not self.in_position and self.direction[0] == 1:
-            size = int((self.broker.get_cash() * 0.95) / self.data.close[0])
-            self.buy(size=size)
-            self.in_position = True
-        elif self.in_position and self.direction[0] == -1:
-            self.close()
-            self.in_position = False
+# {股票}_all_metrics.csv 中每组参数的指标
+ALL_METRICS = ['sharpe', 'sortino', 'win_rate', 'profit_factor', 'max_drawdown', 'cagr', 'volatility', 'calmar',
+               'information_ratio', 'r_squared']
 
-# 添加交易记录分析器
-class TradeRecorder(bt.Analyzer):
-    def __init__(self):
-        self.trades = []
-        self.current_trade = None
-
-    def notify_trade(self, trade):
-        if trade.isclosed:
-            # 获取交易的数据
-            data = trade.data
-            # 获取退出时间点的收盘价作为退出价格
-            exit_price = data.close[0]
-            
-            self.trades.append({
-                'entry_date': bt.num2date(trade.dtopen).strftime('%Y-%m-%d %H:%M:%S'),
-                'exit_date': bt.num2date(trade.dtclose).strftime('%Y-%m-%d %H:%M:%S'),
-                'entry_price': trade.price,
-                'exit_price': exit_price,
-                'size': trade.size,
-                'entry_value': abs(trade.value),
-                'exit_value': abs(trade.pnlcomm + trade.value),
-                'pnl': trade.pnlcomm,
-                'return_pct': (trade.pnlcomm / abs(trade.value)) * 100 if trade.value != 0 else 0,
-                'commission': trade.commission
-            })
-
-    def get_trades(self):
-        return self.trades
-
-class TradingProblem(Problem):
-    def __init__(self, stock_code, start_date, end_date):
-        self.period_values = PERIOD_RANGE
-        self.multiplier_values = MULTIPLIER_RANGE
-        
-        # 添加一个列表来存储所有参数的metrics
-        self.all_metrics = []
-        
-        # 根据参数范围的长度自动设置上下界
-        super().__init__(
-            n_var=2,  # 两个变量：period和multiplier
-            n_obj=2,  # 两个目标：胜率和盈亏比
-            n_constr=0,  # 没有约束
-            xl=np.array([0, 0]),  # 下界固定为0
-            xu=np.array([len(self.period_values)-1, len(self.multiplier_values)-1]),  # 上界根据参数范围长度自动设置
-            vtype=np.int32  # 设置变量类型为整数
-        )
-        self.stock_code = stock_code
-        self.start_date = start_date
-        self.end_date   = end_date
-        
-        print(f'正在获取股票数据: {stock_code}')
-        self.df = get_30m_kline_data('wfq', self.stock_code, self.start_date, self.end_date)
-        self.df['trade_time'] = pd.to_datetime(self.df['trade_time'])
-        self.df.set_index('trade_time', inplace=True)
-        self.df = heikin_ashi(self.df)
-        
-        # 对每个可能的参数组合预先计算SuperTrend信号
-        self.parameter_data = {}
-        for period in self.period_values:
-            for multiplier in self.multiplier_values:
-                df_copy = self.df.copy()
-                df_copy = supertrend(df_copy, period, multiplier)
-                self.parameter_data[(period, multiplier)] = df_copy
-        
-        # 在初始化时获取基准数据
-        print('正在获取基准数据...')
-        benchmark_sql = """
-        SELECT trade_time, close 
-        FROM a_index_1day_kline_baostock 
-        WHERE ts_code = '000300.SH' 
-        AND trade_time BETWEEN %s AND %s 
-        ORDER BY trade_time
-        """
-        self.benchmark_df = pd.read_sql(benchmark_sql, engine, params=(start_date, end_date))
-        self.benchmark_df['trade_time'] = pd.to_datetime(self.benchmark_df['trade_time'])
-        self.benchmark_df.set_index('trade_time', inplace=True)
-        self.benchmark_returns = self.benchmark_df['close'].pct_change()
-        self.benchmark_returns.name = '000300.SH'
+#################################
 
-    def _evaluate(self, x, out, *args, **kwargs):
-        F = np.zeros((x.shape[0], 2))
-        
-        for i in range(x.shape[0]):
-            period = self.period_values[int(x[i, 0])]
-            multiplier = self.multiplier_values[int(x[i, 1])]
-            
-            # 使用预先计算好的数据
-            df = self.parameter_data[(period, multiplier)]
-            cerebro = bt.Cerebro()
-            data = HeikinAshiData(dataname=df)
-            cerebro.adddata(data)
-            cerebro.broker.setcash(100000)
-            cerebro.broker.setcommission(commission=0.0003)
-            cerebro.addstrategy(HeikinAshiSuperTrendStrategy,
-                              supertrend_period=period,
-                              supertrend_multiplier=multiplier)
-            cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
-            results = cerebro.run()
-            strat = results[0]
-            returns = pd.Series(strat.analyzers.timereturn.get_analysis())
-            
-            # 将30分钟收益聚合为日度收益
-            returns.index = pd.to_datetime(returns.index)
-            daily_returns = (1 + returns).groupby(returns.index.date).prod() - 1
-            daily_returns.index = pd.to_datetime(daily_returns.index)
-            daily_returns.name = 'SuperTrend'
-            
-            # 使用已获取的基准数据
-            benchmark_returns = self.benchmark_returns
-            
-            # 确保两个时间序列的索引对齐
-            aligned_dates = daily_returns.index.intersection(benchmark_returns.index)
-            daily_returns = daily_returns[aligned_dates]
-            benchmark_returns = benchmark_returns[aligned_dates]
-            
-            # 删除任何包含NaN的数据
-            valid_data = ~(daily_returns.isna() | benchmark_returns.isna())
-            daily_returns = daily_returns[valid_data]
-            benchmark_returns = benchmark_returns[valid_data]
-            
-            # 计算当前参数组合的metrics
-            metrics = {
-                'stock_code': self.stock_code,
-                'period': period,
-                'multiplier': multiplier,
-                'sharpe': qs.stats.sharpe(daily_returns),
-                'sortino': qs.stats.sortino(daily_returns),
-                'win_rate': qs.stats.win_rate(daily_returns) * 100,
-                'profit_factor': qs.stats.profit_factor(daily_returns),
-                'max_drawdown': qs.stats.max_drawdown(daily_returns) * 100,
-                'cagr': qs.stats.cagr(daily_returns) * 100,
-                'volatility': qs.stats.volatility(daily_returns) * 100,
-                'calmar': qs.stats.calmar(daily_returns),
-                'information_ratio': qs.stats.information_ratio(daily_returns, benchmark_returns),
-                'r_squared': qs.stats.r_squared(daily_returns, benchmark_returns)
-            }
-            
-            # 将metrics添加到列表中
-            self.all_metrics.append(metrics)
-            
-            # 设置优化目标
-            F[i, 0] = -metrics['win_rate']
-            F[i, 1] = -metrics['profit_factor']
-        
-        out["F"] = F
 
+def build_config() -> dict:
+    """由模块级参数生成框架配置"""
+    return get_config(CONFIG_NAME, start_date=START_DATE, end_date=END_DATE, engine=ENGINE, stocks=[STOCK_CODE],
+                      space={'supertrend_period': PERIOD_RANGE, 'supertrend_multiplier': MULTIPLIER_RANGE},
+                      search_options={'pop_size': POPULATION_SIZE, 'n_offsprings': OFFSPRING_SIZE,
+                                      'n_gen': N_GENERATIONS})
+
+def optimize_stock(stock_code, raise_errors=False):
+    """对单个股票进行参数优化"""
+    return optimize_config(stock_code, build_config(), USE_CACHE, raise_errors)
+
+
+def evaluated_metrics(backtester) -> pd.DataFrame:
+    """搜索中评估过的每组参数(按评估顺序，含缓存命中)的主要指标"""
+    grid = pd.DataFrame(backtester.evaluated).drop_duplicates().reset_index(drop=True)
+    daily = backtester.daily_returns(grid)
+    reports = {}
+    for i in range(len(grid)):
+        returns, benchmark = align_with_benchmark(daily[i], backtester.benchmark_returns)
+        reports[tuple(backtester.params_at(grid, i).values())] = metrics_report(returns, benchmark)
+    rows = []
+    for params in backtester.evaluated:
+        report = reports[tuple(params.values())]
+        rows.append({'stock_code': backtester.ts_code, 'period': params['supertrend_period'],
+                     'multiplier': params['supertrend_multiplier'], **{name: report[name] for name in ALL_METRICS}})
+    return pd.DataFrame(rows)
+
+def trade_record(backtester, params: dict) -> pd.DataFrame:
+    """最优参数的已平仓交易(数组撮合，与Cerebro逐笔一致；字段同原TradeRecorder)"""
+    indicators = backtester.indicators
+    direction = indicators.signals(pd.DataFrame([params]))['direction'][:, 0]
+    cash, position, trades = simulate_signals(indicators.trade_open, indicators.trade_close, direction)
+    result = vector_result(indicators.index, indicators.trade_close, cash, position, trades)
+    return pd.DataFrame(trade_records(result.trades))
 
 
 if __name__ == '__main__':
-    # 创建问题实例
-    problem = TradingProblem(STOCK_CODE, START_DATE, END_DATE)
-    
-    # 创建算法实例，添加采样、交叉和变异操作
-    algorithm = NSGA2(
-        pop_size=POPULATION_SIZE,
-        n_offsprings=OFFSPRING_SIZE,
-        sampling=FloatRandomSampling(),
-        crossover=SBX(prob=0.9, eta=15),
-        mutation=PM(eta=20),
-        eliminate_duplicates=True
-    )
-    
-    # 设置终止条件
-    termination = get_termination("n_gen", N_GENERATIONS)
-    
-    # 运行优化
-    print(f'正在运行 {STOCK_CODE} 的多目标参数优化...')
-    res = minimize(
-        problem,
-        algorithm,
-        termination,
-        seed=1,
-        verbose=True
-    )
-    
+    parser = argparse.ArgumentParser(description='Heikin Ashi SuperTrend策略多目标优化')
+    parser.add_argument('--engine', type=str, choices=ENGINES, default=ENGINE, help=f'回测引擎 (默认: {ENGINE})')
+    parser.add_argument('--no-cache', action='store_true', help='禁用评估缓存')
+    args = parser.parse_args()
+    ENGINE = args.engine
+    USE_CACHE = not args.no_cache
+
+    setup_logger()
+    config = build_config()
+    found = search_stock(STOCK_CODE, config, USE_CACHE)
+    if found is None:
+        raise SystemExit(1)
+    backtester, best_params, objectives, daily_returns, benchmark_returns = found
+
     # 保存所有参数的metrics
-    all_metrics_df = pd.DataFrame(problem.all_metrics)
-    all_metrics_df.round(3).to_csv(f'{STOCK_CODE}_all_metrics.csv', index=False)
+    evaluated_metrics(backtester).round(3).to_csv(f'{STOCK_CODE}_all_metrics.csv', index=False)
     print(f'\n所有参数的metrics已保存到：{STOCK_CODE}_all_metrics.csv')
-    
-    # 输出结果
-    print("\n=== 优化结果 ===")
-    print("最优解集合:")
-    for i in range(len(res.X)):
-        period_idx = int(res.X[i, 0])
-        multiplier_idx = int(res.X[i, 1])
-        period = problem.period_values[period_idx]
-        multiplier = problem.multiplier_values[multiplier_idx]
-        win_rate = -res.F[i, 0] * 100
-        profit_factor = -res.F[i, 1]
-        print(f"\n解 {i+1}:")
-        print(f"参数: period={period}, multiplier={multiplier}")
-        print(f"胜率: {win_rate:.2f}%")
-        print(f"盈亏比: {profit_factor:.2f}")
-    
-    # 选择一个平衡的解进行回测
-    balanced_idx = len(res.X) // 2  # 选择中间的解
-    period_idx = int(res.X[balanced_idx, 0])
-    multiplier_idx = int(res.X[balanced_idx, 1])
-    best_params = {
-        'supertrend_period': problem.period_values[period_idx],
-        'supertrend_multiplier': problem.multiplier_values[multiplier_idx]
-    }
-    
-    # 使用选定的参数进行回测
-    cerebro = bt.Cerebro()
-    
-    # 先计算最优参数的SuperTrend指标
-    final_df = problem.df.copy()
-    final_df = supertrend(final_df, 
-                         best_params['supertrend_period'], 
-                         best_params['supertrend_multiplier'])
-    
-    data = HeikinAshiData(dataname=final_df)
-    cerebro.adddata(data)
-    cerebro.broker.setcash(100000)
-    cerebro.broker.setcommission(commission=0.0003)
-    cerebro.addstrategy(HeikinAshiSuperTrendStrategy,
-                       supertrend_period=best_params['supertrend_period'],
-                       supertrend_multiplier=best_params['supertrend_multiplier'])
-    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
-    cerebro.addanalyzer(TradeRecorder, _name='trade_recorder')  # 添加交易记录分析器
-
-    # 设置图表样式
-    # cerebro.addobserver(bt.observers.Broker)
-    # cerebro.addobserver(bt.observers.Trades)
-    # cerebro.addobserver(bt.observers.BuySell)
-
-    results = cerebro.run()
 
-    # 绘制并保存图表
-    # figure = cerebro.plot(style='candlestick', barup='red', bardown='green', volume=True)[0][0]
-    # figure.savefig(f'{STOCK_CODE}_backtrader_plot.png')
-
-    strat = results[0]
-    returns = pd.Series(strat.analyzers.timereturn.get_analysis())
-    
-    # 将30分钟收益聚合为日度收益
-    returns.index = pd.to_datetime(returns.index)
-    daily_returns = (1 + returns).groupby(returns.index.date).prod() - 1
-    daily_returns.index = pd.to_datetime(daily_returns.index)
-    daily_returns.name = 'SuperTrend'
-    
-    # 使用已获取的基准数据
-    benchmark_returns = problem.benchmark_returns
-    
-    # 确保两个时间序列的索引对齐
-    aligned_dates = daily_returns.index.intersection(benchmark_returns.index)
-    daily_returns = daily_returns[aligned_dates]
-    benchmark_returns = benchmark_returns[aligned_dates]
-    
-    # 删除任何包含NaN的数据
-    valid_data = ~(daily_returns.isna() | benchmark_returns.isna())
-    daily_returns = daily_returns[valid_data]
-    benchmark_returns = benchmark_returns[valid_data]
-        
-    # 确保数据类型一致
-    daily_returns = daily_returns.astype(float)
-    benchmark_returns = benchmark_returns.astype(float)
-    
-    # 最后检查确保长度一致
-    if len(daily_returns) != len(benchmark_returns):
-        raise ValueError(f"数据长度不一致: 策略={len(daily_returns)}, 基准={len(benchmark_returns)}")
-    
-    # 计算并打印最终结果
-    metrics = {
-        'stock_code': STOCK_CODE,
-        'period': best_params["supertrend_period"],
-        'multiplier': best_params["supertrend_multiplier"],
-        # 风险调整收益
-        'sharpe': qs.stats.sharpe(daily_returns),
-        'sortino': qs.stats.sortino(daily_returns),
-        'calmar': qs.stats.calmar(daily_returns),
-        'adjusted_sortino': qs.stats.adjusted_sortino(daily_returns),
-        'gain_to_pain_ratio': qs.stats.gain_to_pain_ratio(daily_returns),
-        'risk_of_ruin': qs.stats.risk_of_ruin(daily_returns),
-        'risk_return_ratio': qs.stats.risk_return_ratio(daily_returns),
-        # 胜率 & 盈亏比
-        'win_rate': qs.stats.win_rate(daily_returns) * 100,
-        'profit_factor': qs.stats.profit_factor(daily_returns),
-        'profit_ratio': qs.stats.profit_ratio(daily_returns),
-        'win_loss_ratio': qs.stats.win_loss_ratio(daily_returns),
-        'payoff_ratio': qs.stats.payoff_ratio(daily_returns),
-        'consecutive_losses': qs.stats.consecutive_losses(daily_returns),
-        'consecutive_wins': qs.stats.consecutive_wins(daily_returns),
-        # 收益相关指标
-        'avg_return': qs.stats.avg_return(daily_returns) * 100,
-        'avg_win': qs.stats.avg_win(daily_returns) * 100,
-        'avg_loss': qs.stats.avg_loss(daily_returns) * 100,
-        'best': qs.stats.best(daily_returns) * 100,
-        'worst': qs.stats.worst(daily_returns) * 100,
-        'expected_return': qs.stats.expected_return(daily_returns) * 100,
-        'expected_shortfall': qs.stats.expected_shortfall(daily_returns),
-        'rar': qs.stats.rar(daily_returns),
-        # 风险 & 回撤
-        'volatility': qs.stats.volatility(daily_returns) * 100,
-        'max_drawdown': qs.stats.max_drawdown(daily_returns) * 100,
-        'ulcer_index': qs.stats.ulcer_index(daily_returns),
-        'ulcer_performance_index': qs.stats.ulcer_performance_index(daily_returns),
-        'value_at_risk': qs.stats.value_at_risk(daily_returns),
-        'tail_ratio': qs.stats.tail_ratio(daily_returns),
-        'recovery_factor': qs.stats.recovery_factor(daily_returns),
-        # 年化收益 & 复利相关
-        'cagr': qs.stats.cagr(daily_returns) * 100,
-        'compsum': qs.stats.compsum(daily_returns).iloc[-1] * 100,
-        # 统计指标
-        'skew': qs.stats.skew(daily_returns),
-        'kurtosis': qs.stats.kurtosis(daily_returns),
-        'outlier_loss_ratio': qs.stats.outlier_loss_ratio(daily_returns),
-        'outlier_win_ratio': qs.stats.outlier_win_ratio(daily_returns),
-        'geometric_mean': qs.stats.geometric_mean(daily_returns) * 100,
-        # 组合管理 & 风险衡量
-        'cpc_index': qs.stats.cpc_index(daily_returns),
-        'kelly_criterion': qs.stats.kelly_criterion(daily_returns),
-        'common_sense_ratio': qs.stats.common_sense_ratio(daily_returns),
-        'exposure': qs.stats.exposure(daily_returns) * 100,
-        'ghpr': qs.stats.ghpr(daily_returns),
-        # 需要基准数据的指标
-        'information_ratio': qs.stats.information_ratio(daily_returns, benchmark_returns),
-        'r_squared': qs.stats.r_squared(daily_returns, benchmark_returns)
-    }
-    
     # 将指标保存为DataFrame并输出到CSV
-    metrics_df = pd.DataFrame([metrics])
-    csv_filename = f'{STOCK_CODE}_metrics.csv'
-    metrics_df.round(3).to_csv(csv_filename, index=False)
-    print(f'\n指标已保存到：{csv_filename}')
-    
+    metrics = stock_result(STOCK_CODE, config, best_params, objectives, daily_returns, benchmark_returns)
+    pd.DataFrame([metrics]).round(3).to_csv(f'{STOCK_CODE}_metrics.csv', index=False)
+    print(f'\n指标已保存到：{STOCK_CODE}_metrics.csv')
+
     # 打印主要指标
     print('\n=== 选定参数的回测结果 ===')
-    print(f'参数: period={best_params["supertrend_period"]}, multiplier={best_params["supertrend_multiplier"]}')
+    print(f'参数: period={metrics["period"]}, multiplier={metrics["multiplier"]}')
     print(f'Sortino Ratio: {metrics["sortino"]:.2f}')
     print(f'累积收益率: {metrics["compsum"]:.2f}%')
     print(f'胜率: {metrics["win_rate"]:.2f}%')
     print(f'盈亏比: {metrics["profit_factor"]:.2f}')
-    
+
     # 生成报告
     qs.reports.html(
-        daily_returns, 
+        daily_returns,
         benchmark=benchmark_returns,
         output=f'{STOCK_CODE}.html',
         download_filename=f'{STOCK_CODE}.html',
@@ -437,8 +128,7 @@ if __name__ == '__main__':
     print(f'\n已生成业绩报告：{STOCK_CODE}.html')
 
     # 保存交易记录
-    trade_recorder = strat.analyzers.trade_recorder.get_trades()
-    trades_df = pd.DataFrame(trade_recorder)
+    trades_df = trade_record(backtester, best_params)
     if not trades_df.empty:
         trades_df.round(3).to_csv(f'{STOCK_CODE}_trade_record.csv', index=False)
         print(f'\n交易记录已保存到：{STOCK_CODE}_trade_record.csv')
@@ -25,6 +25,8 @@ from wxpusher import WxPusher
 import requests
 from io import StringIO
 import csv
+import json
+import functools
 
 
 def convert_to_baostock_code(ts_code: str) -> str:
@@ -59,13 +61,72 @@ def get_mysql_connection_string(config):
     mysql_config = config['mysql']
     return f"mysql+pymysql://{mysql_config['user']}:{mysql_config['password']}@{mysql_config['host']}:{mysql_config['port']}/{mysql_config['database']}"
 
+ADJ_FACTOR_TABLE = 'a_stock_adj_factor_baostock'
+
+def get_adj_factors(ts_codes, engine=None) -> pd.DataFrame:
+    """读取指定股票的复权因子(按除权除息日)，返回ts_code, divid_operate_date, back_adjust_factor"""
+    if engine is None:
+        config = load_config()
+        engine = create_engine(get_pg_connection_string(config))
+    if isinstance(ts_codes, str):
+        ts_codes = [ts_codes]
+    codes = "', '".join(ts_codes)
+    query = f"""
+        SELECT ts_code, divid_operate_date, back_adjust_factor
+        FROM {ADJ_FACTOR_TABLE}
+        WHERE ts_code IN ('{codes}')
+        ORDER BY ts_code, divid_operate_date
+    """
+    factors = pd.read_sql(query, engine)
+    factors['divid_operate_date'] = pd.to_datetime(factors['divid_operate_date'])
+    factors['back_adjust_factor'] = pd.to_numeric(factors['back_adjust_factor'], errors='coerce')
+    return factors
+
+def apply_adj_factor(df: pd.DataFrame, factors: pd.DataFrame, fq_code: str,
+                     price_columns=('open', 'high', 'low', 'close')) -> pd.DataFrame:
+    """
+    对不复权K线向量化计算前/后复权价格
+    后复权价 = 不复权价 × 当时的后复权因子
+    前复权价 = 不复权价 × 当时的后复权因子 / 最新的后复权因子
+    前复权只依赖最新因子，除权后无需重新下载历史数据
+    Args:
+        df: 不复权K线，包含trade_time, ts_code及价格列，可包含多只股票
+        factors: get_adj_factors返回的复权因子
+        fq_code: 'qfq'前复权，'hfq'后复权，'wfq'原样返回
+    """
+    if fq_code == 'wfq' or df.empty:
+        return df
+    df = df.copy()
+    trade_time = pd.to_datetime(df['trade_time'])
+    factor = np.ones(len(df))
+    latest = np.ones(len(df))
+    codes = df['ts_code'].to_numpy()
+    for ts_code, group in factors.groupby('ts_code', sort=False):
+        rows = np.flatnonzero(codes == ts_code)
+        if len(rows) == 0:
+            continue
+        event_dates = group['divid_operate_date'].to_numpy(dtype='datetime64[ns]')
+        event_factors = group['back_adjust_factor'].to_numpy(dtype=float)
+        # 除权除息日当天起生效，首个复权事件之前因子为1
+        idx = np.searchsorted(event_dates, trade_time.to_numpy()[rows], side='right') - 1
+        factor[rows] = np.where(idx >= 0, event_factors[np.maximum(idx, 0)], 1.0)
+        latest[rows] = event_factors[-1]
+    if fq_code == 'qfq':
+        factor = factor / latest
+    for col in price_columns:
+        df[col] = df[col] * factor
+    return df
+
 def get_30m_kline_data(fq_code, ts_code, start_date=None, end_date=None):
-    """从PostgreSQL数据库获取股票数据，返回DataFrame"""
+    """
+    从PostgreSQL数据库获取股票数据，返回DataFrame
+    只存储不复权K线，qfq/hfq在读取时按复权因子计算
+    """
     config = load_config()
     engine = create_engine(get_pg_connection_string(config))
     query = f"""
         SELECT trade_time, ts_code, open, high, low, close, volume, amount
-        FROM a_stock_30m_kline_{fq_code}_baostock
+        FROM a_stock_30m_kline_wfq_baostock
         WHERE ts_code = '{ts_code}'
     """
     # 添加日期范围条件
@@ -82,6 +143,8 @@ def get_30m_kline_data(fq_code, ts_code, start_date=None, end_date=None):
         df[col] = pd.to_numeric(df[col], errors='coerce')
     # 删除任何包含 NaN 的行
     df = df.dropna()
+    if fq_code in ('qfq', 'hfq'):
+        df = apply_adj_factor(df, get_adj_factors(ts_code, engine), fq_code)
     return df
 
 def setup_logger(prefix: str = None) -> logger:
@@ -253,6 +316,65 @@ def format_time(time_str):
     minute = time_str[10:12]
     return f"{hour}:{minute}:00"
 
+# ================================= A股交易时段 =================================
+MORNING_OPEN     = 9 * 60 + 30   # 09:30，自0点起的分钟数
+MORNING_CLOSE    = 11 * 60 + 30  # 11:30
+AFTERNOON_OPEN   = 13 * 60       # 13:00
+AFTERNOON_CLOSE  = 15 * 60       # 15:00
+MORNING_MINUTES  = MORNING_CLOSE - MORNING_OPEN        # 上午连续竞价120分钟
+SESSION_MINUTES  = MORNING_MINUTES + AFTERNOON_CLOSE - AFTERNOON_OPEN  # 全天240分钟
+BAR_MINUTES = {'5m': 5, '15m': 15, '30m': 30, '60m': 60, '1day': SESSION_MINUTES}
+
+def session_minute(clock_minute):
+    """
+    将时钟分钟数(自0点起)转换为交易时段内的分钟数(0~240)，向量化
+    午休期间(11:30~13:00)统一归到上午收盘(120)，开盘前归0，收盘后归240
+    """
+    clock_minute = np.asarray(clock_minute)
+    minute = np.where(clock_minute <= MORNING_CLOSE, clock_minute - MORNING_OPEN,
+             np.where(clock_minute <= AFTERNOON_OPEN, MORNING_MINUTES,
+                      clock_minute - AFTERNOON_OPEN + MORNING_MINUTES))
+    return np.clip(minute, 0, SESSION_MINUTES)
+
+def clock_minute(session_min):
+    """将交易时段内的分钟数转换回时钟分钟数，120对应11:30，240对应15:00"""
+    session_min = np.asarray(session_min)
+    return np.where(session_min <= MORNING_MINUTES, MORNING_OPEN + session_min,
+                    AFTERNOON_OPEN + session_min - MORNING_MINUTES)
+
+def bar_end_minutes(freq: str) -> np.ndarray:
+    """
+    返回指定周期在一个交易日内所有K线的结束时钟分钟数
+    K线时间采用右端点标记，与baostock/QMT一致，如30m为10:00,10:30,11:00,11:30,13:30,...,15:00
+    """
+    n = BAR_MINUTES[freq]
+    return clock_minute(np.arange(n, SESSION_MINUTES + 1, n))
+
+def bar_bucket_end(trade_time, freq: str) -> np.ndarray:
+    """
+    计算每根K线所属目标周期K线的结束时间(向量化)，用于将小周期K线聚合为大周期
+    Args:
+        trade_time: 小周期K线时间(右端点标记)，可为Series/ndarray
+        freq: 目标周期，见BAR_MINUTES
+    Returns:
+        np.ndarray: datetime64[ns]数组
+    """
+    trade_time = np.asarray(pd.to_datetime(trade_time), dtype='datetime64[ns]')
+    day = trade_time.astype('datetime64[D]')
+    minute = (trade_time - day) // np.timedelta64(1, 'm')
+    n = BAR_MINUTES[freq]
+    # 09:30集合竞价K线(时段分钟为0)并入第一根K线
+    bucket = np.maximum(np.ceil(session_minute(minute) / n), 1).astype(np.int64)
+    end_minute = clock_minute(np.minimum(bucket * n, SESSION_MINUTES))
+    return (day + end_minute.astype('timedelta64[m]')).astype('datetime64[ns]')
+
+def qmt_time_to_datetime(ms) -> pd.Series:
+    """
+    将QMT返回的毫秒时间戳转换为北京时间(不带时区)，向量化
+    不依赖本机时区，替代逐行datetime.fromtimestamp(机器时区非东八区时会整体时移)
+    """
+    return pd.to_datetime(pd.Series(ms), unit='ms', utc=True).dt.tz_convert('Asia/Shanghai').dt.tz_localize(None)
+
 # heikin_ashi函数
 def heikin_ashi(df):
     df = df.copy()
@@ -269,6 +391,37 @@ def supertrend(df, length, multiplier):
     df['direction'] = supertrend_df[f'SUPERTd_{length}_{multiplier}.0']
     return df
 
+def supertrend_batch(high, low, close, lengths, multipliers):
+    '''
+    一次计算多组(length, multiplier)的SuperTrend方向，逐K线递推与ta.supertrend相同(ATR同为talib.ATR)
+    每个length只算一次ATR，时间上只循环一遍，每根K线同时更新所有参数组合
+    Returns:
+        direction: (K线数, 参数组数)矩阵，第k列对应(lengths[k], multipliers[k])，1上涨，-1下跌
+    '''
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    lengths = np.asarray(lengths, dtype=int)
+    multipliers = np.asarray(multipliers, dtype=float)
+    atr = {length: talib.ATR(high, low, close, int(length)) for length in np.unique(lengths)}
+    matr = np.column_stack([atr[length] for length in lengths]) * multipliers
+    hl2 = ((high + low) / 2)[:, None]
+    upperband = hl2 + matr
+    lowerband = hl2 - matr
+
+    direction = np.ones((len(close), len(lengths)))
+    for i in range(1, len(close)):
+        up = close[i] > upperband[i - 1]
+        down = ~up & (close[i] < lowerband[i - 1])
+        hold = ~(up | down)
+        direction[i] = np.where(up, 1.0, np.where(down, -1.0, direction[i - 1]))
+        # 方向不变时收紧轨道：上涨中下轨不下移，下跌中上轨不上移
+        fix_lower = hold & (direction[i] > 0) & (lowerband[i] < lowerband[i - 1])
+        lowerband[i] = np.where(fix_lower, lowerband[i - 1], lowerband[i])
+        fix_upper = hold & (direction[i] < 0) & (upperband[i] > upperband[i - 1])
+        upperband[i] = np.where(fix_upper, upperband[i - 1], upperband[i])
+    return direction
+
 def ha_st_pandas_ta(df, length, multiplier):
     '''direction=1上涨，-1下跌'''
     df = df.copy()
@@ -505,3 +658,144 @@ def retry_on_failure(max_retries=3, delay=1):
             return -1, False
         return wrapper
     return decorator
+
+
+# ================================= 阶段计时 =================================
+# 未启用时计时器只做一次标志判断；启用后各阶段按嵌套路径(如 optimize_stock/evaluate/backtest)累计
+# 调用次数、总耗时和最长耗时，每个进程在最外层阶段结束时把累计结果写入 {目录}/{pid}.json，
+# 进程池的工作进程通过环境变量继承启用状态，主进程最后用collect_profile汇总
+PROFILE_ENV = 'BT_PROFILE_DIR'
+_PROFILE = {'dir': os.environ.get(PROFILE_ENV), 'pid': os.getpid(), 'stack': [], 'stages': {}, 'counters': {}}
+
+def enable_profiling(run: str, directory: str = os.path.join('reports', 'profile')) -> str:
+    """
+    启用阶段计时(须在创建进程池之前调用)
+    Returns:
+        str: 本次运行的计时目录 {directory}/{run}_{时间}
+    """
+    profile_dir = os.path.join(directory, f"{run}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(profile_dir, exist_ok=True)
+    os.environ[PROFILE_ENV] = profile_dir
+    _PROFILE.update({'dir': profile_dir, 'pid': os.getpid(), 'stack': [], 'stages': {}, 'counters': {}, 'start': time.time()})
+    return profile_dir
+
+def profiling_enabled() -> bool:
+    return _PROFILE['dir'] is not None
+
+def _profile_state() -> dict:
+    """fork出的工作进程会继承父进程已累计的结果，首次计时时清空，避免重复计入"""
+    if _PROFILE['pid'] != os.getpid():
+        _PROFILE.update({'pid': os.getpid(), 'stack': [], 'stages': {}, 'counters': {}})
+    return _PROFILE
+
+class profile_stage:
+    """
+    阶段计时器，可作为上下文管理器或装饰器:
+        with profile_stage('backtest'):
+            ...
+        @profile_stage('optimize_stock')
+        def optimize_stock(stock_code): ...
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = None
+
+    def __enter__(self):
+        if _PROFILE['dir'] is None:
+            return self
+        _profile_state()['stack'].append(self.name)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.t0 is None:
+            return False
+        elapsed = time.perf_counter() - self.t0
+        self.t0 = None
+        stack = _PROFILE['stack']
+        path = '/'.join(stack)
+        stack.pop()
+        stat = _PROFILE['stages'].setdefault(path, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+        if not stack:
+            flush_profile()
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILE['dir'] is None:
+                return func(*args, **kwargs)
+            with profile_stage(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+def profile_count(name: str, n: int = 1) -> None:
+    """累加计数器(如评估次数、缓存命中、K线行数)"""
+    if _PROFILE['dir'] is not None:
+        counters = _profile_state()['counters']
+        counters[name] = counters.get(name, 0) + n
+
+def flush_profile() -> None:
+    """把本进程的累计结果写入 {pid}.json，先写临时文件再替换"""
+    if _PROFILE['dir'] is None or not _profile_state()['stages']:
+        return
+    path = os.path.join(_PROFILE['dir'], f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'stages': _PROFILE['stages'], 'counters': _PROFILE['counters']}, f)
+    os.replace(f'{path}.tmp', path)
+
+def collect_profile(profile_dir: str = None, show: bool = True) -> dict:
+    """
+    汇总各进程的计时结果，写入 {profile_dir}/summary.json 并打印阶段耗时表
+    share为该阶段总耗时占上一级阶段总耗时的比例(最外层阶段占全部最外层阶段之和)
+    """
+    profile_dir = profile_dir or _PROFILE['dir']
+    if profile_dir is None:
+        return {}
+    flush_profile()
+    stages, counters, pids = {}, {}, []
+    for name in os.listdir(profile_dir):
+        if not name.endswith('.json') or name == 'summary.json':
+            continue
+        with open(os.path.join(profile_dir, name), encoding='utf-8') as f:
+            data = json.load(f)
+        pids.append(data['pid'])
+        for path, (calls, total, longest) in data['stages'].items():
+            stat = stages.setdefault(path, [0, 0.0, 0.0])
+            stat[0] += calls
+            stat[1] += total
+            stat[2] = max(stat[2], longest)
+        for key, n in data['counters'].items():
+            counters[key] = counters.get(key, 0) + n
+
+    top_total = sum(total for path, (_, total, _) in stages.items() if '/' not in path) or 1.0
+    rows = []
+    for path, (calls, total, longest) in stages.items():
+        parent = path.rsplit('/', 1)[0] if '/' in path else None
+        base = stages[parent][1] if parent in stages else top_total
+        rows.append({'stage': path, 'calls': calls, 'total_s': total, 'mean_ms': total / calls * 1000,
+                     'max_ms': longest * 1000, 'share': total / base if base else 0.0})
+    rows.sort(key=lambda row: row['stage'])
+    summary = {
+        'profile_dir': profile_dir,
+        'wall_seconds': time.time() - _PROFILE['start'] if 'start' in _PROFILE else None,
+        'processes': len(pids),
+        'stages': rows,
+        'counters': counters,
+    }
+    with open(os.path.join(profile_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if show:
+        table = pd.DataFrame(rows, columns=['stage', 'calls', 'total_s', 'mean_ms', 'max_ms', 'share'])
+        table['stage'] = [('  ' * path.count('/')) + path.rsplit('/', 1)[-1] for path in table['stage']]
+        table['share'] = [f'{share:.1%}' for share in table['share']]
+        print(f"\n阶段耗时 ({len(pids)} 个进程，计时目录 {profile_dir}):")
+        print(table.to_string(index=False))
+        if counters:
+            print('计数: ' + ', '.join(f'{key}={n}' for key, n in sorted(counters.items())))
+    return summary
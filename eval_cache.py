@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+参数优化的评估结果持久化缓存
+
+各优化脚本(pymoo / DEAP / 贝叶斯 / 网格)在每次回测前先查询本缓存，命中则直接返回目标值和指标，
+未命中才回测并写入。键为 (策略, 股票, 数据版本, 参数)：
+- 策略     区分脚本及其评分口径，评分逻辑变化时应更换策略名(如加版本后缀)
+- 数据版本 由K线及基准数据内容哈希得到，数据更新或回测区间变化后自动失效
+- 参数     按参数名排序后的JSON
+
+缓存存放在 cache/eval_store.sqlite，多进程可同时读写；重复运行或增加迭代代数时只计算新的参数点
+
+用法:
+    store = EvalStore('ha_st_mult_tscode', stock_code, data_version(df, benchmark_returns))
+    cached = store.get(params)
+    if cached is None:
+        ...回测...
+        store.put(params, objectives, metrics)
+"""
+from common import *
+import argparse
+import hashlib
+import json
+import sqlite3
+
+
+# ================================= 定义初始变量 =================================
+EVAL_STORE_PATH = os.path.join('cache', 'eval_store.sqlite')
+EVAL_TABLE = 'eval_store'
+
+
+# ================================= 键的构造 =================================
+def _to_builtin(value):
+    """numpy标量/数组转换为可JSON序列化的Python类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'无法序列化的类型: {type(value)}')
+
+def params_key(params: dict) -> str:
+    """参数字典的规范化键，整数值的浮点数(如3.0)与整数视为同一参数"""
+    normalized = {}
+    for name, value in params.items():
+        value = _to_builtin(value) if isinstance(value, np.generic) else value
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, default=_to_builtin)
+
+def data_version(*frames) -> str:
+    """对参与评估的数据(K线、基准收益等)按索引和内容求哈希，作为数据版本"""
+    digest = hashlib.sha1()
+    for frame in frames:
+        if frame is None:
+            digest.update(b'none')
+            continue
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+        if isinstance(frame, pd.DataFrame):
+            digest.update(','.join(map(str, frame.columns)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# ================================= 评估缓存 =================================
+class EvalStore:
+    """
+    绑定到(策略, 股票, 数据版本)的评估缓存，初始化时载入该范围内的已有结果
+    数据库连接按需打开，对象可被复制或传入子进程
+    """
+
+    def __init__(self, strategy: str, ts_code: str, version: str, path: str = EVAL_STORE_PATH):
+        self.strategy = strategy
+        self.ts_code = ts_code
+        self.version = version
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = None
+        rows = self._connection().execute(
+            f'SELECT params, objectives, metrics FROM {EVAL_TABLE} WHERE strategy = ? AND ts_code = ? AND data_version = ?',
+            (strategy, ts_code, version)).fetchall()
+        self.memo = {params: (json.loads(objectives), json.loads(metrics) if metrics else None)
+                     for params, objectives, metrics in rows}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = connect(self.path)
+        return self.conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['conn'] = None
+        return state
+
+    def get(self, params: dict):
+        """返回(objectives, metrics)，未评估过返回None"""
+        result = self.memo.get(params_key(params))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, params: dict, objectives, metrics: dict = None) -> None:
+        """写入一次评估结果，objectives为目标值序列(如pymoo的F行、DEAP的fitness)"""
+        key = params_key(params)
+        objectives = [float(v) for v in np.atleast_1d(objectives)]
+        self.memo[key] = (objectives, metrics)
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {EVAL_TABLE} '
+                    '(strategy, ts_code, data_version, params, objectives, metrics, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.strategy, self.ts_code, self.version, key, json.dumps(objectives),
+                     json.dumps(metrics, default=_to_builtin) if metrics is not None else None,
+                     datetime.now().isoformat(timespec='seconds')))
+        except sqlite3.Error as e:
+            logger.error(f"写入评估缓存失败 {self.strategy} {self.ts_code} {key}: {str(e)}")
+
+    def summary(self) -> str:
+        return f'评估缓存 {self.strategy} {self.ts_code}: 命中 {self.hits} 次，新评估 {self.misses} 次，累计 {len(self.memo)} 组参数'
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def connect(path: str = EVAL_STORE_PATH) -> sqlite3.Connection:
+    """打开缓存库并建表；WAL模式允许多个优化进程并发读写"""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {EVAL_TABLE} (
+        strategy TEXT NOT NULL,
+        ts_code TEXT NOT NULL,
+        data_version TEXT NOT NULL,
+        params TEXT NOT NULL,
+        objectives TEXT NOT NULL,
+        metrics TEXT,
+        created_at TEXT,
+        PRIMARY KEY (strategy, ts_code, data_version, params)
+    )
+    """)
+    return conn
+
+def open_store(strategy: str, ts_code: str, version: str, enabled: bool = True, path: str = EVAL_STORE_PATH):
+    """按开关创建缓存，禁用或打开失败时返回None(调用方照常回测)"""
+    if not enabled:
+        return None
+    try:
+        return EvalStore(strategy, ts_code, version, path)
+    except sqlite3.Error as e:
+        logger.error(f"打开评估缓存失败 {path}: {str(e)}")
+        return None
+
+
+# ================================= 命令行 =================================
+def main():
+    parser = argparse.ArgumentParser(description='参数优化评估缓存管理')
+    parser.add_argument('--path', type=str, default=EVAL_STORE_PATH, help=f'缓存文件 (默认: {EVAL_STORE_PATH})')
+    parser.add_argument('--strategy', type=str, help='只处理指定策略')
+    parser.add_argument('--clear', action='store_true', help='删除(指定策略的)缓存记录')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f'缓存文件不存在: {args.path}')
+        return
+    conn = connect(args.path)
+    where, params = ('WHERE strategy = ?', (args.strategy,)) if args.strategy else ('', ())
+    if args.clear:
+        with conn:
+            deleted = conn.execute(f'DELETE FROM {EVAL_TABLE} {where}', params).rowcount
+        print(f'已删除 {deleted} 条评估记录')
+    else:
+        stats_df = pd.read_sql(
+            f'SELECT strategy, COUNT(DISTINCT ts_code) AS stocks, COUNT(DISTINCT data_version) AS data_versions, '
+            f'COUNT(*) AS evaluations, MAX(created_at) AS last_update FROM {EVAL_TABLE} {where} GROUP BY strategy',
+            conn, params=params)
+        print(stats_df.to_string(index=False) if not stats_df.empty else '缓存为空')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
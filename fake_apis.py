@@ -0,0 +1,749 @@
+# -*- coding: utf-8 -*-
+"""
+baostock / tushare / xtquant 离线替身服务，用于在本机对数据入库脚本做端到端吞吐测试
+
+- 覆盖脚本实际用到的接口：
+  baostock: login, logout, query_history_k_data_plus, query_adjust_factor, query_sz50/hs300/zz500_stocks
+  tushare.pro_api: trade_cal, daily, daily_basic, moneyflow, moneyflow_ind_ths, index_dailybasic,
+                   index_weight, ths_index, ths_member
+  xtquant.xtdata: download_history_data, get_local_data, get_market_data_ex, get_stock_list_in_sector,
+                  get_full_tick, subscribe_quote, unsubscribe_quote, run
+- 行情由(股票代码, 交易日, K线序号)哈希确定性生成：同一根K线无论按什么日期区间、周期查询结果都一致，
+  30m/60m/日线由5m聚合得到；含上市日期、随机停牌、复权因子、日内U型成交量
+- 可配置调用延迟、错误率和tushare每分钟调用额度，运行结束输出各接口调用次数、失败次数和耗时
+
+用法(在替身环境中运行任意脚本，脚本本身无需修改，数据写入config.ini配置的数据库):
+    python fake_apis.py --latency 0.05 --error-rate 0.01 a_stock_5m_kline_wfq_baostock.py
+    python fake_apis.py --n-stocks 500 --tushare-rate-limit 500 a_stock_daily_task.py
+    python fake_apis.py backfill_orchestrator.py --job baostock_30m_wfq --start-date 20240101
+"""
+from common import *
+import argparse
+import runpy
+import threading
+import types
+import zlib
+from collections import defaultdict
+from functools import partial
+
+
+# ================================= 定义初始变量 =================================
+STOCK_LIST_FILE = '沪深A股_stock_list.csv'
+BASE_FREQ = '5m'
+BARS_PER_DAY = len(bar_end_minutes(BASE_FREQ))
+BAOSTOCK_FREQ = {'5': '5m', '15': '15m', '30': '30m', '60': '60m', 'd': '1day'}
+QMT_FREQ = {'5m': '5m', '15m': '15m', '30m': '30m', '1h': '60m', '60m': '60m', '1d': '1day'}
+THS_INDUSTRY_COUNT = 90
+THS_CONCEPT_COUNT = 300
+CSI_SIZES = {'000016.SH': 50, '000300.SH': 300, '000905.SH': 500, '000852.SH': 1000}
+
+
+class FakeApiError(Exception):
+    """离线服务模拟的接口错误"""
+
+
+# ================================= 确定性随机数 =================================
+def _mix(*keys) -> np.ndarray:
+    """splitmix64哈希，keys按numpy广播规则组合，相同输入得到相同输出"""
+    shape = np.broadcast(*[np.asarray(k) for k in keys]).shape
+    x = np.zeros(shape, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in keys:
+            x = x ^ np.asarray(k).astype(np.uint64)
+            x = x + np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x = x ^ (x >> np.uint64(31))
+    return x
+
+def _uniform(*keys) -> np.ndarray:
+    """(0, 1)均匀分布"""
+    return ((_mix(*keys) >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+
+def _normal(*keys) -> np.ndarray:
+    """标准正态分布(Box-Muller)"""
+    return np.sqrt(-2 * np.log(_uniform(*keys, 1))) * np.cos(2 * np.pi * _uniform(*keys, 2))
+
+def _code_seed(ts_codes) -> np.ndarray:
+    return np.array([zlib.crc32(code.encode()) for code in ts_codes], dtype=np.uint64)
+
+
+# ================================= 合成行情 =================================
+class SyntheticMarket:
+    """合成A股行情：交易日历、股票池、分钟/日K线、复权因子、资金流和同花顺指数"""
+
+    def __init__(self, n_stocks: int = 300, suspend_rate: float = 0.005, seed: int = 0):
+        self.n_stocks = n_stocks
+        self.suspend_rate = suspend_rate
+        self.seed = np.uint64(seed)
+        self._universe = None
+
+    # ---------------- 日历与股票池 ----------------
+    @staticmethod
+    def trade_days(start, end) -> np.ndarray:
+        """交易日：工作日剔除元旦、劳动节(5/1-5/3)和国庆(10/1-10/7)"""
+        days = pd.bdate_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize())
+        holiday = ((days.month == 1) & (days.day == 1)) | ((days.month == 5) & (days.day <= 3)) | \
+                  ((days.month == 10) & (days.day <= 7))
+        return days[~holiday].to_numpy(dtype='datetime64[D]')
+
+    def universe(self) -> List[str]:
+        """股票池：优先使用沪深A股股票列表，否则生成沪深各半的代码"""
+        if self._universe is None:
+            if os.path.exists(STOCK_LIST_FILE):
+                codes = pd.read_csv(STOCK_LIST_FILE, header=None, names=['ts_code'])['ts_code'].tolist()
+            else:
+                half = self.n_stocks // 2
+                codes = [f"{600000 + i:06d}.SH" for i in range(self.n_stocks - half)] + \
+                        [f"{1 + i:06d}.SZ" for i in range(half)]
+            self._universe = codes[:self.n_stocks]
+        return self._universe
+
+    def list_dates(self, ts_codes) -> np.ndarray:
+        """上市日期：2000年至2022年间按代码哈希分布"""
+        seed = _code_seed(ts_codes)
+        return np.datetime64('2000-01-01') + (seed % np.uint64(23 * 365)).astype('timedelta64[D]')
+
+    # ---------------- K线 ----------------
+    def base_bars(self, ts_codes, days) -> dict:
+        """
+        生成5m K线，数组形状均为 (股票数, 交易日数, 48)
+        日内价格为对数随机游走，日间价格围绕按代码哈希确定的水平做慢速波动
+        """
+        seed = (_code_seed(ts_codes) ^ self.seed)[:, None, None]
+        d = np.asarray(days, dtype='datetime64[D]').astype(np.int64)[None, :, None]
+        slot = np.arange(BARS_PER_DAY)[None, None, :]
+
+        base = 3 + (seed % np.uint64(5000)).astype(float) / 100
+        phase = 2 * np.pi * _uniform(seed, 7)
+        level = base * np.exp(0.35 * np.sin(2 * np.pi * d / 500 + phase) + 0.12 * np.sin(2 * np.pi * d / 45 + 2 * phase))
+        day_open = level * (1 + 0.01 * _normal(seed, d, 99))
+        close = day_open * np.exp(np.cumsum(0.0025 * _normal(seed, d, slot), axis=2))
+        open_ = np.concatenate([np.broadcast_to(day_open, close[..., :1].shape), close[..., :-1]], axis=2)
+        high = np.maximum(open_, close) * (1 + 0.0015 * np.abs(_normal(seed, d, slot, 3)))
+        low = np.minimum(open_, close) * (1 - 0.0015 * np.abs(_normal(seed, d, slot, 4)))
+        open_, high, low, close = (np.round(x, 2) for x in (open_, high, low, close))
+
+        u_shape = 1 + 1.5 * ((slot - (BARS_PER_DAY - 1) / 2) / ((BARS_PER_DAY - 1) / 2)) ** 2
+        volume = np.round(u_shape * np.exp(0.6 * _normal(seed, d, slot, 5)) *
+                          (50 + (seed % np.uint64(500)).astype(float))) * 100
+        amount = np.round(volume * (open_ + high + low + close) / 4, 2)
+
+        listed = np.asarray(days, dtype='datetime64[D]')[None, :] >= self.list_dates(ts_codes)[:, None]
+        suspended = _uniform(seed[..., 0], d[..., 0], 11) < self.suspend_rate
+        return {'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume, 'amount': amount,
+                'valid': listed & ~suspended}
+
+    def bars(self, ts_codes, days, freq: str) -> dict:
+        """生成指定周期K线，由5m按固定根数聚合，另返回每根K线的结束时间 times (交易日数, K线数)"""
+        bars = self.base_bars(ts_codes, days)
+        k = BAR_MINUTES[freq] // BAR_MINUTES[BASE_FREQ]
+        if k > 1:
+            shape = bars['close'].shape[:2] + (BARS_PER_DAY // k, k)
+            reshaped = {name: bars[name].reshape(shape) for name in ['open', 'high', 'low', 'close', 'volume', 'amount']}
+            bars.update({
+                'open': reshaped['open'][..., 0],
+                'high': reshaped['high'].max(axis=3),
+                'low': reshaped['low'].min(axis=3),
+                'close': reshaped['close'][..., -1],
+                'volume': reshaped['volume'].sum(axis=3),
+                'amount': reshaped['amount'].sum(axis=3),
+            })
+        minutes = bar_end_minutes(freq) if freq != '1day' else np.zeros(1, dtype=np.int64)
+        days = np.asarray(days, dtype='datetime64[D]').astype('datetime64[m]')
+        bars['times'] = days[:, None] + minutes[None, :].astype('timedelta64[m]')
+        return bars
+
+    def bars_frame(self, ts_code: str, start, end, freq: str, include_prev_close: bool = False) -> pd.DataFrame:
+        """单只股票在日期区间内的K线(长表)，停牌和上市前的交易日没有K线"""
+        days = self.trade_days(start, end)
+        if len(days) == 0:
+            return pd.DataFrame()
+        bars = self.bars([ts_code], days, freq)
+        valid = np.repeat(bars['valid'][0], bars['times'].shape[1])
+        df = pd.DataFrame({
+            'trade_time': bars['times'].ravel(),
+            'open': bars['open'][0].ravel(),
+            'high': bars['high'][0].ravel(),
+            'low': bars['low'][0].ravel(),
+            'close': bars['close'][0].ravel(),
+            'volume': bars['volume'][0].ravel(),
+            'amount': bars['amount'][0].ravel(),
+        })
+        if include_prev_close:
+            df['pre_close'] = df['close'].shift(1).fillna(df['open'])
+        return df[valid].reset_index(drop=True)
+
+    def daily_snapshot(self, trade_date) -> pd.DataFrame:
+        """全市场某交易日的日线(含前收盘)，用于tushare按trade_date查询的接口"""
+        codes = self.universe()
+        day = np.datetime64(pd.Timestamp(trade_date).date(), 'D')
+        prev_days = self.trade_days(pd.Timestamp(day) - pd.Timedelta(days=15), pd.Timestamp(day) - pd.Timedelta(days=1))
+        days = np.array([prev_days[-1] if len(prev_days) else day - 1, day], dtype='datetime64[D]')
+        bars = self.bars(codes, days, '1day')
+        df = pd.DataFrame({
+            'ts_code': codes,
+            'trade_date': pd.Timestamp(day).strftime('%Y%m%d'),
+            'open': bars['open'][:, 1, 0],
+            'high': bars['high'][:, 1, 0],
+            'low': bars['low'][:, 1, 0],
+            'close': bars['close'][:, 1, 0],
+            'pre_close': bars['close'][:, 0, 0],
+            'vol': bars['volume'][:, 1, 0] / 100,
+            'amount': bars['amount'][:, 1, 0] / 1000,
+        })
+        df['change'] = (df['close'] - df['pre_close']).round(2)
+        df['pct_chg'] = (df['change'] / df['pre_close'] * 100).round(4)
+        return df[bars['valid'][:, 1]].reset_index(drop=True)
+
+    # ---------------- 复权因子 ----------------
+    def adj_factors(self, ts_code: str) -> pd.DataFrame:
+        """每年6-7月一次除权除息，后复权因子逐次累乘"""
+        seed = _code_seed([ts_code])[0]
+        list_date = self.list_dates([ts_code])[0]
+        years = np.arange(pd.Timestamp(list_date).year + 1, date.today().year + 1)
+        if len(years) == 0:
+            return pd.DataFrame(columns=['divid_operate_date', 'back_adjust_factor'])
+        offsets = (_mix(seed, years) % np.uint64(40)).astype(int)
+        event_days = np.array([f"{y}-06-10" for y in years], dtype='datetime64[D]') + offsets.astype('timedelta64[D]')
+        steps = 1.01 + 0.03 * _uniform(seed, years, 13)
+        return pd.DataFrame({'divid_operate_date': event_days, 'back_adjust_factor': np.round(np.cumprod(steps), 6)})
+
+    # ---------------- 指数与板块 ----------------
+    def ths_indices(self) -> pd.DataFrame:
+        industries = pd.DataFrame({
+            'ts_code': [f"{881101 + i}.TI" for i in range(THS_INDUSTRY_COUNT)],
+            'name': [f"行业{i + 1:02d}" for i in range(THS_INDUSTRY_COUNT)],
+            'type': 'I',
+        })
+        concepts = pd.DataFrame({
+            'ts_code': [f"{885300 + i}.TI" for i in range(THS_CONCEPT_COUNT)],
+            'name': [f"概念{i + 1:03d}" for i in range(THS_CONCEPT_COUNT)],
+            'type': 'N',
+        })
+        df = pd.concat([industries, concepts], ignore_index=True)
+        df['exchange'] = 'A'
+        df['list_date'] = '20100101'
+        df['count'] = [len(self.ths_members(code)) for code in df['ts_code']]
+        return df[['ts_code', 'name', 'count', 'exchange', 'list_date', 'type']]
+
+    def stock_industry(self, ts_codes) -> np.ndarray:
+        """每只股票属于一个行业指数"""
+        return (_code_seed(ts_codes) % np.uint64(THS_INDUSTRY_COUNT)).astype(int)
+
+    def ths_members(self, index_code: str) -> List[str]:
+        codes = np.asarray(self.universe())
+        number = int(index_code.split('.')[0])
+        if number < 885300:
+            return codes[self.stock_industry(codes) == number - 881101].tolist()
+        # 概念指数：每只股票以3%概率归入
+        return codes[_uniform(_code_seed(codes), number) < 0.03].tolist()
+
+    def csi_members(self, index_code: str) -> List[str]:
+        return self.universe()[:CSI_SIZES.get(index_code, 300)]
+
+
+# ================================= 调用模拟(延迟/错误/限频/统计) =================================
+class FakeServer:
+    """所有替身接口共享的延迟、错误注入、限频与调用统计"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, tushare_rate_limit: int = 0,
+                 market: SyntheticMarket = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tushare_rate_limit = tushare_rate_limit
+        self.market = market or SyntheticMarket()
+        self.lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.rows = defaultdict(int)
+        self.elapsed = defaultdict(float)
+        self.recent = defaultdict(list)
+        self.rng = np.random.default_rng()
+
+    def enter(self, api: str) -> None:
+        """模拟网络延迟(对数正态抖动)、随机错误和tushare每分钟额度，出错时抛出FakeApiError"""
+        with self.lock:
+            self.calls[api] += 1
+            delay = self.latency * self.rng.lognormal(0, 0.5) if self.latency > 0 else 0
+            failed = self.rng.random() < self.error_rate
+            limited = False
+            if self.tushare_rate_limit and api.startswith('tushare.'):
+                now = time.monotonic()
+                window = [t for t in self.recent[api] if now - t < 60]
+                limited = len(window) >= self.tushare_rate_limit
+                if not limited:
+                    window.append(now)
+                self.recent[api] = window
+        if delay:
+            time.sleep(delay)
+        if limited:
+            self._count_error(api)
+            raise FakeApiError(f"抱歉，您每分钟最多访问该接口{self.tushare_rate_limit}次")
+        if failed:
+            self._count_error(api)
+            raise FakeApiError("离线服务模拟的网络错误")
+
+    def leave(self, api: str, rows: int, t0: float) -> None:
+        with self.lock:
+            self.rows[api] += rows
+            self.elapsed[api] += time.perf_counter() - t0
+
+    def _count_error(self, api: str) -> None:
+        with self.lock:
+            self.errors[api] += 1
+
+    def get_stats(self) -> pd.DataFrame:
+        with self.lock:
+            return pd.DataFrame([{
+                'api': api,
+                'calls': self.calls[api],
+                'errors': self.errors[api],
+                'rows': self.rows[api],
+                'total_s': self.elapsed[api],
+            } for api in sorted(self.calls)])
+
+
+# ================================= baostock 替身 =================================
+class FakeResultData:
+    """baostock ResultData：error_code/error_msg/fields + next()/get_row_data()/get_data()"""
+
+    def __init__(self, fields: List[str] = None, rows: List[list] = None, error_code: str = '0', error_msg: str = 'success'):
+        self.fields = fields or []
+        self.data = rows or []
+        self.error_code = error_code
+        self.error_msg = error_msg
+        self._cursor = -1
+
+    def next(self) -> bool:
+        self._cursor += 1
+        return self._cursor < len(self.data)
+
+    def get_row_data(self) -> list:
+        return self.data[self._cursor]
+
+    def get_data(self) -> pd.DataFrame:
+        return pd.DataFrame(self.data, columns=self.fields)
+
+
+class FakeBaostock:
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+    def _call(self, api: str, build: Callable) -> FakeResultData:
+        t0 = time.perf_counter()
+        try:
+            self.server.enter(f"baostock.{api}")
+        except FakeApiError as e:
+            return FakeResultData(error_code='10002007', error_msg=str(e))
+        result = build()
+        self.server.leave(f"baostock.{api}", len(result.data), t0)
+        return result
+
+    def login(self, user_id='anonymous', password='123456', options=0) -> FakeResultData:
+        return FakeResultData(error_msg='login success!')
+
+    def logout(self, user_id='anonymous') -> FakeResultData:
+        return FakeResultData(error_msg='logout success!')
+
+    def query_history_k_data_plus(self, code, fields, start_date=None, end_date=None, frequency='d', adjustflag='3'):
+        def build():
+            fields_list = [f.strip() for f in fields.split(',')]
+            ts_code = convert_to_tushare_code(code)
+            freq = BAOSTOCK_FREQ[str(frequency)]
+            df = self.server.market.bars_frame(ts_code, start_date or '2015-01-01', end_date or date.today(),
+                                               freq, include_prev_close=True)
+            if df.empty:
+                return FakeResultData(fields_list, [])
+            if str(adjustflag) in ('1', '2'):
+                factors = self.server.market.adj_factors(ts_code)
+                back = np.r_[1.0, factors['back_adjust_factor'].to_numpy()]
+                idx = np.searchsorted(factors['divid_operate_date'].to_numpy(dtype='datetime64[ns]'),
+                                      df['trade_time'].to_numpy(dtype='datetime64[ns]'), side='right')
+                scale = back[idx] if str(adjustflag) == '1' else back[idx] / back[-1]
+                for col in ['open', 'high', 'low', 'close', 'pre_close']:
+                    df[col] = np.round(df[col] * scale, 4)
+            values = {
+                'date': df['trade_time'].dt.strftime('%Y-%m-%d'),
+                'time': df['trade_time'].dt.strftime('%Y%m%d%H%M%S000'),
+                'code': code,
+                'open': df['open'].map('{:.4f}'.format),
+                'high': df['high'].map('{:.4f}'.format),
+                'low': df['low'].map('{:.4f}'.format),
+                'close': df['close'].map('{:.4f}'.format),
+                'preclose': df['pre_close'].map('{:.4f}'.format),
+                'volume': df['volume'].astype(np.int64).astype(str),
+                'amount': df['amount'].map('{:.4f}'.format),
+                'adjustflag': str(adjustflag),
+                'tradestatus': '1',
+                'isST': '0',
+                'pctChg': ((df['close'] / df['pre_close'] - 1) * 100).map('{:.6f}'.format),
+            }
+            out = pd.DataFrame({f: values.get(f, '') for f in fields_list})
+            return FakeResultData(fields_list, out.values.tolist())
+        return self._call('query_history_k_data_plus', build)
+
+    def query_adjust_factor(self, code, start_date=None, end_date=None):
+        def build():
+            fields = ['code', 'dividOperateDate', 'foreAdjustFactor', 'backAdjustFactor', 'adjustFactor']
+            factors = self.server.market.adj_factors(convert_to_tushare_code(code))
+            if factors.empty:
+                return FakeResultData(fields, [])
+            latest = factors['back_adjust_factor'].iloc[-1]
+            factors = factors[(factors['divid_operate_date'] >= np.datetime64(start_date or '1990-01-01')) &
+                              (factors['divid_operate_date'] <= np.datetime64(end_date or date.today()))]
+            rows = [[code, pd.Timestamp(d).strftime('%Y-%m-%d'), f"{b / latest:.6f}", f"{b:.6f}", f"{b:.6f}"]
+                    for d, b in zip(factors['divid_operate_date'], factors['back_adjust_factor'])]
+            return FakeResultData(fields, rows)
+        return self._call('query_adjust_factor', build)
+
+    def _query_index_stocks(self, index_code: str, api: str, date=None):
+        def build():
+            update_date = str(self.server.market.trade_days('2010-01-01', date or datetime.today())[-1])
+            rows = [[update_date, convert_to_baostock_code(code), code]
+                    for code in self.server.market.csi_members(index_code)]
+            return FakeResultData(['updateDate', 'code', 'code_name'], rows)
+        return self._call(api, build)
+
+    def query_sz50_stocks(self, date=None):
+        return self._query_index_stocks('000016.SH', 'query_sz50_stocks', date)
+
+    def query_hs300_stocks(self, date=None):
+        return self._query_index_stocks('000300.SH', 'query_hs300_stocks', date)
+
+    def query_zz500_stocks(self, date=None):
+        return self._query_index_stocks('000905.SH', 'query_zz500_stocks', date)
+
+
+# ================================= tushare 替身 =================================
+class FakePro:
+    """tushare.pro_api 替身，pro.xxx(**kwargs) 与 pro.query('xxx', **kwargs) 均可调用"""
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+    def __getattr__(self, api_name: str):
+        if api_name.startswith('_'):
+            raise AttributeError(api_name)
+        return partial(self.query, api_name)
+
+    def query(self, api_name: str, fields: str = '', **kwargs) -> pd.DataFrame:
+        handler = getattr(self, f"_api_{api_name}", None)
+        if handler is None:
+            raise FakeApiError(f"接口 {api_name} 未在离线服务中实现")
+        t0 = time.perf_counter()
+        self.server.enter(f"tushare.{api_name}")
+        df = handler(**kwargs)
+        if fields:
+            df = df[[f.strip() for f in fields.split(',') if f.strip() in df.columns]]
+        self.server.leave(f"tushare.{api_name}", len(df), t0)
+        return df.reset_index(drop=True)
+
+    def _trade_dates(self, trade_date=None, start_date=None, end_date=None) -> List[str]:
+        if trade_date:
+            days = self.server.market.trade_days(trade_date, trade_date)
+        else:
+            days = self.server.market.trade_days(start_date or '20240101', end_date or date.today())
+        return [pd.Timestamp(d).strftime('%Y%m%d') for d in days]
+
+    def _api_trade_cal(self, exchange='SSE', start_date='19900101', end_date=None, **kwargs):
+        cal = pd.date_range(pd.Timestamp(start_date), pd.Timestamp(end_date or date.today()))
+        open_days = pd.DatetimeIndex(self.server.market.trade_days(cal[0], cal[-1]))
+        is_open = cal.isin(open_days)
+        pretrade = pd.Series(cal, index=cal).where(is_open).ffill().shift(1)
+        return pd.DataFrame({
+            'exchange': exchange,
+            'cal_date': cal.strftime('%Y%m%d'),
+            'is_open': is_open.astype(int),
+            'pretrade_date': pretrade.dt.strftime('%Y%m%d').to_numpy(),
+        }).iloc[::-1]
+
+    def _api_daily(self, trade_date=None, ts_code=None, start_date=None, end_date=None, **kwargs):
+        frames = [self.server.market.daily_snapshot(d) for d in self._trade_dates(trade_date, start_date, end_date)]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if ts_code and not df.empty:
+            df = df[df['ts_code'].isin(ts_code.split(','))]
+        return df
+
+    def _api_daily_basic(self, trade_date=None, ts_code=None, **kwargs):
+        df = self._api_daily(trade_date=trade_date, ts_code=ts_code, **kwargs)
+        if df.empty:
+            return df
+        seed = _code_seed(df['ts_code'])
+        total_share = (2e4 + (seed % np.uint64(5e6)).astype(float)).round(2)  # 万股
+        float_share = (total_share * (0.5 + 0.5 * _uniform(seed, 21))).round(2)
+        free_share = (float_share * (0.6 + 0.4 * _uniform(seed, 22))).round(2)
+        pe = (8 + 60 * _uniform(seed, 23)).round(4)
+        pb = (0.6 + 8 * _uniform(seed, 24)).round(4)
+        return pd.DataFrame({
+            'ts_code': df['ts_code'],
+            'trade_date': df['trade_date'],
+            'close': df['close'],
+            'turnover_rate': (df['vol'] / float_share).round(4),  # 手 / 万股 = %
+            'turnover_rate_f': (df['vol'] / free_share).round(4),
+            'volume_ratio': (0.5 + _uniform(seed, _code_seed(df['trade_date']), 25)).round(2),
+            'pe': pe, 'pe_ttm': (pe * 1.05).round(4), 'pb': pb,
+            'ps': (pe / 5).round(4), 'ps_ttm': (pe / 5.2).round(4),
+            'dv_ratio': (3 * _uniform(seed, 26)).round(4), 'dv_ttm': (3 * _uniform(seed, 27)).round(4),
+            'total_share': total_share, 'float_share': float_share, 'free_share': free_share,
+            'total_mv': (total_share * df['close']).round(4), 'circ_mv': (float_share * df['close']).round(4),
+        })
+
+    def _api_moneyflow(self, trade_date=None, ts_code=None, start_date=None, end_date=None, **kwargs):
+        df = self._api_daily(trade_date=trade_date, ts_code=ts_code, start_date=start_date, end_date=end_date)
+        if df.empty:
+            return df
+        seed = _code_seed(df['ts_code'] + df['trade_date'])
+        out = pd.DataFrame({'ts_code': df['ts_code'], 'trade_date': df['trade_date']})
+        weights = np.stack([_uniform(seed, k) for k in range(8)], axis=1)
+        weights = weights / weights.sum(axis=1, keepdims=True)
+        vol, amount = df['vol'].to_numpy() * 2, df['amount'].to_numpy() * 2 / 10  # 手, 万元
+        net_vol = np.zeros(len(df))
+        net_amount = np.zeros(len(df))
+        for i, size in enumerate(['sm', 'md', 'lg', 'elg']):
+            for j, side in enumerate(['buy', 'sell']):
+                w = weights[:, 2 * i + j]
+                out[f'{side}_{size}_vol'] = np.round(vol * w).astype(np.int64)
+                out[f'{side}_{size}_amount'] = np.round(amount * w, 2)
+                sign = 1 if side == 'buy' else -1
+                net_vol += sign * out[f'{side}_{size}_vol'].to_numpy()
+                net_amount += sign * out[f'{side}_{size}_amount'].to_numpy()
+        out['net_mf_vol'] = net_vol.astype(np.int64)
+        out['net_mf_amount'] = np.round(net_amount, 2)
+        return out
+
+    def _api_moneyflow_ind_ths(self, trade_date=None, start_date=None, end_date=None, ts_code=None, **kwargs):
+        frames = []
+        indices = self.server.market.ths_indices()
+        industries = indices[indices['type'] == 'I'].reset_index(drop=True)
+        for d in self._trade_dates(trade_date, start_date, end_date):
+            daily = self.server.market.daily_snapshot(d)
+            daily['industry'] = self.server.market.stock_industry(daily['ts_code'])
+            daily['pct'] = daily['pct_chg']
+            flow = self._api_moneyflow(trade_date=d)
+            daily['net_amount'] = flow['net_mf_amount'].to_numpy() / 1e4  # 亿元
+            grouped = daily.groupby('industry')
+            agg = grouped.agg(company_num=('ts_code', 'size'), pct_change=('pct', 'mean'),
+                              net_amount=('net_amount', 'sum')).reindex(range(len(industries)))
+            lead = daily.loc[grouped['pct'].idxmax()].set_index('industry').reindex(range(len(industries)))
+            frames.append(pd.DataFrame({
+                'trade_date': d,
+                'ts_code': industries['ts_code'],
+                'industry': industries['name'],
+                'lead_stock': lead['ts_code'].fillna('').to_numpy(),
+                'close': (1000 * (1 + agg['pct_change'].fillna(0).to_numpy() / 100)).round(2),
+                'pct_change': agg['pct_change'].fillna(0).round(4).to_numpy(),
+                'company_num': agg['company_num'].fillna(0).astype(int).to_numpy(),
+                'pct_change_stock': lead['pct'].fillna(0).round(4).to_numpy(),
+                'close_price': lead['close'].fillna(0).to_numpy(),
+                'net_buy_amount': np.maximum(agg['net_amount'].fillna(0).to_numpy(), 0).round(2) + 10,
+                'net_sell_amount': np.maximum(-agg['net_amount'].fillna(0).to_numpy(), 0).round(2) + 10,
+                'net_amount': agg['net_amount'].fillna(0).round(2).to_numpy(),
+            }))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if ts_code and not df.empty:
+            df = df[df['ts_code'] == ts_code]
+        return df
+
+    def _api_index_dailybasic(self, ts_code=None, trade_date=None, start_date=None, end_date=None, **kwargs):
+        rows = []
+        for d in self._trade_dates(trade_date, start_date, end_date):
+            basic = self._api_daily_basic(trade_date=d)
+            for index_code in (ts_code.split(',') if ts_code else list(CSI_SIZES)):
+                members = basic[basic['ts_code'].isin(self.server.market.csi_members(index_code))]
+                if members.empty:
+                    continue
+                rows.append({
+                    'ts_code': index_code, 'trade_date': d,
+                    'total_mv': members['total_mv'].sum() * 1e4, 'float_mv': members['circ_mv'].sum() * 1e4,
+                    'total_share': members['total_share'].sum() * 1e4, 'float_share': members['float_share'].sum() * 1e4,
+                    'free_share': members['free_share'].sum() * 1e4,
+                    'turnover_rate': members['turnover_rate'].mean(), 'turnover_rate_f': members['turnover_rate_f'].mean(),
+                    'pe': members['pe'].median(), 'pe_ttm': members['pe_ttm'].median(), 'pb': members['pb'].median(),
+                })
+        return pd.DataFrame(rows)
+
+    def _api_index_weight(self, index_code=None, trade_date=None, start_date=None, end_date=None, **kwargs):
+        days = pd.Series(pd.to_datetime(self._trade_dates(trade_date, start_date, end_date)))
+        if days.empty:
+            return pd.DataFrame()
+        month_ends = days.groupby(days.dt.to_period('M')).max().dt.strftime('%Y%m%d')
+        members = self.server.market.csi_members(index_code)
+        return pd.DataFrame([{'index_code': index_code, 'con_code': code, 'trade_date': d, 'weight': round(100 / len(members), 4)}
+                             for d in month_ends for code in members])
+
+    def _api_ths_index(self, exchange=None, type=None, ts_code=None, **kwargs):
+        df = self.server.market.ths_indices()
+        if type:
+            df = df[df['type'] == type]
+        if ts_code:
+            df = df[df['ts_code'] == ts_code]
+        return df
+
+    def _api_ths_member(self, ts_code=None, code=None, **kwargs):
+        members = self.server.market.ths_members(ts_code)
+        return pd.DataFrame({'ts_code': ts_code, 'con_code': members, 'con_name': members,
+                             'weight': None, 'in_date': None, 'out_date': None, 'is_new': 'Y'})
+
+
+# ================================= xtquant.xtdata 替身 =================================
+class FakeXtdata:
+    enable_hello = False
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.subscriptions = {}
+        self._seq = 0
+
+    def _call(self, api: str) -> float:
+        t0 = time.perf_counter()
+        self.server.enter(f"xtdata.{api}")
+        return t0
+
+    def get_stock_list_in_sector(self, sector_name: str) -> List[str]:
+        t0 = self._call('get_stock_list_in_sector')
+        if sector_name in ('沪深300', '中证500', '上证50'):
+            code = {'沪深300': '000300.SH', '中证500': '000905.SH', '上证50': '000016.SH'}[sector_name]
+            codes = self.server.market.csi_members(code)
+        else:
+            codes = list(self.server.market.universe())
+        self.server.leave('xtdata.get_stock_list_in_sector', len(codes), t0)
+        return codes
+
+    def download_history_data(self, stock_code, period='1d', start_time='', end_time='', incrementally=None):
+        t0 = self._call('download_history_data')
+        self.server.leave('xtdata.download_history_data', 0, t0)
+
+    def _frame(self, stock_code: str, period: str, start_time: str, end_time: str, count: int) -> pd.DataFrame:
+        freq = QMT_FREQ[period]
+        end = pd.Timestamp(end_time[:8]) if end_time else pd.Timestamp(date.today())
+        start = pd.Timestamp(start_time[:8]) if start_time else end - pd.Timedelta(days=730)
+        df = self.server.market.bars_frame(stock_code, start, end, freq, include_prev_close=True)
+        df = df[df['trade_time'] <= datetime.now()]
+        if count and count > 0:
+            df = df.iloc[-count:]
+        # QMT时间戳为UTC毫秒，成交量单位为手
+        times = df['trade_time'].to_numpy(dtype='datetime64[ns]')
+        utc_ms = (times - np.timedelta64(8, 'h')).astype('datetime64[ms]').astype(np.int64)
+        out = pd.DataFrame({
+            'time': utc_ms,
+            'open': df['open'].to_numpy(), 'high': df['high'].to_numpy(),
+            'low': df['low'].to_numpy(), 'close': df['close'].to_numpy(),
+            'volume': (df['volume'].to_numpy() / 100).astype(np.int64), 'amount': df['amount'].to_numpy(),
+            'settelementPrice': 0.0, 'openInterest': 15, 'preClose': df['pre_close'].to_numpy(),
+            'suspendFlag': 0,
+        }, index=pd.to_datetime(times).strftime('%Y%m%d%H%M%S'))
+        return out
+
+    def get_local_data(self, field_list=[], stock_list=[], period='1d', start_time='', end_time='', count=-1,
+                       dividend_type='none', fill_data=True, data_dir=None) -> Dict[str, pd.DataFrame]:
+        t0 = self._call('get_local_data')
+        data = {code: self._frame(code, period, start_time, end_time, count) for code in stock_list}
+        if field_list:
+            data = {code: df[[f for f in field_list if f in df.columns]] for code, df in data.items()}
+        self.server.leave('xtdata.get_local_data', sum(len(df) for df in data.values()), t0)
+        return data
+
+    def get_market_data_ex(self, field_list=[], stock_list=[], period='1d', start_time='', end_time='', count=-1,
+                           dividend_type='none', fill_data=True) -> Dict[str, pd.DataFrame]:
+        t0 = self._call('get_market_data_ex')
+        data = {code: self._frame(code, period, start_time, end_time, count) for code in stock_list}
+        if field_list:
+            data = {code: df[[f for f in field_list if f in df.columns]] for code, df in data.items()}
+        self.server.leave('xtdata.get_market_data_ex', sum(len(df) for df in data.values()), t0)
+        return data
+
+    def get_full_tick(self, code_list) -> dict:
+        t0 = self._call('get_full_tick')
+        ticks = {}
+        for code in code_list:
+            df = self._frame(code, '5m', (date.today() - timedelta(days=10)).strftime('%Y%m%d'), '', 2)
+            if df.empty:
+                continue
+            last = df.iloc[-1]
+            ticks[code] = {
+                'time': int(last['time']), 'lastPrice': float(last['close']), 'open': float(last['open']),
+                'high': float(last['high']), 'low': float(last['low']), 'lastClose': float(last['preClose']),
+                'amount': float(last['amount']), 'volume': int(last['volume']),
+                'askPrice': [round(float(last['close']) + 0.01 * i, 2) for i in range(1, 6)],
+                'bidPrice': [round(float(last['close']) - 0.01 * i, 2) for i in range(5)],
+                'askVol': [100] * 5, 'bidVol': [100] * 5,
+            }
+        self.server.leave('xtdata.get_full_tick', len(ticks), t0)
+        return ticks
+
+    def subscribe_quote(self, stock_code, period='1d', start_time='', end_time='', count=0, callback=None) -> int:
+        self._call('subscribe_quote')
+        self._seq += 1
+        self.subscriptions[self._seq] = (stock_code, period, callback)
+        return self._seq
+
+    def unsubscribe_quote(self, seq: int) -> None:
+        self.subscriptions.pop(seq, None)
+
+    def run(self, push_interval: float = 3.0) -> None:
+        """阻塞运行，定期把最新K线推送给带回调的订阅"""
+        while True:
+            for stock_code, period, callback in list(self.subscriptions.values()):
+                if callback is not None:
+                    df = self._frame(stock_code, period, (date.today() - timedelta(days=10)).strftime('%Y%m%d'), '', 1)
+                    callback({stock_code: df.to_dict('records')})
+            time.sleep(push_interval)
+
+
+# ================================= 安装替身模块 =================================
+def install(server: FakeServer) -> FakeServer:
+    """将替身注册到sys.modules，之后 import baostock / tushare / xtquant 均得到离线实现"""
+    fake_bs = FakeBaostock(server)
+    bs_module = types.ModuleType('baostock')
+    for name in ['login', 'logout', 'query_history_k_data_plus', 'query_adjust_factor',
+                 'query_sz50_stocks', 'query_hs300_stocks', 'query_zz500_stocks']:
+        setattr(bs_module, name, getattr(fake_bs, name))
+
+    ts_module = types.ModuleType('tushare')
+    ts_module.pro_api = lambda token=None, **kwargs: FakePro(server)
+    ts_module.set_token = lambda token: None
+
+    fake_xt = FakeXtdata(server)
+    xt_module = types.ModuleType('xtquant')
+    xtdata_module = types.ModuleType('xtquant.xtdata')
+    for name in ['get_stock_list_in_sector', 'download_history_data', 'get_local_data', 'get_market_data_ex',
+                 'get_full_tick', 'subscribe_quote', 'unsubscribe_quote', 'run']:
+        setattr(xtdata_module, name, getattr(fake_xt, name))
+    xtdata_module.enable_hello = False
+    xt_module.xtdata = xtdata_module
+
+    sys.modules.update({'baostock': bs_module, 'tushare': ts_module,
+                        'xtquant': xt_module, 'xtquant.xtdata': xtdata_module})
+    return server
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='在baostock/tushare/xtquant离线替身环境中运行脚本并统计吞吐')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次调用的平均延迟(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='每次调用的随机失败概率')
+    parser.add_argument('--tushare-rate-limit', type=int, default=0, help='tushare每个接口每分钟调用上限，0表示不限')
+    parser.add_argument('--n-stocks', type=int, default=300, help='股票池大小')
+    parser.add_argument('--suspend-rate', type=float, default=0.005, help='每只股票每日停牌概率')
+    parser.add_argument('--seed', type=int, default=0, help='行情生成种子')
+    parser.add_argument('script', type=str, help='要运行的脚本')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='传给脚本的参数')
+    args = parser.parse_args()
+
+    market = SyntheticMarket(n_stocks=args.n_stocks, suspend_rate=args.suspend_rate, seed=args.seed)
+    server = install(FakeServer(latency=args.latency, error_rate=args.error_rate,
+                                tushare_rate_limit=args.tushare_rate_limit, market=market))
+    sys.argv = [args.script] + args.script_args
+    t0 = time.time()
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    finally:
+        elapsed = time.time() - t0
+        stats_df = server.get_stats()
+        if not stats_df.empty:
+            stats_df['rows_per_s'] = (stats_df['rows'] / elapsed).round(1)
+            logger.info(f"{args.script} 运行 {elapsed:.1f} 秒，离线接口调用统计:\n{stats_df.round(3).to_string(index=False)}")
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from common import *
 import baostock as bs
+from index_membership import CSI_INDICES, fetch_csi_snapshot, record_snapshots
+
+# 当前成分股同时记录到成分历史表
+config = load_config()
+engine = create_engine(get_pg_connection_string(config))
+snapshots = []
 
 # 登陆系统
 lg = bs.login()
@@ -13,6 +19,7 @@ while (rs.error_code == '0') & rs.next():
 result = pd.DataFrame(sz50_stocks, columns=rs.fields)
 result['code'] = result['code'].apply(convert_to_tushare_code)
 result['code'].to_csv("上证50_stock_list.csv",encoding='utf-8',index=False,header=False)
+snapshots.append(pd.DataFrame({'index_code': '000016.SH', 'index_name': '上证50', 'ts_code': result['code']}))
 
 # 获取沪深300成分股
 rs = bs.query_hs300_stocks()
@@ -22,6 +29,7 @@ while (rs.error_code == '0') & rs.next():
 result = pd.DataFrame(hs300_stocks, columns=rs.fields)
 result['code'] = result['code'].apply(convert_to_tushare_code)
 result['code'].to_csv("沪深300_stock_list.csv",encoding='utf-8',index=False,header=False)
+snapshots.append(pd.DataFrame({'index_code': '000300.SH', 'index_name': '沪深300', 'ts_code': result['code']}))
 
 # 获取中证500成分股
 rs = bs.query_zz500_stocks()
@@ -31,7 +39,17 @@ while (rs.error_code == '0') & rs.next():
 result = pd.DataFrame(zz500_stocks, columns=rs.fields)
 result['code'] = result['code'].apply(convert_to_tushare_code)
 result['code'].to_csv("中证500_stock_list.csv",encoding='utf-8',index=False,header=False)
+snapshots.append(pd.DataFrame({'index_code': '000905.SH', 'index_name': '中证500', 'ts_code': result['code']}))
+
+# 获取中证1000成分股(baostock不提供，取tushare指数权重最近一期)
+zz1000_stocks, _ = fetch_csi_snapshot('000852.SH', date.today().strftime('%Y%m%d'))
+if zz1000_stocks:
+    pd.Series(zz1000_stocks).to_csv("中证1000_stock_list.csv",encoding='utf-8',index=False,header=False)
+    snapshots.append(pd.DataFrame({'index_code': '000852.SH', 'index_name': CSI_INDICES['000852.SH'][0], 'ts_code': zz1000_stocks}))
+else:
+    logger.warning("未获取到中证1000成分股，本次不记录其快照")
 
+record_snapshots(engine, pd.concat(snapshots, ignore_index=True), 'csi', date.today())
 
 # 登出系统
 bs.logout()
\ No newline at end of file
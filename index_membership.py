@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+指数成分股历史(时点成分)
+
+- index_member_history 表按有效区间 [valid_from, valid_to) 记录每只股票在每个指数中的成分期，valid_to为空表示当前仍是成分股
+- record_snapshots 将某日的成分股快照与在册区间比对，只关闭被剔除的区间、新开新纳入的区间；
+  快照日期早于该指数已记录的最新日期时跳过该指数，不会产生valid_to早于valid_from的区间
+- 同花顺指数每天由 ths_index_members.py 写入快照(同花顺无历史接口，历史从首次记录日开始)
+- 中证指数(上证50/沪深300/中证500/中证1000)可用 backfill_csi_history 按月回补历史：只回补该指数首次记录日之前的月份，
+  在内存中按月重放成分变化，写入已关闭的历史区间(截止到首次记录日)，不改动已有区间
+- IndexMembership 将区间加载为按指数划分的 IntervalIndex，提供 members_as_of 与 (T × N) 成分掩码，
+  供回测按历史成分过滤股票池，避免幸存者偏差
+
+用法:
+    python index_membership.py --backfill --start-date 20150101     # 回补中证指数成分历史
+    membership = IndexMembership.load(engine, ['000300.SH'])
+    membership.members_as_of('沪深300', '20200630')
+    mask = membership.mask('000300.SH', bar_times, ts_codes)
+"""
+from common import *
+import argparse
+
+
+# ================================= 定义初始变量 =================================
+TABLE_NAME = 'index_member_history'
+OPEN_END = pd.Timestamp('2200-01-01')   # 仍在册区间的右端点
+
+# 中证指数：baostock查询函数名(None表示baostock不提供，改用tushare index_weight)
+CSI_INDICES = {
+    '000016.SH': ('上证50', 'query_sz50_stocks'),
+    '000300.SH': ('沪深300', 'query_hs300_stocks'),
+    '000905.SH': ('中证500', 'query_zz500_stocks'),
+    '000852.SH': ('中证1000', None),
+}
+
+
+# ================================= 历史表维护 =================================
+def create_table_if_not_exists(engine) -> None:
+    """创建成分股历史表"""
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+        index_code VARCHAR(50) NOT NULL,
+        index_name VARCHAR(50),
+        source VARCHAR(20) NOT NULL,
+        ts_code VARCHAR(20) NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        PRIMARY KEY (index_code, ts_code, valid_from)
+    );
+    CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_open ON {TABLE_NAME} (index_code) WHERE valid_to IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_ts_code ON {TABLE_NAME} (ts_code);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+
+def recorded_bounds(engine, index_codes) -> pd.DataFrame:
+    """各指数已记录的首个生效日(first)和最新变动日(latest，区间起止日中最晚的一天)，以index_code为索引"""
+    return pd.read_sql(
+        text(f"""SELECT index_code, MIN(valid_from) AS first, GREATEST(MAX(valid_from), MAX(valid_to)) AS latest
+                FROM {TABLE_NAME} WHERE index_code = ANY(:codes) GROUP BY index_code"""),
+        engine, params={'codes': list(index_codes)}).set_index('index_code')
+
+def latest_recorded(engine, index_codes) -> dict:
+    """{指数代码: 已记录的最新变动日}，无记录的指数不出现"""
+    return {code: pd.Timestamp(day).date() for code, day in recorded_bounds(engine, index_codes)['latest'].items()}
+
+def record_snapshots(engine, snapshot: pd.DataFrame, source: str, as_of, index_codes=None) -> tuple:
+    """
+    记录一批指数在as_of日的成分股快照
+    Args:
+        snapshot: 包含index_code, index_name, ts_code的成分股快照
+        source: 'ths'或'csi'
+        as_of: 快照日期，新纳入成分从该日生效，被剔除成分在该日失效；早于指数已记录最新日期的快照跳过
+        index_codes: 本次快照覆盖的指数，默认取snapshot中出现的指数；覆盖但快照中无成分的指数视为全部剔除
+    Returns:
+        (新开区间数, 关闭区间数)
+    """
+    create_table_if_not_exists(engine)
+    as_of = pd.Timestamp(as_of).date()
+    if index_codes is None:
+        index_codes = snapshot['index_code'].unique().tolist()
+    latest = latest_recorded(engine, index_codes)
+    stale = [code for code in index_codes if code in latest and latest[code] > as_of]
+    if stale:
+        logger.warning(f"{as_of} 早于已记录的最新成分日期，跳过指数: "
+                       f"{', '.join(f'{code}({latest[code]})' for code in stale)}")
+    index_codes = [code for code in index_codes if code not in stale]
+    if not index_codes:
+        return 0, 0
+
+    open_df = pd.read_sql(
+        text(f"SELECT index_code, ts_code FROM {TABLE_NAME} WHERE valid_to IS NULL AND index_code = ANY(:codes)"),
+        engine, params={'codes': index_codes})
+    current = snapshot[snapshot['index_code'].isin(index_codes)][['index_code', 'index_name', 'ts_code']].drop_duplicates(['index_code', 'ts_code'])
+    merged = current.merge(open_df, on=['index_code', 'ts_code'], how='outer', indicator=True)
+
+    opened = merged[merged['_merge'] == 'left_only'][['index_code', 'index_name', 'ts_code']].copy()
+    opened['source'] = source
+    opened['valid_from'] = as_of
+    opened['valid_to'] = None
+    opened = opened[['index_code', 'index_name', 'source', 'ts_code', 'valid_from', 'valid_to']]
+    closed = merged[merged['_merge'] == 'right_only'][['index_code', 'ts_code']]
+
+    if not closed.empty:
+        close_sql = f"""
+            UPDATE {TABLE_NAME} h SET valid_to = '{as_of}'
+            FROM tmp_{TABLE_NAME}_closed c
+            WHERE h.index_code = c.index_code AND h.ts_code = c.ts_code AND h.valid_to IS NULL
+        """
+        upsert_data(closed, TABLE_NAME, f'tmp_{TABLE_NAME}_closed', close_sql, engine)
+    if not opened.empty:
+        save_to_database(df=opened, table_name=TABLE_NAME, conflict_columns=['index_code', 'ts_code', 'valid_from'],
+                         data_type='指数成分历史', engine=engine)
+    logger.info(f"{as_of} 成分股快照({source}, {len(index_codes)}个指数): 新纳入 {len(opened)}，剔除 {len(closed)}")
+    return len(opened), len(closed)
+
+
+# ================================= 中证指数历史回补 =================================
+def fetch_csi_snapshot(index_code: str, as_of: str) -> tuple:
+    """
+    获取中证指数在as_of日(YYYYMMDD)的成分股
+    Returns:
+        (成分股代码列表, 成分生效日期)，baostock返回updateDate时以其作为生效日
+    """
+    index_name, query_name = CSI_INDICES[index_code]
+    if query_name is not None:
+        import baostock as bs
+        rs = getattr(bs, query_name)(date=convert_date_format(as_of))
+        rows = []
+        while (rs.error_code == '0') & rs.next():
+            rows.append(rs.get_row_data())
+        df = pd.DataFrame(rows, columns=rs.fields)
+        if df.empty:
+            return [], as_of
+        effective = pd.to_datetime(df['updateDate']).max().strftime('%Y%m%d') if 'updateDate' in df.columns else as_of
+        return df['code'].apply(convert_to_tushare_code).tolist(), min(effective, as_of)
+
+    # baostock不提供中证1000，用tushare指数权重(月度)取截至as_of最近一期
+    from tushare_client import get_tushare_client
+    pro = get_tushare_client()
+    start_date = (pd.to_datetime(as_of) - pd.Timedelta(days=45)).strftime('%Y%m%d')
+    df = pro.index_weight(index_code=index_code, start_date=start_date, end_date=as_of)
+    if df.empty:
+        return [], as_of
+    latest = df['trade_date'].max()
+    return df[df['trade_date'] == latest]['con_code'].tolist(), latest
+
+def replay_snapshots(snapshots: List[tuple], close_at=None) -> pd.DataFrame:
+    """
+    在内存中按日期先后重放成分快照，生成有效区间
+    Args:
+        snapshots: [(生效日期, 成分股代码列表)]，按日期升序
+        close_at: 重放结束时仍在册区间的失效日，None表示保持在册(valid_to为空)
+    Returns:
+        包含ts_code, valid_from, valid_to的区间
+    """
+    opened, rows = {}, []
+    for as_of, members in snapshots:
+        members = set(members)
+        for ts_code in [code for code in opened if code not in members]:
+            rows.append((ts_code, opened.pop(ts_code), as_of))
+        for ts_code in members:
+            opened.setdefault(ts_code, as_of)
+    rows.extend((ts_code, valid_from, close_at) for ts_code, valid_from in opened.items())
+    # 同一天生效又失效的区间为空区间，不写入
+    return pd.DataFrame([row for row in rows if row[1] != row[2]], columns=['ts_code', 'valid_from', 'valid_to'])
+
+def backfill_csi_history(engine, start_date: str, end_date: str = None, index_codes=None) -> None:
+    """
+    按月末交易日抓取中证指数成分快照，回补各指数首次记录日之前的历史
+    已有记录的指数，回补区间在首次记录日关闭(与已有区间首尾相接)，已有区间不做改动；无记录的指数保留末期在册区间
+    """
+    from trade_calendar import get_trade_calendar
+    import baostock as bs
+
+    create_table_if_not_exists(engine)
+    end_date = end_date or datetime.today().strftime('%Y%m%d')
+    index_codes = index_codes or list(CSI_INDICES)
+    trade_days = pd.Series(pd.to_datetime(get_trade_calendar(engine=engine).between(start_date, end_date)))
+    month_ends = trade_days.groupby(trade_days.dt.to_period('M')).max().dt.strftime('%Y%m%d').tolist()
+    first_recorded = {code: pd.Timestamp(day).strftime('%Y%m%d')
+                      for code, day in recorded_bounds(engine, index_codes)['first'].items()}
+
+    bs.login()
+    try:
+        for index_code in index_codes:
+            first = first_recorded.get(index_code)
+            snapshots = []
+            for as_of in tqdm([day for day in month_ends if first is None or day < first], desc=f'回补{index_code}成分'):
+                members, effective = fetch_csi_snapshot(index_code, as_of)
+                if not members:
+                    logger.warning(f"{index_code} 在 {as_of} 没有成分股数据，跳过")
+                    continue
+                snapshots.append((max(effective, snapshots[-1][0]) if snapshots else effective, members))
+            intervals = replay_snapshots(snapshots, close_at=first)
+            if intervals.empty:
+                logger.info(f"{index_code} 没有需要回补的成分历史(首次记录日 {first})")
+                continue
+            intervals['index_code'] = index_code
+            intervals['index_name'] = CSI_INDICES[index_code][0]
+            intervals['source'] = 'csi'
+            for column in ['valid_from', 'valid_to']:
+                intervals[column] = pd.to_datetime(intervals[column]).dt.date.astype(object).where(intervals[column].notna(), None)
+            save_to_database(df=intervals[['index_code', 'index_name', 'source', 'ts_code', 'valid_from', 'valid_to']],
+                             table_name=TABLE_NAME, conflict_columns=['index_code', 'ts_code', 'valid_from'],
+                             data_type='指数成分历史', engine=engine)
+            logger.info(f"{index_code} 回补 {len(snapshots)} 期快照，写入 {len(intervals)} 个历史区间"
+                        + (f"(截止到首次记录日 {first})" if first else ''))
+    finally:
+        bs.logout()
+
+
+# ================================= 时点成分查询 =================================
+class IndexMembership:
+    """
+    时点成分查询，每个指数一组 IntervalIndex(左闭右开)
+    members_as_of 为一次向量化区间包含判断；mask 用区间端点在时间轴上的差分累加生成 (T × N) 掩码，
+    复杂度 O(T × N + 区间数)
+    """
+
+    def __init__(self, history: pd.DataFrame):
+        history = history.copy()
+        history['valid_from'] = pd.to_datetime(history['valid_from'])
+        history['valid_to'] = pd.to_datetime(history['valid_to']).fillna(OPEN_END)
+        self.names = dict(zip(history['index_name'], history['index_code']))
+        self.intervals = {}
+        self.codes = {}
+        self.bounds = {}
+        for index_code, group in history.groupby('index_code', sort=False):
+            self.intervals[index_code] = pd.IntervalIndex.from_arrays(group['valid_from'], group['valid_to'], closed='left')
+            self.codes[index_code] = group['ts_code'].to_numpy()
+            self.bounds[index_code] = (group['valid_from'].to_numpy(dtype='datetime64[ns]'),
+                                       group['valid_to'].to_numpy(dtype='datetime64[ns]'))
+
+    @classmethod
+    def load(cls, engine=None, indices=None):
+        """从历史表加载，indices可为指数代码或名称列表，默认全部"""
+        if engine is None:
+            config = load_config()
+            engine = create_engine(get_pg_connection_string(config))
+        query = f"SELECT index_code, index_name, ts_code, valid_from, valid_to FROM {TABLE_NAME}"
+        params = {}
+        if indices:
+            query += " WHERE index_code = ANY(:indices) OR index_name = ANY(:indices)"
+            params['indices'] = list(indices)
+        return cls(pd.read_sql(text(query), engine, params=params))
+
+    def _resolve(self, index) -> str:
+        if index in self.intervals:
+            return index
+        if index in self.names:
+            return self.names[index]
+        raise KeyError(f"未加载指数 {index} 的成分历史")
+
+    def members_as_of(self, index, as_of) -> List[str]:
+        """指定日期的成分股列表"""
+        index_code = self._resolve(index)
+        hit = self.intervals[index_code].contains(pd.Timestamp(as_of))
+        return sorted(set(self.codes[index_code][hit]))
+
+    def universe(self, index, start, end) -> List[str]:
+        """区间内任一时刻曾为成分股的全部股票(无幸存者偏差的股票池)"""
+        index_code = self._resolve(index)
+        valid_from, valid_to = self.bounds[index_code]
+        hit = (valid_from <= np.datetime64(pd.Timestamp(end))) & (valid_to > np.datetime64(pd.Timestamp(start)))
+        return sorted(set(self.codes[index_code][hit]))
+
+    def mask(self, index, dates, ts_codes) -> np.ndarray:
+        """
+        生成 (T × N) 布尔掩码，mask[t, n]表示ts_codes[n]在dates[t]时刻是否为成分股
+        Args:
+            dates: 升序时间轴(日期或K线时间)
+            ts_codes: 股票代码列
+        """
+        index_code = self._resolve(index)
+        dates = np.asarray(pd.to_datetime(dates), dtype='datetime64[ns]')
+        column = pd.Index(ts_codes).get_indexer(self.codes[index_code])
+        keep = column >= 0
+        valid_from, valid_to = self.bounds[index_code]
+        start = np.searchsorted(dates, valid_from[keep], side='left')
+        end = np.searchsorted(dates, valid_to[keep], side='left')
+        delta = np.zeros((len(dates) + 1, len(ts_codes)), dtype=np.int32)
+        np.add.at(delta, (start, column[keep]), 1)
+        np.add.at(delta, (end, column[keep]), -1)
+        return np.cumsum(delta, axis=0)[:-1] > 0
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='指数成分股历史维护')
+    parser.add_argument('--backfill', action='store_true', help='回补中证指数成分历史')
+    parser.add_argument('--start-date', type=str, default='20100101', help='回补开始日期 (YYYYMMDD)')
+    parser.add_argument('--end-date', type=str, help='回补结束日期 (YYYYMMDD)，默认今天')
+    parser.add_argument('--index', type=str, nargs='*', help='指数代码，默认全部中证指数')
+    args = parser.parse_args()
+
+    setup_logger()
+    config = load_config()
+    engine = create_engine(get_pg_connection_string(config))
+    create_table_if_not_exists(engine)
+    if args.backfill:
+        backfill_csi_history(engine, args.start_date, args.end_date, args.index)
+
+if __name__ == '__main__':
+    main()
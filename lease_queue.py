@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL表上的租约工作队列
+
+backfill_orchestrator(K线回补单元) 与 optimization_queue(参数优化任务) 共用的领取/续租/接管逻辑：
+- 任务表包含 status(pending/running/done/failed)、attempts、worker、lease_until、last_error、started_at、finished_at 列
+- claim 通过 FOR UPDATE SKIP LOCKED 领取一个待执行、可重试的失败或租约已过期的执行中任务，多进程多机器互不重复、互不阻塞
+- 领取时设置租约，LeaseKeeper 后台线程每 lease_seconds/3 秒续租；进程或机器崩溃后租约过期，任务被其他工作进程重新领取
+- finish 仅当任务仍由本进程持有时生效，可与结果写入放在同一事务中；租约已被接管的过期进程无法覆盖状态和结果
+- fail_expired 把租约过期且已达重试上限的任务标记为失败
+
+用法:
+    queue = LeaseQueue('opt_job', scope='run_id', keys=['run_id', 'ts_code'], order_by='attempts, enqueued_at, ts_code')
+    row = queue.claim(engine, run_id, worker, max_attempts, lease_seconds, ['run_id', 'ts_code', 'param_space'])
+    key = {'run_id': row[0], 'ts_code': row[1]}
+    with LeaseKeeper(queue, engine, key, worker, lease_seconds):
+        ...
+    with engine.begin() as conn:
+        if queue.finish(conn, key, worker):
+            ...  # 同一事务中写入结果
+"""
+from common import *
+import threading
+
+
+# ================================= 队列 =================================
+class LeaseQueue:
+    """
+    绑定到一张任务表的租约队列
+    Args:
+        table: 任务表名
+        scope: 划分批次的列(如run_id/job)，领取和统计时按该列过滤，传入None表示全部批次
+        keys: 唯一标识一个任务的列(含scope列)
+        order_by: 领取顺序
+    """
+
+    def __init__(self, table: str, scope: str, keys: List[str], order_by: str):
+        self.table = table
+        self.scope = scope
+        self.keys = list(keys)
+        self.order_by = order_by
+
+    def _scope_filter(self) -> str:
+        return f"(CAST(:scope AS VARCHAR) IS NULL OR {self.scope} = :scope)"
+
+    def _key_filter(self) -> str:
+        return ' AND '.join(f"{key} = :{key}" for key in self.keys)
+
+    def add_lease_column(self, conn) -> None:
+        """旧版本建立的任务表没有lease_until列时补上"""
+        conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP"))
+
+    def claim(self, engine, scope: Optional[str], worker: str, max_attempts: int, lease_seconds: int,
+              returning: List[str]) -> Optional[tuple]:
+        """
+        领取一个任务并设置租约：待执行、可重试的失败或租约已过期(含无租约的遗留)的执行中任务
+        Returns:
+            returning各列的值，无可领取任务时返回None
+        """
+        claim_sql = f"""
+            UPDATE {self.table} q SET status = 'running', attempts = q.attempts + 1, worker = :worker,
+                started_at = NOW(), lease_until = NOW() + make_interval(secs => :lease)
+            FROM (
+                SELECT {', '.join(self.keys)} FROM {self.table}
+                WHERE {self._scope_filter()} AND attempts < :max_attempts
+                  AND (status = 'pending' OR status = 'failed'
+                       OR (status = 'running' AND (lease_until IS NULL OR lease_until < NOW())))
+                ORDER BY {self.order_by}
+                LIMIT 1 FOR UPDATE SKIP LOCKED
+            ) c
+            WHERE {' AND '.join(f"q.{key} = c.{key}" for key in self.keys)}
+            RETURNING {', '.join(f"q.{column}" for column in returning)}
+        """
+        with engine.begin() as conn:
+            row = conn.execute(text(claim_sql), {'scope': scope, 'worker': worker, 'max_attempts': max_attempts,
+                                                 'lease': lease_seconds}).fetchone()
+        return tuple(row) if row is not None else None
+
+    def renew(self, engine, key: dict, worker: str, lease_seconds: int) -> bool:
+        """续租，返回False表示租约已过期并被其他工作进程接管"""
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                UPDATE {self.table} SET lease_until = NOW() + make_interval(secs => :lease)
+                WHERE {self._key_filter()} AND worker = :worker AND status = 'running'
+            """), {**key, 'lease': lease_seconds, 'worker': worker})
+        return result.rowcount > 0
+
+    def finish(self, conn, key: dict, worker: str, error: str = None, values: dict = None) -> bool:
+        """
+        在调用方的事务中标记任务完成或失败，values为同时更新的其他列；
+        仅当任务仍由本进程持有时生效，返回False表示租约已被接管
+        """
+        values = values or {}
+        assignments = ''.join(f", {column} = :{column}" for column in values)
+        row = conn.execute(text(f"""
+            UPDATE {self.table}
+            SET status = :status, last_error = :error, finished_at = NOW(), lease_until = NULL{assignments}
+            WHERE {self._key_filter()} AND worker = :worker AND status = 'running'
+            RETURNING {self.keys[0]}
+        """), {**key, **values, 'status': 'failed' if error else 'done', 'error': error, 'worker': worker}).fetchone()
+        return row is not None
+
+    def fail_expired(self, engine, scope: Optional[str], max_attempts: int) -> int:
+        """租约过期且已达重试上限的任务不会再被领取，标记为失败"""
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                UPDATE {self.table} SET status = 'failed', last_error = '租约过期', lease_until = NULL
+                WHERE {self._scope_filter()} AND status = 'running'
+                  AND (lease_until IS NULL OR lease_until < NOW()) AND attempts >= :max_attempts
+            """), {'scope': scope, 'max_attempts': max_attempts})
+        if result.rowcount:
+            logger.warning(f"{self.table} 有 {result.rowcount} 个任务租约过期且已达重试上限，标记为失败")
+        return result.rowcount
+
+    def running(self, engine, scope: Optional[str]) -> int:
+        """执行中(含租约已过期)的任务数"""
+        with engine.connect() as conn:
+            return conn.execute(text(f"""
+                SELECT COUNT(*) FROM {self.table} WHERE {self._scope_filter()} AND status = 'running'
+            """), {'scope': scope}).scalar() or 0
+
+    def reset_failed(self, engine, scope: str) -> int:
+        """将失败任务的重试次数清零，使其重新进入队列"""
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                UPDATE {self.table} SET status = 'pending', attempts = 0
+                WHERE {self.scope} = :scope AND status = 'failed'
+            """), {'scope': scope})
+        return result.rowcount
+
+
+# ================================= 续租线程 =================================
+class LeaseKeeper:
+    """后台线程定期续租，任务结束时停止；lost为True表示租约已被其他工作进程接管"""
+
+    def __init__(self, queue: LeaseQueue, engine, key: dict, worker: str, lease_seconds: int):
+        self.queue = queue
+        self.engine = engine
+        self.key = key
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.stop_event = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        label = ' '.join(str(value) for value in self.key.values())
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.engine, self.key, self.worker, self.lease_seconds):
+                    self.lost = True
+                    logger.warning(f"{label} 租约已被其他工作进程接管")
+                    return
+            except Exception as e:
+                logger.error(f"{label} 续租失败: {str(e)}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
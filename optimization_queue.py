@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+跨机器的参数优化任务队列
+
+单机 mp.Pool(cpu_count()-1) 跑完沪深A股的全量优化受限于一台机器。本模块用PostgreSQL表作为任务队列：
+- 协调端把 (策略, 股票, 参数空间) 作为任务登记到 opt_job 表，同一批任务用run_id标识
+- 任意台机器上的任意个工作进程通过 FOR UPDATE SKIP LOCKED 领取任务，互不重复、互不阻塞，加机器即线性增加吞吐
+- 领取时设置租约(lease_until)，工作进程后台线程定期续租；进程或机器崩溃后租约过期，任务被其他工作进程重新领取
+  (领取/续租/接管与K线回补共用 lease_queue)
+- 任务完成后结果(优化脚本optimize_stock返回的指标字典)与任务状态在同一事务中写入 opt_result 表，
+  租约已被他人接管的过期进程无法覆盖结果
+- 执行出错(含参数空间无法解析)的任务记为失败，在重试次数内自动重新领取；没有数据或没有有效参数的股票记为完成但无结果
+
+参数空间是覆盖策略脚本模块级参数的JSON，如 {"SEARCH": "grid", "PERIOD_RANGE": [10, 20, 30]}
+
+用法:
+    # 协调端登记任务
+    python optimization_queue.py --enqueue --run st_2024 --strategy ha_st_mult_tscode --space '{"SEARCH": "grid"}'
+    # 每台机器启动工作进程
+    python optimization_queue.py --work --run st_2024 --processes 8
+    # 查看进度 / 导出结果
+    python optimization_queue.py --status --run st_2024 --watch
+    python optimization_queue.py --export --run st_2024 --sort-by sharpe
+"""
+from common import *
+import argparse
+import importlib
+import json
+import socket
+from multiprocessing import Pool
+from lease_queue import LeaseKeeper, LeaseQueue
+
+
+# ================================= 定义初始变量 =================================
+JOB_TABLE = 'opt_job'
+RESULT_TABLE = 'opt_result'
+STOCK_LIST_FILE = '沪深A股_stock_list.csv'
+LEASE_SECONDS = 600      # 租约时长，工作进程每 LEASE_SECONDS/3 秒续租一次
+POLL_SECONDS = 30        # 队列暂无可领取任务但仍有他人执行中的任务时的轮询间隔
+
+# 可排队的策略：脚本模块、结果中的评分列和默认输出文件
+STRATEGIES = {
+    'ha_st_mult_tscode': {'module': 'bt_ha_supertrend_mult_tscode', 'score': 'optimization_score',
+                          'output': 'Heikin_Ashi_SuperTrend_Metrics.csv'},
+    'ma_adx_mult_tscode': {'module': 'bt_ma_adx_mult_tscode', 'score': 'sharpe',
+                           'output': 'MA_ADX_Strategy_Metrics.csv'},
+}
+
+QUEUE = LeaseQueue(JOB_TABLE, scope='run_id', keys=['run_id', 'ts_code'], order_by='attempts, enqueued_at, ts_code')
+
+
+# ================================= 队列表 =================================
+def create_tables_if_not_exists(engine) -> None:
+    """创建任务表和结果表"""
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {JOB_TABLE} (
+        run_id VARCHAR(50) NOT NULL,
+        ts_code VARCHAR(20) NOT NULL,
+        strategy VARCHAR(50) NOT NULL,
+        param_space TEXT NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker VARCHAR(100),
+        lease_until TIMESTAMP,
+        last_error TEXT,
+        enqueued_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        PRIMARY KEY (run_id, ts_code)
+    );
+    CREATE INDEX IF NOT EXISTS idx_{JOB_TABLE}_status ON {JOB_TABLE} (run_id, status);
+    CREATE TABLE IF NOT EXISTS {RESULT_TABLE} (
+        run_id VARCHAR(50) NOT NULL,
+        ts_code VARCHAR(20) NOT NULL,
+        strategy VARCHAR(50) NOT NULL,
+        score DOUBLE PRECISION,
+        metrics TEXT NOT NULL,
+        worker VARCHAR(100),
+        elapsed DOUBLE PRECISION,
+        finished_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (run_id, ts_code)
+    );
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+
+def enqueue_jobs(engine, run_id: str, strategy: str, ts_codes: List[str], param_space: dict) -> int:
+    """
+    登记一批任务，已登记的股票保持原状态(可重复执行)
+    参数空间JSON含引号，用参数化INSERT写入，不经过COPY文本格式的转义
+    Returns:
+        int: 新登记的任务数
+    """
+    create_tables_if_not_exists(engine)
+    space = json.dumps(param_space, sort_keys=True)
+    jobs = [{'run_id': run_id, 'ts_code': ts_code, 'strategy': strategy, 'param_space': space}
+            for ts_code in dict.fromkeys(ts_codes)]
+    insert_sql = f"""
+        INSERT INTO {JOB_TABLE} (run_id, ts_code, strategy, param_space)
+        VALUES (:run_id, :ts_code, :strategy, :param_space)
+        ON CONFLICT (run_id, ts_code) DO NOTHING
+    """
+    count_sql = text(f"SELECT COUNT(*) FROM {JOB_TABLE} WHERE run_id = :run_id")
+    with engine.begin() as conn:
+        before = conn.execute(count_sql, {'run_id': run_id}).scalar()
+        if jobs:
+            conn.execute(text(insert_sql), jobs)
+        after = conn.execute(count_sql, {'run_id': run_id}).scalar()
+    logger.info(f"{run_id} 登记 {len(jobs)} 个任务，新登记 {after - before} 个")
+    return after - before
+
+def claim_job(engine, run_id: Optional[str], worker: str, max_attempts: int, lease_seconds: int) -> Optional[tuple]:
+    """
+    领取一个任务：待执行、可重试的失败任务或租约已过期的执行中任务；run_id为None时从全部批次中领取
+    Returns:
+        (run_id, ts_code, strategy, param_space JSON字符串)，无可领取任务时返回None
+    """
+    return QUEUE.claim(engine, run_id, worker, max_attempts, lease_seconds,
+                       ['run_id', 'ts_code', 'strategy', 'param_space'])
+
+def finish_job(engine, run_id: str, ts_code: str, strategy: str, worker: str, elapsed: float,
+               metrics: dict = None, error: str = None) -> bool:
+    """
+    标记任务完成(写入结果)或失败，状态更新与结果写入在同一事务中；
+    仅当任务仍由本进程持有时生效，返回False表示租约已被接管、结果被丢弃
+    """
+    with engine.begin() as conn:
+        if not QUEUE.finish(conn, {'run_id': run_id, 'ts_code': ts_code}, worker, error):
+            return False
+        if metrics is not None:
+            score = metrics.get(STRATEGIES[strategy]['score'])
+            conn.execute(text(f"""
+                INSERT INTO {RESULT_TABLE} (run_id, ts_code, strategy, score, metrics, worker, elapsed)
+                VALUES (:run_id, :ts_code, :strategy, :score, :metrics, :worker, :elapsed)
+                ON CONFLICT (run_id, ts_code) DO UPDATE SET
+                    score = EXCLUDED.score, metrics = EXCLUDED.metrics, worker = EXCLUDED.worker,
+                    elapsed = EXCLUDED.elapsed, finished_at = NOW()
+            """), {'run_id': run_id, 'ts_code': ts_code, 'strategy': strategy,
+                   'score': float(score) if score is not None and np.isfinite(score) else None,
+                   'metrics': json.dumps(metrics, default=_json_default), 'worker': worker, 'elapsed': elapsed})
+    return True
+
+def _json_default(value):
+    """numpy标量等转换为JSON可序列化类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'无法序列化的类型: {type(value)}')
+
+def get_progress(engine, run_id: str) -> pd.DataFrame:
+    """按状态汇总任务数、尝试次数和租约过期数"""
+    return pd.read_sql(text(f"""
+        SELECT status, COUNT(*) AS jobs, MAX(attempts) AS max_attempts,
+               SUM(CASE WHEN status = 'running' AND lease_until < NOW() THEN 1 ELSE 0 END) AS expired_leases
+        FROM {JOB_TABLE} WHERE run_id = :run_id GROUP BY status ORDER BY status
+    """), engine, params={'run_id': run_id})
+
+def get_throughput(engine, run_id: str, minutes: int = 10) -> pd.DataFrame:
+    """最近minutes分钟内各主机完成的任务数、平均耗时和执行中的任务数"""
+    return pd.read_sql(text(f"""
+        SELECT split_part(worker, ':', 1) AS host,
+               SUM(CASE WHEN status = 'done' AND finished_at >= NOW() - make_interval(mins => :minutes) THEN 1 ELSE 0 END) AS recent_done,
+               SUM(CASE WHEN status = 'running' THEN 1 ELSE 0 END) AS running,
+               AVG(CASE WHEN status = 'done' THEN EXTRACT(EPOCH FROM finished_at - started_at) END) AS avg_seconds
+        FROM {JOB_TABLE} WHERE run_id = :run_id AND worker IS NOT NULL
+        GROUP BY 1 ORDER BY 1
+    """), engine, params={'run_id': run_id, 'minutes': minutes})
+
+def report_progress(engine, run_id: str, minutes: int = 10) -> None:
+    """输出任务状态、各主机吞吐和预计剩余时间"""
+    progress = get_progress(engine, run_id)
+    throughput = get_throughput(engine, run_id, minutes)
+    counts = progress.set_index('status')['jobs']
+    remaining = int(counts.get('pending', 0) + counts.get('running', 0) + counts.get('failed', 0))
+    rate = throughput['recent_done'].sum() / minutes if not throughput.empty else 0
+    eta = f"{remaining / rate:.0f} 分钟" if rate > 0 else '未知'
+    logger.info(f"{run_id} 任务状态:\n{progress.to_string(index=False)}\n"
+                f"各主机吞吐(最近{minutes}分钟):\n{throughput.to_string(index=False) if not throughput.empty else '无'}\n"
+                f"剩余 {remaining} 个任务，当前 {rate:.1f} 个/分钟，预计还需 {eta}")
+
+def export_results(engine, run_id: str, sort_by: str = None) -> tuple:
+    """
+    结果表展开为与优化脚本输出CSV相同的表格
+    Returns:
+        (results_df, strategy)
+    """
+    rows = pd.read_sql(text(f"SELECT strategy, metrics FROM {RESULT_TABLE} WHERE run_id = :run_id"),
+                       engine, params={'run_id': run_id})
+    results_df = pd.DataFrame([json.loads(m) for m in rows['metrics']])
+    if sort_by and sort_by in results_df.columns:
+        results_df = results_df.sort_values(by=sort_by, ascending=False)
+    return results_df, (rows['strategy'].iloc[0] if not rows.empty else None)
+
+
+# ================================= 工作进程 =================================
+def configure_strategy(strategy: str, param_space: dict, defaults: Dict[str, dict]):
+    """
+    导入策略脚本模块，先恢复模块级参数的默认值，再用参数空间覆盖(与脚本main中更新全局参数的方式相同)
+    参数空间中不存在于模块的参数名视为错误
+    """
+    module = importlib.import_module(STRATEGIES[strategy]['module'])
+    if strategy not in defaults:
+        defaults[strategy] = {name: getattr(module, name) for name in dir(module) if name.isupper()}
+    for name, value in defaults[strategy].items():
+        setattr(module, name, value)
+    for name, value in param_space.items():
+        if name not in defaults[strategy]:
+            raise ValueError(f"{strategy} 没有参数 {name}")
+        if isinstance(defaults[strategy][name], np.ndarray):
+            value = np.asarray(value)
+        setattr(module, name, value)
+    return module
+
+def run_worker(run_id: Optional[str], worker_no: int, max_attempts: int, lease_seconds: int) -> int:
+    """
+    工作进程主循环：领取任务 -> 按参数空间配置策略 -> optimize_stock -> 写入结果；
+    暂无可领取任务但仍有其他进程执行中的任务时继续轮询(以便接管过期租约)，全部结束后退出
+    """
+    setup_logger()
+    engine = create_engine(get_pg_connection_string(load_config()))
+    worker = f"{socket.gethostname()}:{os.getpid()}:{worker_no}"
+    defaults = {}
+    done = 0
+    while True:
+        job = claim_job(engine, run_id, worker, max_attempts, lease_seconds)
+        if job is None:
+            QUEUE.fail_expired(engine, run_id, max_attempts)
+            if not QUEUE.running(engine, run_id):
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+
+        job_run_id, ts_code, strategy, param_space = job
+        t0 = time.time()
+        with LeaseKeeper(QUEUE, engine, {'run_id': job_run_id, 'ts_code': ts_code}, worker, lease_seconds):
+            try:
+                module = configure_strategy(strategy, json.loads(param_space), defaults)
+                # 执行出错时抛出异常，记为失败以便重试；没有数据或没有有效参数时返回None，记为完成但无结果
+                metrics = module.optimize_stock(ts_code, raise_errors=True)
+                error = None
+            except Exception as e:
+                logger.error(f"{job_run_id} {strategy} {ts_code} 执行失败: {str(e)}")
+                metrics, error = None, str(e)[:2000]
+        if not finish_job(engine, job_run_id, ts_code, strategy, worker, time.time() - t0, metrics, error):
+            logger.warning(f"{job_run_id} {ts_code} 租约已失效，结果被丢弃")
+        elif error is None:
+            done += 1
+    return done
+
+def run_workers(engine, run_id: Optional[str], processes: int, max_attempts: int, lease_seconds: int,
+                poll_seconds: int = 60) -> None:
+    """在本机启动工作进程并定期输出进度"""
+    with Pool(processes=processes) as pool:
+        result = pool.starmap_async(run_worker, [(run_id, i, max_attempts, lease_seconds) for i in range(processes)])
+        while not result.ready():
+            result.wait(poll_seconds)
+            if run_id:
+                report_progress(engine, run_id)
+        done = sum(result.get())
+    logger.info(f"本机 {processes} 个工作进程结束，共完成 {done} 个任务")
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='跨机器的参数优化任务队列')
+    parser.add_argument('--run', type=str, help='任务批次ID')
+    parser.add_argument('--enqueue', action='store_true', help='登记任务')
+    parser.add_argument('--work', action='store_true', help='启动本机工作进程')
+    parser.add_argument('--status', action='store_true', help='查看进度')
+    parser.add_argument('--export', action='store_true', help='导出结果CSV')
+    parser.add_argument('--strategy', type=str, choices=list(STRATEGIES), default='ha_st_mult_tscode', help='策略')
+    parser.add_argument('--space', type=str, default='{}', help='参数空间JSON，覆盖策略脚本的模块级参数')
+    parser.add_argument('--ts-codes', type=str, nargs='*', help=f'股票代码，默认读取{STOCK_LIST_FILE}')
+    parser.add_argument('--processes', type=int, default=max(1, os.cpu_count() - 1), help='本机工作进程数')
+    parser.add_argument('--max-attempts', type=int, default=3, help='每个任务的最大尝试次数')
+    parser.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS, help=f'租约时长 (默认: {LEASE_SECONDS}秒)')
+    parser.add_argument('--retry-failed', action='store_true', help='重置已达重试上限的失败任务')
+    parser.add_argument('--watch', action='store_true', help='持续输出进度')
+    parser.add_argument('--sort-by', type=str, default='sharpe', help='导出结果排序依据 (默认: sharpe)')
+    parser.add_argument('--output', type=str, help='导出文件 (默认: 该批次策略脚本的输出文件名)')
+    args = parser.parse_args()
+
+    setup_logger()
+    engine = create_engine(get_pg_connection_string(load_config()))
+    create_tables_if_not_exists(engine)
+    if (args.enqueue or args.status or args.export or args.retry_failed) and not args.run:
+        parser.error('--enqueue/--status/--export/--retry-failed 需要指定 --run')
+
+    if args.enqueue:
+        ts_codes = args.ts_codes or pd.read_csv(STOCK_LIST_FILE, header=None, names=['ts_code'])['ts_code'].tolist()
+        param_space = json.loads(args.space)
+        configure_strategy(args.strategy, param_space, {})  # 登记前校验参数名
+        enqueue_jobs(engine, args.run, args.strategy, ts_codes, param_space)
+    if args.retry_failed:
+        logger.info(f"{args.run} 重置 {QUEUE.reset_failed(engine, args.run)} 个失败任务")
+    if args.work:
+        run_workers(engine, args.run, args.processes, args.max_attempts, args.lease_seconds)
+    if args.status:
+        while True:
+            report_progress(engine, args.run)
+            if not args.watch:
+                break
+            time.sleep(POLL_SECONDS)
+    if args.export:
+        results_df, strategy = export_results(engine, args.run, args.sort_by)
+        output = args.output or STRATEGIES[strategy or args.strategy]['output']
+        results_df.to_csv(output, index=False)
+        logger.info(f"{args.run} 导出 {len(results_df)} 条结果到 {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+HA SuperTrend 全市场面板回测
+
+把一批股票的30分钟K线按时间对齐为 (K线数 T × 股票数 N) 的矩阵，一次载入：
+- Heikin Ashi、ATR、SuperTrend递推、下单撮合在同一个时间循环中对全部股票同时计算，
+  同一period的所有multiplier作为额外一维一起计算，参数网格只需循环period
+- 某只股票在某根K线没有数据(未上市、停牌)时其状态原样保留，结果与逐只股票单独回测一致
+- 撮合语义与 vector_backtest / Cerebro 相同，评分与 bt_ha_supertrend_mult_tscode 的 ha_st_score 相同
+
+optimize_panel 按股票分块(控制内存)遍历整个参数网格，输出每只股票的最优参数表；
+check_panel 对少量股票与逐只回测的结果逐项比对:
+    python panel_backtest.py --stock 600000.SH 000001.SZ --check
+--synthetic 用合成K线(含晚上市、停牌和退市)和合成基准离线比对，不需要数据库:
+    python panel_backtest.py --check --synthetic --stocks 6
+"""
+from common import *
+from vector_backtest import INITIAL_CASH, COMMISSION, POSITION_RATIO, run_vector_backtest, synthetic_bars
+from perf_metrics import aggregate_daily_returns, ha_st_score
+from shared_market_data import get_benchmark
+import argparse
+
+
+# ================================= 定义初始变量 =================================
+KLINE_TABLE = 'a_stock_30m_kline_wfq_baostock'
+PANEL_CHUNK = 200  # 每块股票数，内存约为 交易日数 × 股票数 × multiplier数 × 8字节
+SCORE_COLUMNS = ['sharpe', 'sortino', 'avg_up_days', 'max_up_days', 'trend_strength', 'max_drawdown',
+                 'volatility', 'downside_vol']
+
+
+# ================================= 面板数据 =================================
+class PanelData:
+    """
+    对齐后的K线面板，矩阵形状均为(T, N)，无K线处为NaN
+    day_index: 每根K线所属交易日序号；day_end: 是否为当日(面板时间轴上)最后一根K线
+    first_day/last_day: 每只股票首/末根K线所在交易日序号，没有数据的股票为-1
+    """
+
+    def __init__(self, index: pd.DatetimeIndex, codes: list, open_: np.ndarray, high: np.ndarray,
+                 low: np.ndarray, close: np.ndarray):
+        self.index = pd.DatetimeIndex(index)
+        self.codes = list(codes)
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.valid = ~(np.isnan(open_) | np.isnan(high) | np.isnan(low) | np.isnan(close))
+        self.ha_open, self.ha_high, self.ha_low, self.ha_close = heikin_ashi_panel(open_, high, low, close, self.valid)
+
+        days = self.index.values.astype('datetime64[D]')
+        new_day = np.r_[True, days[1:] != days[:-1]]
+        self.day_index = np.cumsum(new_day) - 1
+        self.day_end = np.r_[new_day[1:], True]
+        self.days = pd.DatetimeIndex(days[new_day])
+
+        has_bar = self.valid.any(axis=0)
+        first_bar = np.argmax(self.valid, axis=0)
+        last_bar = len(self.index) - 1 - np.argmax(self.valid[::-1], axis=0)
+        self.first_day = np.where(has_bar, self.day_index[first_bar], -1)
+        self.last_day = np.where(has_bar, self.day_index[last_bar], -1)
+
+    @property
+    def shape(self) -> tuple:
+        return self.valid.shape
+
+def build_panel(df: pd.DataFrame, codes: list = None) -> PanelData:
+    """由包含trade_time, ts_code, open, high, low, close的长表构建面板，codes指定列顺序"""
+    df = df.drop_duplicates(['trade_time', 'ts_code'])
+    codes = list(codes) if codes is not None else sorted(df['ts_code'].unique())
+    wide = {col: df.pivot(index='trade_time', columns='ts_code', values=col).reindex(columns=codes)
+            for col in ['open', 'high', 'low', 'close']}
+    index = wide['close'].index
+    return PanelData(index, codes, *(wide[col].to_numpy(dtype=float) for col in ['open', 'high', 'low', 'close']))
+
+def load_panel(ts_codes: list, start_date: str, end_date: str, engine) -> PanelData:
+    """一次查询载入一批股票的不复权30分钟K线(与get_30m_kline_data相同的筛选和清洗)"""
+    query = text(f"""
+        SELECT trade_time, ts_code, open, high, low, close
+        FROM {KLINE_TABLE}
+        WHERE ts_code = ANY(:codes) AND trade_time >= :start_date AND trade_time <= :end_date
+        ORDER BY ts_code, trade_time
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params={'codes': list(ts_codes), 'start_date': start_date, 'end_date': end_date})
+    for col in ['open', 'high', 'low', 'close']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna()
+    df['trade_time'] = pd.to_datetime(df['trade_time'])
+    return build_panel(df, ts_codes)
+
+
+# ================================= 指标 =================================
+def heikin_ashi_panel(open_, high, low, close, valid) -> tuple:
+    """
+    按列计算Heikin Ashi(与ta.ha一致)，跳过无K线的行：
+    ha_open[0] = (open[0] + close[0]) / 2, ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2
+    递推用 ewm(alpha=0.5, adjust=False, ignore_na=True) 实现，NaN行不参与也不打断递推
+    """
+    ha_close = 0.25 * (open_ + high + low + close)
+    prev_close = pd.DataFrame(ha_close).ffill().shift(1).to_numpy()
+    seed = np.isnan(prev_close) & valid
+    source = np.where(valid, np.where(seed, 0.5 * (open_ + close), prev_close), np.nan)
+    ha_open = pd.DataFrame(source).ewm(alpha=0.5, adjust=False, ignore_na=True).mean().to_numpy()
+    ha_open = np.where(valid, ha_open, np.nan)
+    ha_high = np.where(valid, np.fmax(np.fmax(high, ha_open), ha_close), np.nan)
+    ha_low = np.where(valid, np.fmin(np.fmin(low, ha_open), ha_close), np.nan)
+    return ha_open, ha_high, ha_low, ha_close
+
+def atr_panel(panel: PanelData, length: int) -> np.ndarray:
+    """逐列对有K线的行计算talib.ATR(HA价格)，无K线的行为NaN"""
+    atr = np.full(panel.shape, np.nan)
+    for j in range(panel.shape[1]):
+        rows = np.flatnonzero(panel.valid[:, j])
+        if len(rows):
+            atr[rows, j] = talib.ATR(panel.ha_high[rows, j], panel.ha_low[rows, j], panel.ha_close[rows, j], int(length))
+    return atr
+
+
+# ================================= 面板回测 =================================
+def run_panel_length(panel: PanelData, length: int, multipliers, initial_cash: float = INITIAL_CASH,
+                     commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> np.ndarray:
+    """
+    同一length下的所有multiplier对全部股票同时回测
+    每根K线依次：上一根信号的订单按开盘价成交 -> SuperTrend递推 -> 策略按direction下单 -> 记录资产
+    Returns:
+        每个交易日收盘后的资产，形状(交易日数, N, multiplier数)
+    """
+    multipliers = np.asarray(multipliers, dtype=float)[None, :]
+    atr = atr_panel(panel, length)
+    hl2 = (panel.ha_high + panel.ha_low) / 2
+    n_bars, n_stocks = panel.shape
+    shape = (n_stocks, multipliers.shape[1])
+
+    direction = np.ones(shape)
+    upper = np.full(shape, np.nan)
+    lower = np.full(shape, np.nan)
+    cash = np.full(shape, float(initial_cash))
+    position = np.zeros(shape)
+    entry_price = np.zeros(shape)
+    order_size = np.zeros(shape)
+    in_position = np.zeros(shape, dtype=bool)
+    pending_entry = np.zeros(shape, dtype=bool)
+    pending_exit = np.zeros(shape, dtype=bool)
+    equity = cash.copy()
+    day_equity = np.empty((len(panel.days),) + shape)
+
+    with np.errstate(invalid='ignore'):
+        for i in range(n_bars):
+            valid = panel.valid[i][:, None]
+            open_ = panel.open[i][:, None]
+            close = panel.close[i][:, None]
+
+            # 上一根K线的订单在本根开盘成交，现金不足(含佣金)则被拒
+            fill = pending_entry & valid
+            after = cash - order_size * open_ - order_size * open_ * commission
+            filled = fill & (order_size > 0) & (after >= 0.0)
+            cash = np.where(filled, after, cash)
+            position = np.where(filled, order_size, position)
+            entry_price = np.where(filled, open_, entry_price)
+            pending_entry &= ~valid
+
+            exit_fill = pending_exit & valid & (position > 0)
+            exit_cash = (cash + position * entry_price + position * (open_ - entry_price)
+                         - position * open_ * commission)
+            cash = np.where(exit_fill, exit_cash, cash)
+            position = np.where(exit_fill, 0.0, position)
+            pending_exit &= ~valid
+
+            # SuperTrend递推(与ta.supertrend相同)，无K线的股票保持上一状态
+            ha_close = panel.ha_close[i][:, None]
+            matr = atr[i][:, None] * multipliers
+            upper_raw = hl2[i][:, None] + matr
+            lower_raw = hl2[i][:, None] - matr
+            up = ha_close > upper
+            down = ~up & (ha_close < lower)
+            hold = ~(up | down)
+            new_direction = np.where(up, 1.0, np.where(down, -1.0, direction))
+            new_lower = np.where(hold & (new_direction > 0) & (lower_raw < lower), lower, lower_raw)
+            new_upper = np.where(hold & (new_direction < 0) & (upper_raw > upper), upper, upper_raw)
+            direction = np.where(valid, new_direction, direction)
+            lower = np.where(valid, new_lower, lower)
+            upper = np.where(valid, new_upper, upper)
+
+            # 策略：空仓且direction==1买入，持仓且direction==-1平仓
+            buy = valid & ~in_position & (direction == 1)
+            sell = valid & in_position & (direction == -1)
+            order_size = np.where(buy, np.trunc((cash * position_ratio) / close), order_size)
+            pending_entry |= buy
+            pending_exit |= sell
+            in_position = (in_position | buy) & ~sell
+
+            equity = np.where(valid, cash + position * close, equity)
+            if panel.day_end[i]:
+                day_equity[panel.day_index[i]] = equity
+    return day_equity
+
+def panel_daily_returns(panel: PanelData, day_equity: np.ndarray, benchmark_returns: pd.Series,
+                        initial_cash: float = INITIAL_CASH) -> tuple:
+    """
+    与逐只回测相同口径的日收益：TimeReturn日收益 -> 按自然日补0 -> 与基准日期对齐并去除NaN
+    Returns:
+        (returns, dates): returns形状(基准日期数, N, multiplier数)，超出股票数据区间处为NaN
+    """
+    prev = np.concatenate([np.full((1,) + day_equity.shape[1:], float(initial_cash)), day_equity[:-1]])
+    returns = day_equity / prev - 1.0
+
+    benchmark_returns = benchmark_returns.dropna()
+    dates = pd.DatetimeIndex(benchmark_returns.index).normalize()
+    day_values = panel.days.values
+    pos = np.clip(np.searchsorted(day_values, dates.values), 0, max(len(day_values) - 1, 0))
+    present = (day_values[pos] == dates.values) if len(day_values) else np.zeros(len(dates), dtype=bool)
+    aligned = np.where(present[:, None, None], returns[pos], 0.0)
+
+    # 只保留每只股票首末K线日期之间的日期
+    first = np.where(panel.first_day >= 0, day_values[np.maximum(panel.first_day, 0)], np.datetime64('NaT'))
+    last = np.where(panel.last_day >= 0, day_values[np.maximum(panel.last_day, 0)], np.datetime64('NaT'))
+    in_span = (dates.values[:, None] >= first[None, :]) & (dates.values[:, None] <= last[None, :])
+    aligned[~in_span] = np.nan
+    return aligned, dates
+
+def score_panel(panel: PanelData, length: int, multipliers, benchmark_returns: pd.Series) -> pd.DataFrame:
+    """一个length下全部股票 × multiplier 的ha_st_score，行为(ts_code, multiplier)"""
+    day_equity = run_panel_length(panel, length, multipliers)
+    returns, dates = panel_daily_returns(panel, day_equity, benchmark_returns)
+    n_dates, n_stocks, n_mult = returns.shape
+    scores = ha_st_score(returns.reshape(n_dates, n_stocks * n_mult))
+    scores.index = pd.MultiIndex.from_product([panel.codes, list(multipliers)], names=['ts_code', 'multiplier'])
+    scores.insert(0, 'period', length)
+    return scores
+
+
+# ================================= 全市场优化 =================================
+def optimize_panel(ts_codes: list, start_date: str, end_date: str, periods, multipliers,
+                   benchmark_returns: pd.Series, engine, chunk: int = PANEL_CHUNK) -> pd.DataFrame:
+    """
+    按块载入股票面板并遍历参数网格，返回每只股票综合评分最高的参数及其评分分项
+    """
+    best = []
+    for start in tqdm(range(0, len(ts_codes), chunk), desc='面板回测'):
+        codes = ts_codes[start:start + chunk]
+        t0 = time.time()
+        panel = load_panel(codes, start_date, end_date, engine)
+        if not panel.valid.any():
+            continue
+        scores = pd.concat([score_panel(panel, period, multipliers, benchmark_returns) for period in periods])
+        scores = scores.reset_index()
+        scores = scores[np.isfinite(scores['score'])]
+        # 同分时取参数网格中靠前的组合
+        scores['grid_order'] = np.arange(len(scores))
+        top = scores.sort_values(['ts_code', 'score', 'grid_order'], ascending=[True, False, True]).groupby('ts_code').head(1)
+        best.append(top.drop(columns='grid_order'))
+        logger.info(f"面板回测 {len(codes)} 只股票 × {len(periods) * len(multipliers)} 组参数，"
+                    f"K线 {panel.shape[0]} 根，耗时 {time.time() - t0:.1f}秒")
+    if not best:
+        return pd.DataFrame()
+    result = pd.concat(best, ignore_index=True).rename(columns={'ts_code': 'stock_code', 'score': 'optimization_score'})
+    return result[['stock_code', 'period', 'multiplier', 'optimization_score'] + SCORE_COLUMNS]
+
+
+# ================================= 一致性校验 =================================
+def sequential_score(df: pd.DataFrame, length: int, multiplier: float, benchmark_returns: pd.Series) -> float:
+    """按bt_ha_supertrend_mult_tscode逐只股票的方式(单股HA、SuperTrend、数组回测)计算评分"""
+    df = df.copy()
+    df['direction'] = supertrend_batch(df['ha_high'], df['ha_low'], df['ha_close'], [length], [multiplier])[:, 0]
+    daily_returns = aggregate_daily_returns(run_vector_backtest(df).returns, calendar_days=True)
+    aligned_dates = daily_returns.index.intersection(benchmark_returns.index)
+    daily_returns = daily_returns[aligned_dates]
+    benchmark = benchmark_returns[aligned_dates]
+    daily_returns = daily_returns[~(daily_returns.isna() | benchmark.isna())]
+    return ha_st_score(daily_returns)['score'].iloc[0]
+
+def check_panel(panel: PanelData, frames: Dict[str, pd.DataFrame], periods, multipliers,
+                benchmark_returns: pd.Series, tol: float = 1e-8) -> pd.DataFrame:
+    """面板评分与逐只股票评分比对，frames为各股票已计算heikin_ashi、以trade_time为索引的K线"""
+    rows = []
+    for period in periods:
+        scores = score_panel(panel, period, multipliers, benchmark_returns)
+        for code, df in frames.items():
+            for multiplier in multipliers:
+                expected = sequential_score(df, period, multiplier, benchmark_returns)
+                actual = scores.loc[(code, multiplier), 'score']
+                diff = abs(actual - expected) if np.isfinite(expected) else (0.0 if not np.isfinite(actual) else np.inf)
+                rows.append({'stock_code': code, 'period': period, 'multiplier': multiplier, 'sequential': expected,
+                             'panel': actual, 'ok': diff <= tol * max(1.0, abs(expected))})
+    return pd.DataFrame(rows)
+
+def synthetic_market(n_stocks: int, n_days: int = 750, seed: int = 0) -> tuple:
+    """
+    离线比对用的合成行情：各股票的K线(长表)和沪深300日收益
+    第2只起依次晚上市，第3只起依次在中段停牌一段时间，最后一只提前退市，覆盖面板中无K线的各种情形
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for k in range(n_stocks):
+        df = synthetic_bars(n_days, seed * 1000 + k)
+        days = df['trade_time'].dt.normalize()
+        first_day = days.iloc[0]
+        keep = np.ones(len(df), dtype=bool)
+        if k >= 1:
+            keep &= (days >= first_day + pd.offsets.BDay(k * 20)).to_numpy()
+        if k >= 2:
+            pause = first_day + pd.offsets.BDay(n_days // 2 + k * 5)
+            keep &= ~((days >= pause) & (days < pause + pd.offsets.BDay(10 + k))).to_numpy()
+        if k == n_stocks - 1 and n_stocks > 1:
+            keep &= (days < first_day + pd.offsets.BDay(n_days - 60)).to_numpy()
+        frames.append(df[keep].assign(ts_code=f'synthetic_{k}'))
+    bars = pd.concat(frames, ignore_index=True)
+    days = pd.bdate_range(bars['trade_time'].min().normalize(), periods=n_days)
+    benchmark_returns = pd.Series(rng.normal(0.0003, 0.01, n_days), index=days, name='000300.SH')
+    return bars, benchmark_returns
+
+def get_benchmark_returns(start_date: str, end_date: str, engine) -> pd.Series:
+    """沪深300日收益(优先共享行情，否则读数据库)"""
+    benchmark_returns = get_benchmark(start_date, end_date, engine)['close'].pct_change()
+    benchmark_returns.name = '000300.SH'
+    return benchmark_returns
+
+
+# ================================= 主函数 =================================
+def report_check(report: pd.DataFrame) -> None:
+    """输出比对结果，有不一致时以非零状态退出"""
+    logger.info(f"面板与逐只回测比对:\n{report.to_string(index=False)}")
+    if not report['ok'].all():
+        logger.error(f"{(~report['ok']).sum()} 组评分不一致")
+        sys.exit(1)
+    logger.info(f"全部 {len(report)} 组评分一致")
+
+def main():
+    parser = argparse.ArgumentParser(description='HA SuperTrend 全市场面板回测')
+    parser.add_argument('--stock', type=str, nargs='+', default=['600000.SH', '000001.SZ'], help='股票代码')
+    parser.add_argument('--start-date', type=str, default='2000-01-01', help='开始日期')
+    parser.add_argument('--end-date', type=str, default='2024-12-31', help='结束日期')
+    parser.add_argument('--periods', type=int, nargs='+', default=[10, 50], help='SuperTrend周期')
+    parser.add_argument('--multipliers', type=float, nargs='+', default=[2, 3, 5], help='SuperTrend乘数')
+    parser.add_argument('--check', action='store_true', help='与逐只股票回测比对评分')
+    parser.add_argument('--synthetic', action='store_true', help='--check 时用合成行情离线比对，不读数据库')
+    parser.add_argument('--stocks', type=int, default=6, help='--synthetic 时的合成股票数')
+    parser.add_argument('--tol', type=float, default=1e-8, help='允许误差')
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.synthetic:
+        bars, benchmark_returns = synthetic_market(args.stocks)
+        panel = build_panel(bars)
+        frames = {code: heikin_ashi(df.drop(columns='ts_code').set_index('trade_time'))
+                  for code, df in bars.groupby('ts_code')}
+        report_check(check_panel(panel, frames, args.periods, args.multipliers, benchmark_returns, args.tol))
+        return
+
+    engine = create_engine(get_pg_connection_string(load_config()))
+    benchmark_returns = get_benchmark_returns(args.start_date, args.end_date, engine)
+    if not args.check:
+        result = optimize_panel(args.stock, args.start_date, args.end_date, args.periods, args.multipliers,
+                                benchmark_returns, engine)
+        logger.info(f"最优参数:\n{result.to_string(index=False)}")
+        return
+
+    panel = load_panel(args.stock, args.start_date, args.end_date, engine)
+    frames = {}
+    for code in args.stock:
+        df = get_30m_kline_data('wfq', code, args.start_date, args.end_date)
+        if df is None or df.empty:
+            continue
+        df['trade_time'] = pd.to_datetime(df['trade_time'])
+        frames[code] = heikin_ashi(df.set_index('trade_time'))
+    report_check(check_panel(panel, frames, args.periods, args.multipliers, benchmark_returns, args.tol))
+
+if __name__ == '__main__':
+    main()
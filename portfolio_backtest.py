@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+监控标的组合回测(共享资金账户)
+
+各bt_*脚本每只股票单独用100000资金回测，而实盘(qmt_monitor_ha_st_30m)用同一个账户交易monitor_stocks.csv的全部股票。
+本模块按实盘规则对全部监控标的在一个资金账户上回测：
+- 信号: 每只股票用自己的period/multiplier计算ha_st_pine的direction，上一根为-1、本根为1时买入，1变-1时卖出
+- 买入: 与QMTTrader.process_signal相同，数量 max(100, int(buy_threshold / 价格) // 100 * 100)，不检查已有持仓；
+        可用资金(含佣金)不足时委托失败
+- 卖出: 全部持仓卖出，当日买入的股票不可卖出(T+1)，卖出失败后持仓保留到下一个卖出信号
+- 成交价为信号K线的收盘价(实盘在K线结束后按最新价委托)，同一根K线的多个信号按股票代码降序依次处理(与监控列表顺序一致)
+
+HA、ATR(RMA)、SuperTrend递推对 (K线数 T × 股票数 N) 的面板同时计算，每只股票可以有不同参数；
+资金撮合只遍历有信号的K线，持仓和资产由信号处的持仓快照展开得到
+
+用法:
+    python portfolio_backtest.py --cash 1000000 --buy-threshold 10000
+    python portfolio_backtest.py --stock 600000.SH 000001.SZ --check   # 与common.ha_st_pine逐只比对direction
+"""
+from common import *
+from vector_backtest import COMMISSION
+from panel_backtest import PanelData, load_panel, get_benchmark_returns
+from perf_metrics import metrics_report
+import argparse
+import scipy.signal
+
+
+# ================================= 定义初始变量 =================================
+START_DATE = '2000-01-01'
+END_DATE = '2024-12-31'
+PORTFOLIO_CASH = 1000000   # 账户初始资金
+BUY_THRESHOLD = 10000      # 与实盘trading_config的buy_threshold一致
+MIN_VOLUME = 100           # 最小交易数量(1手)
+LOT_SIZE = 100
+OUTPUT_DIR = os.path.join('reports', 'portfolio')
+
+
+# ================================= 信号(与ha_st_pine一致) =================================
+def rma_panel(panel: PanelData, lengths: np.ndarray) -> np.ndarray:
+    """
+    ha_st_pine中的ATR：HA价格的TR，第length根K线取前length个TR的均值，之后按alpha=1/length递推
+    每只股票只对有K线的行计算，可以有不同的length
+    """
+    rma = np.full(panel.shape, np.nan)
+    for j, length in enumerate(lengths):
+        rows = np.flatnonzero(panel.valid[:, j])
+        length = int(length)
+        if len(rows) < length:
+            continue
+        high, low, close = panel.ha_high[rows, j], panel.ha_low[rows, j], panel.ha_close[rows, j]
+        prev_close = np.r_[np.nan, close[:-1]]
+        tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        alpha = 1.0 / length
+        seed = tr[:length].mean()
+        values = np.full(len(rows), np.nan)
+        values[length - 1] = seed
+        if len(rows) > length:
+            values[length:], _ = scipy.signal.lfilter([alpha], [1, -(1.0 - alpha)], tr[length:], zi=[(1.0 - alpha) * seed])
+        rma[rows, j] = values
+    return rma
+
+def pine_direction_panel(panel: PanelData, lengths, multipliers) -> np.ndarray:
+    """
+    与ha_st_pine逐根一致的direction，形状(T, N)：每只股票前length-1根为0，第length根为1，之后为1/-1；
+    无K线处为NaN，股票状态在无K线时保持
+    """
+    lengths = np.asarray(lengths, dtype=int)
+    multipliers = np.asarray(multipliers, dtype=float)
+    rma = rma_panel(panel, lengths)
+    src = (panel.ha_high + panel.ha_low) / 2
+    n_bars, n_stocks = panel.shape
+
+    seen = np.zeros(n_stocks, dtype=int)
+    upper = np.full(n_stocks, np.nan)
+    lower = np.full(n_stocks, np.nan)
+    st_is_upper = np.zeros(n_stocks, dtype=bool)
+    direction = np.zeros(n_stocks)
+    prev_close = np.full(n_stocks, np.nan)
+    result = np.full(panel.shape, np.nan)
+
+    with np.errstate(invalid='ignore'):
+        for i in range(n_bars):
+            valid = panel.valid[i]
+            ha_close = panel.ha_close[i]
+            current_upper = src[i] + multipliers * rma[i]
+            current_lower = src[i] - multipliers * rma[i]
+
+            start = valid & (seen == lengths - 1)
+            step = valid & (seen > lengths - 1)
+            new_lower = np.where((current_lower > lower) | (prev_close < lower), current_lower, lower)
+            new_upper = np.where((current_upper < upper) | (prev_close > upper), current_upper, upper)
+            step_direction = np.where(st_is_upper, np.where(ha_close > new_upper, 1.0, -1.0),
+                                      np.where(ha_close < new_lower, -1.0, 1.0))
+
+            lower = np.where(start, current_lower, np.where(step, new_lower, lower))
+            upper = np.where(start, current_upper, np.where(step, new_upper, upper))
+            direction = np.where(start, 1.0, np.where(step, step_direction, direction))
+            # supertrend在direction为1时取下轨，否则取上轨；下一根按“上一根supertrend是否等于上轨”判断
+            supertrend = np.where(start, current_upper, np.where(direction == 1, lower, upper))
+            st_is_upper = np.where(start | step, supertrend == upper, st_is_upper)
+
+            prev_close = np.where(valid, ha_close, prev_close)
+            seen += valid
+            result[i] = np.where(valid, direction, np.nan)
+    return result
+
+def signal_changes(panel: PanelData, direction: np.ndarray) -> tuple:
+    """与check_signal_change一致：同一股票上一根有K线的direction为-1、本根为1买入，1变-1卖出"""
+    prev = pd.DataFrame(direction).ffill().shift(1).to_numpy()
+    buy = panel.valid & (prev == -1) & (direction == 1)
+    sell = panel.valid & (prev == 1) & (direction == -1)
+    return buy, sell
+
+
+# ================================= 共享资金撮合 =================================
+def order_volume(price, buy_threshold: float = BUY_THRESHOLD, min_volume: int = MIN_VOLUME):
+    """与QMTTrader.process_signal相同的买入数量"""
+    return np.maximum(min_volume, (buy_threshold / np.asarray(price, dtype=float)).astype(int) // LOT_SIZE * LOT_SIZE)
+
+def simulate_portfolio(panel: PanelData, buy: np.ndarray, sell: np.ndarray, initial_cash: float = PORTFOLIO_CASH,
+                       buy_threshold: float = BUY_THRESHOLD, commission: float = COMMISSION) -> dict:
+    """
+    按信号在一个资金账户上撮合
+    Returns:
+        dict: equity/cash/invested(每根K线)、positions(每根K线持仓股数, T × N)、trades(成交与失败委托记录)
+    """
+    n_bars, n_stocks = panel.shape
+    close = panel.close
+    volume = order_volume(np.where(buy, close, 1.0), buy_threshold)
+    events = np.flatnonzero((buy | sell).any(axis=1))
+
+    cash = float(initial_cash)
+    position = np.zeros(n_stocks)
+    cost = np.zeros(n_stocks)
+    last_buy_day = np.full(n_stocks, -1)
+    change_bars, cash_levels, position_levels = [0], [cash], [position.copy()]
+    trades = []
+    for i in events:
+        day = panel.day_index[i]
+        for j in np.flatnonzero(buy[i] | sell[i]):
+            price = close[i, j]
+            if buy[i, j]:
+                amount = volume[i, j] * price
+                fee = amount * commission
+                if cash < amount + fee:
+                    trades.append((i, j, 'BUY', price, volume[i, j], 0.0, np.nan, 'cash'))
+                    continue
+                cash -= amount + fee
+                position[j] += volume[i, j]
+                cost[j] += amount + fee
+                last_buy_day[j] = day
+                trades.append((i, j, 'BUY', price, volume[i, j], fee, np.nan, ''))
+            elif position[j] > 0:
+                if last_buy_day[j] == day:
+                    trades.append((i, j, 'SELL', price, position[j], 0.0, np.nan, 't+1'))
+                    continue
+                amount = position[j] * price
+                fee = amount * commission
+                cash += amount - fee
+                trades.append((i, j, 'SELL', price, position[j], fee, amount - fee - cost[j], ''))
+                position[j] = 0.0
+                cost[j] = 0.0
+        change_bars.append(i)
+        cash_levels.append(cash)
+        position_levels.append(position.copy())
+
+    slot = np.searchsorted(np.asarray(change_bars), np.arange(n_bars), side='right') - 1
+    positions = np.asarray(position_levels)[slot]
+    mark = np.nan_to_num(pd.DataFrame(close).ffill().to_numpy())
+    invested = (positions * mark).sum(axis=1)
+    cash_path = np.asarray(cash_levels)[slot]
+    trades_df = pd.DataFrame(
+        [(panel.index[i], panel.codes[j], side, price, vol, fee, pnl, reject)
+         for i, j, side, price, vol, fee, pnl, reject in trades],
+        columns=['trade_time', 'ts_code', 'side', 'price', 'volume', 'commission', 'pnl', 'rejected'])
+    return {'equity': cash_path + invested, 'cash': cash_path, 'invested': invested, 'positions': positions,
+            'trades': trades_df}
+
+
+# ================================= 组合统计 =================================
+def portfolio_report(panel: PanelData, result: dict, initial_cash: float,
+                     benchmark_returns: pd.Series = None) -> tuple:
+    """
+    Returns:
+        (summary, daily, per_stock): 组合指标(含资金利用率)；每日资产/现金/持仓数；各股票成交统计
+    """
+    day_end = panel.day_end
+    held = (result['positions'] > 0).sum(axis=1)
+    daily = pd.DataFrame({
+        'equity': result['equity'][day_end],
+        'cash': result['cash'][day_end],
+        'invested': result['invested'][day_end],
+        'holdings': held[day_end],
+    }, index=panel.days)
+    daily['utilization'] = daily['invested'] / daily['equity']
+    daily['return'] = daily['equity'] / np.r_[initial_cash, daily['equity'].to_numpy()[:-1]] - 1.0
+
+    benchmark = benchmark_returns.reindex(daily.index) if benchmark_returns is not None else None
+    summary = metrics_report(daily['return'], benchmark)
+    trades = result['trades']
+    done = trades[trades['rejected'] == '']
+    summary.update({
+        'final_equity': daily['equity'].iloc[-1],
+        'avg_utilization': daily['utilization'].mean() * 100,
+        'max_utilization': daily['utilization'].max() * 100,
+        # 有持仓的交易日中的平均利用率，区分“空仓等待”和“资金不足”
+        'avg_utilization_when_holding': daily.loc[daily['holdings'] > 0, 'utilization'].mean() * 100,
+        'avg_holdings': daily['holdings'].mean(),
+        'max_holdings': daily['holdings'].max(),
+        'buy_orders': int((done['side'] == 'BUY').sum()),
+        'sell_orders': int((done['side'] == 'SELL').sum()),
+        'rejected_buys_cash': int((trades['rejected'] == 'cash').sum()),
+        'rejected_sells_t1': int((trades['rejected'] == 't+1').sum()),
+        'total_commission': done['commission'].sum(),
+    })
+
+    sells = done[done['side'] == 'SELL']
+    per_stock = pd.DataFrame({
+        'buys': done[done['side'] == 'BUY'].groupby('ts_code').size(),
+        'sells': sells.groupby('ts_code').size(),
+        'realized_pnl': sells.groupby('ts_code')['pnl'].sum(),
+        'win_rate': sells.groupby('ts_code')['pnl'].apply(lambda p: (p > 0).mean() * 100),
+        'rejected_buys_cash': trades[trades['rejected'] == 'cash'].groupby('ts_code').size(),
+    }).reindex(panel.codes)
+    per_stock[['buys', 'sells', 'rejected_buys_cash']] = per_stock[['buys', 'sells', 'rejected_buys_cash']].fillna(0).astype(int)
+    per_stock['final_volume'] = result['positions'][-1]
+    per_stock.index.name = 'ts_code'
+    return summary, daily, per_stock.reset_index()
+
+
+# ================================= 主流程 =================================
+def load_monitor_params(path: str = 'monitor_stocks.csv', ts_codes: list = None) -> pd.DataFrame:
+    """监控标的及其period/multiplier，按股票代码降序(与实盘监控列表顺序一致)"""
+    params = pd.read_csv(path, encoding='utf-8')[['ts_code', 'period', 'multiplier']].drop_duplicates('ts_code')
+    if ts_codes:
+        params = params[params['ts_code'].isin(ts_codes)]
+    return params.sort_values('ts_code', ascending=False).reset_index(drop=True)
+
+def run_portfolio(params: pd.DataFrame, start_date: str, end_date: str, engine, initial_cash: float = PORTFOLIO_CASH,
+                  buy_threshold: float = BUY_THRESHOLD) -> tuple:
+    """载入面板、计算信号并撮合，返回(summary, daily, per_stock, trades)"""
+    t0 = time.time()
+    panel = load_panel(params['ts_code'].tolist(), start_date, end_date, engine)
+    t1 = time.time()
+    direction = pine_direction_panel(panel, params['period'].to_numpy(), params['multiplier'].to_numpy())
+    buy, sell = signal_changes(panel, direction)
+    t2 = time.time()
+    result = simulate_portfolio(panel, buy, sell, initial_cash, buy_threshold)
+    benchmark_returns = get_benchmark_returns(start_date, end_date, engine)
+    summary, daily, per_stock = portfolio_report(panel, result, initial_cash, benchmark_returns)
+    logger.info(f"组合回测 {len(panel.codes)} 只股票，K线 {panel.shape[0]} 根: 载入 {t1 - t0:.1f}秒，"
+                f"信号 {t2 - t1:.1f}秒，撮合与统计 {time.time() - t2:.1f}秒")
+    return summary, daily, per_stock, result['trades']
+
+def check_directions(panel: PanelData, params: pd.DataFrame, frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """面板direction与common.ha_st_pine逐只比对，frames为各股票以trade_time为索引的K线"""
+    direction = pine_direction_panel(panel, params['period'].to_numpy(), params['multiplier'].to_numpy())
+    rows = []
+    for j, row in params.iterrows():
+        df = frames.get(row['ts_code'])
+        if df is None:
+            continue
+        expected = ha_st_pine(df, int(row['period']), row['multiplier'])['direction']
+        actual = pd.Series(direction[:, j], index=panel.index).reindex(expected.index)
+        mismatches = int((actual.to_numpy() != expected.to_numpy()).sum())
+        rows.append({'ts_code': row['ts_code'], 'period': row['period'], 'multiplier': row['multiplier'],
+                     'bars': len(expected), 'mismatches': mismatches, 'ok': mismatches == 0})
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='监控标的组合回测(共享资金账户)')
+    parser.add_argument('--params', type=str, default='monitor_stocks.csv', help='参数文件(含ts_code, period, multiplier)')
+    parser.add_argument('--stock', type=str, nargs='+', help='只回测指定股票')
+    parser.add_argument('--start-date', type=str, default=START_DATE, help='开始日期')
+    parser.add_argument('--end-date', type=str, default=END_DATE, help='结束日期')
+    parser.add_argument('--cash', type=float, default=PORTFOLIO_CASH, help=f'初始资金 (默认: {PORTFOLIO_CASH})')
+    parser.add_argument('--buy-threshold', type=float, default=BUY_THRESHOLD, help=f'每次买入金额 (默认: {BUY_THRESHOLD})')
+    parser.add_argument('--output-dir', type=str, default=OUTPUT_DIR, help=f'结果目录 (默认: {OUTPUT_DIR})')
+    parser.add_argument('--check', action='store_true', help='与common.ha_st_pine逐只比对direction')
+    args = parser.parse_args()
+
+    setup_logger()
+    params = load_monitor_params(args.params, args.stock)
+    if params.empty:
+        logger.error("没有可回测的股票")
+        return
+    engine = create_engine(get_pg_connection_string(load_config()))
+
+    if args.check:
+        panel = load_panel(params['ts_code'].tolist(), args.start_date, args.end_date, engine)
+        frames = {}
+        for code in params['ts_code']:
+            df = get_30m_kline_data('wfq', code, args.start_date, args.end_date)
+            if df is not None and not df.empty:
+                df['trade_time'] = pd.to_datetime(df['trade_time'])
+                frames[code] = df.set_index('trade_time')
+        report = check_directions(panel, params, frames)
+        logger.info(f"direction比对:\n{report.to_string(index=False)}")
+        if not report['ok'].all():
+            logger.error(f"{(~report['ok']).sum()} 只股票不一致")
+            sys.exit(1)
+        logger.info(f"全部 {len(report)} 只股票一致")
+        return
+
+    summary, daily, per_stock, trades = run_portfolio(params, args.start_date, args.end_date, engine,
+                                                      args.cash, args.buy_threshold)
+    os.makedirs(args.output_dir, exist_ok=True)
+    pd.DataFrame([summary]).to_csv(os.path.join(args.output_dir, 'portfolio_summary.csv'), index=False, encoding='utf-8-sig')
+    daily.to_csv(os.path.join(args.output_dir, 'portfolio_daily.csv'), index_label='trade_date', encoding='utf-8-sig')
+    per_stock.to_csv(os.path.join(args.output_dir, 'portfolio_stocks.csv'), index=False, encoding='utf-8-sig')
+    trades.to_csv(os.path.join(args.output_dir, 'portfolio_trades.csv'), index=False, encoding='utf-8-sig')
+    logger.info("组合指标:\n" + "\n".join(f"  {name}: {value}" for name, value in summary.items()))
+    logger.info(f"结果已保存到 {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+QuantStats报告的延后生成
+
+多股票优化脚本原先在每只股票的优化进程中调用 qs.reports.html，绘图和HTML渲染比优化本身更耗时，且阻塞工作进程。
+现在分为两个阶段：
+- 优化进程只把最优参数的日收益和对齐后的基准日收益压缩保存为 reports/returns/{run}/{stock_code}.npz (约几十KB)
+- 全部股票完成并排序后，只对前N名(或指定股票)在单独的进程池中渲染HTML，输出仍为 reports/{stock_code}_report.html
+
+各脚本结束时自动渲染前 --report-top 名；也可以事后对任意股票补生成:
+    python report_store.py --run ha_st_mult_tscode --results Heikin_Ashi_SuperTrend_Metrics.csv --top 50 --sort-by sharpe
+    python report_store.py --run ha_st_calmar --stock 600000.SH 000001.SZ
+    python report_store.py --run ha_st_mult_tscode --list
+"""
+from common import *
+import argparse
+import multiprocessing as mp
+
+
+# ================================= 定义初始变量 =================================
+RETURNS_DIR = os.path.join('reports', 'returns')
+REPORT_DIR = 'reports'
+REPORT_TOP_N = 20                                   # 默认渲染报告的股票数
+REPORT_PROCESSES = max(1, mp.cpu_count() // 2)      # 渲染进程数
+CODE_COLUMNS = ['stock_code', 'ts_code']            # 各脚本结果表中的股票代码列
+
+
+# ================================= 收益序列存取 =================================
+def returns_path(run: str, stock_code: str, directory: str = RETURNS_DIR) -> str:
+    return os.path.join(directory, run, f'{stock_code}.npz')
+
+def save_returns(run: str, stock_code: str, daily_returns: pd.Series, benchmark_returns: pd.Series = None,
+                 title: str = None, directory: str = RETURNS_DIR) -> str:
+    """
+    保存一只股票的日收益与基准日收益(与日收益按日期对齐)，先写临时文件再替换，多进程同时写入不会产生残缺文件
+    Returns:
+        str: 文件路径
+    """
+    path = returns_path(run, stock_code, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dates = pd.DatetimeIndex(daily_returns.index).values.astype('datetime64[D]').astype(np.int32)
+    benchmark = (benchmark_returns.reindex(daily_returns.index).to_numpy(dtype=float)
+                 if benchmark_returns is not None else np.empty(0))
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(
+        tmp_path,
+        dates=dates,
+        returns=daily_returns.to_numpy(dtype=float),
+        benchmark=benchmark,
+        names=np.array([str(daily_returns.name or stock_code),
+                        str(benchmark_returns.name or 'benchmark') if benchmark_returns is not None else '']),
+        title=np.array(title or stock_code),
+    )
+    os.replace(tmp_path, path)
+    return path
+
+def load_returns(path: str) -> tuple:
+    """
+    Returns:
+        (daily_returns, benchmark_returns, title)，未保存基准时benchmark_returns为None
+    """
+    with np.load(path) as data:
+        index = pd.DatetimeIndex(data['dates'].astype('datetime64[D]').astype('datetime64[ns]'))
+        name, benchmark_name = data['names'].tolist()
+        daily_returns = pd.Series(data['returns'], index=index, name=name)
+        benchmark_returns = (pd.Series(data['benchmark'], index=index, name=benchmark_name)
+                             if len(data['benchmark']) else None)
+        title = str(data['title'])
+    return daily_returns, benchmark_returns, title
+
+def saved_stocks(run: str, directory: str = RETURNS_DIR) -> List[str]:
+    """已保存收益序列的股票"""
+    run_dir = os.path.join(directory, run)
+    if not os.path.isdir(run_dir):
+        return []
+    return sorted(name[:-len('.npz')] for name in os.listdir(run_dir) if name.endswith('.npz') and '.tmp' not in name)
+
+
+# ================================= 报告渲染 =================================
+@profile_stage('render_report')
+def render_report(task: tuple) -> tuple:
+    """进程池任务：读取收益序列并渲染HTML报告，返回(stock_code, 报告文件或None, 错误信息)"""
+    run, stock_code, output_dir, directory = task
+    import quantstats_lumi as qs
+    try:
+        daily_returns, benchmark_returns, title = load_returns(returns_path(run, stock_code, directory))
+        report_file = os.path.join(output_dir, f'{stock_code}_report.html')
+        qs.reports.html(
+            daily_returns,
+            benchmark=benchmark_returns,
+            output=report_file,
+            title=title,
+            download_filename=f'{stock_code}_report.html'
+        )
+        return stock_code, report_file, None
+    except Exception as e:
+        return stock_code, None, str(e)
+
+@profile_stage('render_reports')
+def render_reports(run: str, stock_codes: List[str], processes: int = REPORT_PROCESSES,
+                   output_dir: str = REPORT_DIR, directory: str = RETURNS_DIR) -> pd.DataFrame:
+    """在单独的进程池中渲染指定股票的报告，返回每只股票的报告文件和错误信息"""
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(run, code, output_dir, directory) for code in stock_codes]
+    if not tasks:
+        return pd.DataFrame(columns=['stock_code', 'report_file', 'error'])
+    t0 = time.time()
+    with mp.Pool(processes=max(1, min(processes, len(tasks)))) as pool:
+        rows = list(tqdm(pool.imap_unordered(render_report, tasks), total=len(tasks), desc='生成报告'))
+    status = pd.DataFrame(rows, columns=['stock_code', 'report_file', 'error'])
+    for row in status[status['error'].notna()].itertuples():
+        logger.error(f'生成 {row.stock_code} 的策略报告时发生错误: {row.error}')
+    logger.info(f'{run} 生成 {status["report_file"].notna().sum()}/{len(status)} 份报告，耗时 {time.time() - t0:.1f}秒')
+    return status
+
+def select_top(results_df: pd.DataFrame, sort_by: str, top_n: int) -> List[str]:
+    """按sort_by降序取前top_n只股票，sort_by不存在时保持结果表原顺序"""
+    code_column = next(col for col in CODE_COLUMNS if col in results_df.columns)
+    if sort_by in results_df.columns:
+        results_df = results_df.sort_values(by=sort_by, ascending=False)
+    return results_df[code_column].head(top_n).tolist()
+
+def render_top_reports(run: str, results_df: pd.DataFrame, sort_by: str, top_n: int = REPORT_TOP_N,
+                       processes: int = REPORT_PROCESSES) -> pd.DataFrame:
+    """优化脚本结束时调用：结果排序后只渲染前top_n名的报告，top_n为0时不渲染"""
+    if top_n <= 0 or results_df.empty:
+        return pd.DataFrame(columns=['stock_code', 'report_file', 'error'])
+    return render_reports(run, select_top(results_df, sort_by, top_n), processes)
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='QuantStats报告延后生成')
+    parser.add_argument('--run', type=str, required=True, help='优化脚本名(收益序列子目录)，如 ha_st_mult_tscode')
+    parser.add_argument('--stock', type=str, nargs='+', help='指定股票代码')
+    parser.add_argument('--results', type=str, help='优化结果CSV，按 --sort-by 取前 --top 名')
+    parser.add_argument('--sort-by', type=str, default='sharpe', help='排序依据 (默认: sharpe)')
+    parser.add_argument('--top', type=int, default=REPORT_TOP_N, help=f'渲染前N名 (默认: {REPORT_TOP_N})')
+    parser.add_argument('--processes', type=int, default=REPORT_PROCESSES, help=f'渲染进程数 (默认: {REPORT_PROCESSES})')
+    parser.add_argument('--output-dir', type=str, default=REPORT_DIR, help=f'报告目录 (默认: {REPORT_DIR})')
+    parser.add_argument('--list', action='store_true', help='列出已保存收益序列的股票')
+    args = parser.parse_args()
+
+    setup_logger()
+    available = saved_stocks(args.run)
+    if args.list:
+        print(f'{args.run} 已保存 {len(available)} 只股票的收益序列')
+        print(' '.join(available))
+        return
+    if args.stock:
+        stock_codes = args.stock
+    elif args.results:
+        stock_codes = select_top(pd.read_csv(args.results), args.sort_by, args.top)
+    else:
+        parser.error('需要指定 --stock 或 --results')
+
+    missing = [code for code in stock_codes if code not in available]
+    if missing:
+        logger.warning(f'{len(missing)} 只股票没有保存收益序列，跳过: {missing}')
+    render_reports(args.run, [code for code in stock_codes if code in available], args.processes, args.output_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+多股票优化的增量结果记录与断点续跑
+
+多股票优化脚本原先把结果累积在内存中，全部股票完成后才写CSV，中途崩溃会丢失已完成的全部结果。
+现在每只股票的结果一返回就追加写入 reports/results/{run}_{配置哈希}.jsonl：
+- 每行一条JSON记录，以O_APPEND单次写入并fsync，崩溃最多留下一行残缺记录，读取时跳过
+- 首行记录运行配置(回测区间、参数范围、优化算法参数等)，配置哈希不同的运行写入不同文件，互不混用
+- --resume 时跳过文件中已有结果的股票，否则清空该配置的记录重新开始
+- 最终排序后的CSV由记录文件生成，同一股票有多条记录时以最后一条为准
+
+用法:
+    sink = ResultSink('ha_st_mult_tscode', {'start_date': START_DATE, ...})
+    pending = [code for code in stock_codes if code not in sink.completed()]
+    for result in pool.imap_unordered(optimize_stock, pending):
+        sink.append(result['stock_code'], result)
+    results_df = sink.to_frame(stock_codes)
+
+    python result_sink.py --run ha_st_mult_tscode --list
+    python result_sink.py --run ha_st_mult_tscode --config 1a2b3c4d5e6f7a8b --sort-by sharpe --output metrics.csv
+"""
+from common import *
+import argparse
+import hashlib
+import json
+from eval_cache import _to_builtin, params_key
+
+
+# ================================= 定义初始变量 =================================
+RESULTS_DIR = os.path.join('reports', 'results')
+
+
+# ================================= 配置哈希 =================================
+def config_hash(run_config: dict) -> str:
+    """运行配置的哈希，参数范围等numpy数组按列表参与计算"""
+    return hashlib.sha1(params_key(run_config).encode('utf-8')).hexdigest()[:16]
+
+
+# ================================= 结果记录 =================================
+class ResultSink:
+    """
+    绑定到(优化脚本, 运行配置)的只追加结果文件，仅由父进程写入
+    """
+
+    def __init__(self, run: str, run_config: dict, resume: bool = True, directory: str = RESULTS_DIR):
+        self.run = run
+        self.config = run_config
+        self.config_hash = config_hash(run_config)
+        self.path = os.path.join(directory, f'{run}_{self.config_hash}.jsonl')
+        os.makedirs(directory, exist_ok=True)
+        if not resume and os.path.exists(self.path):
+            logger.info(f'未指定续跑，清空已有结果记录 {self.path}')
+            os.remove(self.path)
+        if os.path.exists(self.path):
+            self._terminate_partial_line()
+        else:
+            self._write({'type': 'config', 'run': run, 'config_hash': self.config_hash, 'config': run_config,
+                         'created_at': datetime.now().isoformat(timespec='seconds')})
+
+    def _write(self, record: dict) -> None:
+        """整行一次写入，O_APPEND保证多次写入不会交错，fsync保证崩溃前已写入的记录落盘"""
+        line = (json.dumps(record, ensure_ascii=False, default=_to_builtin) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _terminate_partial_line(self) -> None:
+        """上次崩溃留下的残缺行没有换行符，先补上，避免续写的记录接在残缺行后面"""
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, b'\n')
+        finally:
+            os.close(fd)
+
+    def append(self, stock_code: str, result: dict) -> None:
+        """追加一只股票的结果"""
+        self._write({'type': 'result', 'stock_code': stock_code, 'result': result,
+                     'created_at': datetime.now().isoformat(timespec='seconds')})
+
+    def records(self) -> Dict[str, dict]:
+        """已记录的结果 {股票代码: 结果}，同一股票以最后一条为准"""
+        return read_records(self.path)
+
+    def completed(self) -> set:
+        """已有结果的股票"""
+        return set(self.records())
+
+    def to_frame(self, stock_codes: List[str] = None, sort_by: str = None) -> pd.DataFrame:
+        """由记录生成结果表，stock_codes指定时只保留其中的股票，sort_by存在时降序排列"""
+        return records_frame(self.records(), stock_codes, sort_by)
+
+
+def read_records(path: str) -> Dict[str, dict]:
+    """读取结果文件，跳过配置行和崩溃时写了一半的残缺行"""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('type') == 'result':
+                records[record['stock_code']] = record['result']
+    return records
+
+def records_frame(records: Dict[str, dict], stock_codes: List[str] = None, sort_by: str = None) -> pd.DataFrame:
+    if stock_codes is not None:
+        records = {code: records[code] for code in stock_codes if code in records}
+    results_df = pd.DataFrame(list(records.values()))
+    if sort_by and sort_by in results_df.columns:
+        results_df = results_df.sort_values(by=sort_by, ascending=False)
+    return results_df
+
+def list_sinks(run: str, directory: str = RESULTS_DIR) -> pd.DataFrame:
+    """某优化脚本的全部结果文件：配置哈希、创建时间、结果数"""
+    rows = []
+    prefix = f'{run}_'
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith(prefix) and name.endswith('.jsonl')):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, encoding='utf-8') as f:
+                header = json.loads(f.readline() or '{}')
+            rows.append({'config_hash': name[len(prefix):-len('.jsonl')], 'created_at': header.get('created_at'),
+                         'results': len(read_records(path)), 'config': json.dumps(header.get('config'), ensure_ascii=False)})
+    return pd.DataFrame(rows, columns=['config_hash', 'created_at', 'results', 'config'])
+
+
+# ================================= 主函数 =================================
+def main():
+    parser = argparse.ArgumentParser(description='多股票优化结果记录的查看与导出')
+    parser.add_argument('--run', type=str, required=True, help='优化脚本名，如 ha_st_mult_tscode / ha_st_calmar')
+    parser.add_argument('--list', action='store_true', help='列出该脚本的全部结果文件')
+    parser.add_argument('--config', type=str, help='配置哈希，导出该配置的结果')
+    parser.add_argument('--sort-by', type=str, help='排序依据')
+    parser.add_argument('--output', type=str, help='导出CSV路径 (默认: 打印前20行)')
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.list or not args.config:
+        sinks = list_sinks(args.run)
+        if sinks.empty:
+            print(f'{args.run} 没有结果记录')
+        else:
+            print(sinks.to_string(index=False))
+        return
+
+    results_df = records_frame(read_records(os.path.join(RESULTS_DIR, f'{args.run}_{args.config}.jsonl')),
+                               sort_by=args.sort_by)
+    if args.output:
+        results_df.to_csv(args.output, index=False)
+        print(f'已导出 {len(results_df)} 条结果到 {args.output}')
+    else:
+        print(results_df.head(20).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
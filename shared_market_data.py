@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+多进程优化脚本的共享内存行情
+
+父进程一次性把全部股票的30分钟K线和沪深300日线载入 multiprocessing.shared_memory：
+- 时间(int64纳秒)和 open/high/low/close/volume/amount(float64) 按 (股票, 时间) 排序存放在两个共享块中
+- 基准收盘价单独一个共享块
+- 进程池通过initializer把共享块名称和每只股票的(起始行, 行数)索引传给工作进程，
+  工作进程挂载只读视图，按股票切片得到与 get_30m_kline_data 相同的DataFrame
+
+数据库只查询一次(行数统计 + 一次流式查询)，内存占用与工作进程数无关
+
+用法:
+    with SharedMarketData.load(stock_codes, START_DATE, END_DATE, engine) as shared:
+        with mp.Pool(processes=n, initializer=attach_shared_data, initargs=(shared.spec,)) as pool:
+            ...
+    # 工作进程中
+    df = get_kline('wfq', stock_code, START_DATE, END_DATE)
+"""
+from common import *
+from multiprocessing import shared_memory
+
+
+# ================================= 定义初始变量 =================================
+KLINE_TABLE = 'a_stock_30m_kline_wfq_baostock'
+BENCHMARK_CODE = '000300.SH'
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount']
+STREAM_ROWS = 1000000  # 流式读取每批行数
+
+# 工作进程挂载的共享行情，由attach_shared_data设置
+_SHARED = None
+
+
+# ================================= 共享块 =================================
+def _create_block(array: np.ndarray) -> tuple:
+    """创建共享块并拷入数据，返回(共享块, 描述)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def _attach_block(desc: tuple) -> tuple:
+    """
+    挂载共享块，返回(共享块, 只读视图)
+    进程池的工作进程与父进程共用同一个resource_tracker，不能在此unregister，
+    否则父进程unlink时tracker会因重复注销报错；Python 3.13起直接不跟踪
+    """
+    name, shape, dtype = desc
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    view.flags.writeable = False
+    return shm, view
+
+
+# ================================= 基准日线 =================================
+def load_benchmark(start_date: str, end_date: str, engine, benchmark_code: str = BENCHMARK_CODE) -> pd.DataFrame:
+    """
+    从数据库读取基准日线(以trade_time为索引，含close列)，共享行情与各脚本的数据库回退共用此查询
+    a_index_1day_kline_baostock 的 trade_date 为 'YYYYMMDD' 字符串，日期参数可带或不带'-'
+    """
+    benchmark = pd.read_sql(text("""
+        SELECT trade_date, close
+        FROM a_index_1day_kline_baostock
+        WHERE ts_code = :code AND trade_date >= :start_date AND trade_date <= :end_date
+        ORDER BY trade_date
+    """), engine, params={'code': benchmark_code, 'start_date': str(start_date).replace('-', ''),
+                          'end_date': str(end_date).replace('-', '')})
+    index = pd.DatetimeIndex(pd.to_datetime(benchmark['trade_date']).to_numpy(dtype='datetime64[ns]'), name='trade_time')
+    return pd.DataFrame({'close': pd.to_numeric(benchmark['close'], errors='coerce').to_numpy(dtype=np.float64)}, index=index)
+
+
+# ================================= 父进程：载入并发布 =================================
+class SharedMarketData:
+    """
+    父进程持有的共享内存行情，spec为传给工作进程的可序列化描述
+    使用完毕调用close()(或with语句)释放共享块
+    """
+
+    def __init__(self, spec: dict, blocks: list):
+        self.spec = spec
+        self.blocks = blocks
+
+    @classmethod
+    def load(cls, ts_codes: list, start_date: str, end_date: str, engine,
+             benchmark_code: str = BENCHMARK_CODE) -> 'SharedMarketData':
+        """查询全部股票的K线与基准收盘价并写入共享内存"""
+        t0 = time.time()
+        params = {'codes': list(ts_codes), 'start_date': start_date, 'end_date': end_date}
+        where = "ts_code = ANY(:codes) AND trade_time >= :start_date AND trade_time <= :end_date"
+        with engine.connect() as conn:
+            total = conn.execute(text(f"SELECT COUNT(*) FROM {KLINE_TABLE} WHERE {where}"), params).scalar() or 0
+            times = np.empty(total, dtype=np.int64)
+            values = np.empty((total, len(BAR_COLUMNS)), dtype=np.float64)
+            index = {}
+            cursor = 0
+            query = text(f"""
+                SELECT trade_time, ts_code, {', '.join(BAR_COLUMNS)}
+                FROM {KLINE_TABLE}
+                WHERE {where}
+                ORDER BY ts_code, trade_time
+            """)
+            stream = conn.execution_options(stream_results=True)
+            for chunk in pd.read_sql(query, stream, params=params, chunksize=STREAM_ROWS):
+                for col in BAR_COLUMNS:
+                    chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+                # 与get_30m_kline_data一致：删除含NaN的行
+                chunk = chunk.dropna()
+                n = len(chunk)
+                times[cursor:cursor + n] = pd.to_datetime(chunk['trade_time']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+                values[cursor:cursor + n] = chunk[BAR_COLUMNS].to_numpy(dtype=np.float64)
+                codes, first, counts = np.unique(chunk['ts_code'].to_numpy(), return_index=True, return_counts=True)
+                for code, offset, count in zip(codes, first, counts):
+                    start, length = index.get(code, (cursor + int(offset), 0))
+                    index[code] = (start, length + int(count))
+                cursor += n
+
+            benchmark = load_benchmark(start_date, end_date, conn, benchmark_code)
+
+        blocks = []
+        spec = {'start_date': start_date, 'end_date': end_date, 'benchmark_code': benchmark_code, 'index': index}
+        for key, array in [('times', times[:cursor]), ('values', values[:cursor]),
+                           ('benchmark_times', benchmark.index.to_numpy(dtype='datetime64[ns]').astype(np.int64)),
+                           ('benchmark_close', benchmark['close'].to_numpy(dtype=np.float64))]:
+            shm, desc = _create_block(np.ascontiguousarray(array))
+            blocks.append(shm)
+            spec[key] = desc
+        size_mb = sum(shm.size for shm in blocks) / 1024 / 1024
+        logger.info(f"共享行情载入完成: {len(index)} 只股票 {cursor} 根K线，{size_mb:.0f}MB，耗时 {time.time() - t0:.1f}秒")
+        return cls(spec, blocks)
+
+    def close(self) -> None:
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ================================= 工作进程：挂载与读取 =================================
+def attach_shared_data(spec: dict) -> None:
+    """进程池initializer：挂载共享行情的只读视图"""
+    global _SHARED
+    shared = {'spec': spec, 'blocks': []}
+    for key in ['times', 'values', 'benchmark_times', 'benchmark_close']:
+        shm, view = _attach_block(spec[key])
+        shared['blocks'].append(shm)
+        shared[key] = view
+    _SHARED = shared
+
+def shared_bars(ts_code: str, start_date: str, end_date: str) -> Optional[pd.DataFrame]:
+    """从共享行情切出一只股票的K线，未挂载或日期范围与载入时不同返回None"""
+    if _SHARED is None:
+        return None
+    spec = _SHARED['spec']
+    if (start_date, end_date) != (spec['start_date'], spec['end_date']):
+        return None
+    start, length = spec['index'].get(ts_code, (0, 0))
+    rows = slice(start, start + length)
+    df = pd.DataFrame(_SHARED['values'][rows].copy(), columns=BAR_COLUMNS)
+    df.insert(0, 'ts_code', ts_code)
+    df.insert(0, 'trade_time', pd.DatetimeIndex(_SHARED['times'][rows].astype('datetime64[ns]')))
+    return df
+
+def shared_benchmark(start_date: str, end_date: str) -> Optional[pd.DataFrame]:
+    """共享的基准日线(以trade_time为索引，含close列)，未挂载或日期范围不同返回None"""
+    if _SHARED is None:
+        return None
+    spec = _SHARED['spec']
+    if (start_date, end_date) != (spec['start_date'], spec['end_date']):
+        return None
+    index = pd.DatetimeIndex(_SHARED['benchmark_times'].astype('datetime64[ns]'), name='trade_time')
+    return pd.DataFrame({'close': np.array(_SHARED['benchmark_close'])}, index=index)
+
+def get_benchmark(start_date: str, end_date: str, engine, benchmark_code: str = BENCHMARK_CODE) -> pd.DataFrame:
+    """优先读取共享的基准日线，否则用与共享行情相同的查询读取数据库"""
+    df = shared_benchmark(start_date, end_date)
+    if df is not None and _SHARED['spec']['benchmark_code'] == benchmark_code:
+        return df
+    return load_benchmark(start_date, end_date, engine, benchmark_code)
+
+def get_kline(fq_code: str, ts_code: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """优先读取共享行情(仅不复权)，否则照常查询数据库"""
+    if fq_code == 'wfq':
+        df = shared_bars(ts_code, start_date, end_date)
+        if df is not None:
+            return df
+    return get_30m_kline_data(fq_code, ts_code, start_date, end_date)
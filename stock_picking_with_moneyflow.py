@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from common import *
-import tushare as ts
+from tushare_client import get_tushare_client
+from trade_calendar import get_trade_calendar
 
 # ================================= 定义初始变量 =================================
 n_stock = 3        # 分析个股N个交易日资金流向
@@ -8,8 +9,7 @@ n_industry = 365   # 分析行业N个交易日净额分位数
 
 # ================================= 读取配置文件 =================================
 config = load_config()
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
+pro = get_tushare_client(config)
 engine = create_engine(get_pg_connection_string(config))
 
 
@@ -17,17 +17,14 @@ engine = create_engine(get_pg_connection_string(config))
 def get_recent_trade_days(days):
     """获取最近N个交易日的日期（排除非交易日）"""
     now = datetime.now()
-    start_date = (now - timedelta(days=400)).strftime('%Y%m%d')
     include_today = now.time() > datetime.strptime('16:00:00', '%H:%M:%S').time()
     end_date = now.strftime('%Y%m%d') if include_today else (now - timedelta(1)).strftime('%Y%m%d')
-    cal = pro.trade_cal(exchange='', start_date=start_date, end_date=end_date, is_open=1)
-    return cal.sort_values('cal_date', ascending=True).tail(days)['cal_date'].tolist()
+    return get_trade_calendar(engine=engine).last_n(end_date, days)
 trade_dates = get_recent_trade_days(n_stock)
 
 # ================================= 获取多日全量股票资金流向数据 =================================
 all_moneyflow = []
-for date in trade_dates:
-    df = pro.moneyflow(trade_date=date)
+for df in pro.map('moneyflow', [{'trade_date': date} for date in trade_dates]):
     # 计算各类单子的净流入
     net_flows = {
         "特大单净流入": df["buy_elg_amount"] - df["sell_elg_amount"],
@@ -40,10 +37,8 @@ for date in trade_dates:
 moneyflow_df = pd.concat(all_moneyflow)
 
 # ================================= 获取多日全量股票最新市值数据 =================================
-all_basic = []
-for date in trade_dates:
-    df = pro.daily_basic(trade_date=date, fields='ts_code,trade_date,turnover_rate,circ_mv,volume_ratio')
-    all_basic.append(df)
+all_basic = pro.map('daily_basic', [{'trade_date': date, 'fields': 'ts_code,trade_date,turnover_rate,circ_mv,volume_ratio'}
+                                    for date in trade_dates])
 basic_df = pd.concat(all_basic)
 
 # ================================= 合并资金流向和市值数据 =================================
@@ -150,12 +145,13 @@ all_ind_data = []
 max_days_per_chunk = 55  # 5000/90≈55.5，取55保守一些
 if estimated_records > 5000:
     chunks = math.ceil(total_days / max_days_per_chunk)    
+    chunk_params = []
     for i in range(chunks):
         start_idx = i * max_days_per_chunk
         end_idx = min((i + 1) * max_days_per_chunk - 1, total_days - 1)
-        chunk_start_date = long_trade_dates[start_idx]
-        chunk_end_date = long_trade_dates[end_idx]        
-        chunk_data = pro.moneyflow_ind_ths(start_date=chunk_start_date, end_date=chunk_end_date)
+        chunk_params.append({'start_date': long_trade_dates[start_idx], 'end_date': long_trade_dates[end_idx]})
+    # 各分段并发请求
+    for chunk_data in pro.map('moneyflow_ind_ths', chunk_params):
         if not chunk_data.empty:
             all_ind_data.append(chunk_data)
 else:
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+策略指标预计算缓存
+
+回测框架(bt_framework)、MA+ADX优化脚本和一致性校验共用，同一只股票的指标只计算一次，一批参数组合的信号由缓存拼出：
+- HaSupertrendIndicators: Heikin Ashi只算一次，SuperTrend方向按(周期, 乘数)缓存并批量计算
+- MaAdxIndicators:        均线按窗口、ADX(含DI+/DI-)按周期缓存，frame 给出Cerebro数据源所需的行情与指标列
+"""
+from common import *
+from scipy.signal import lfilter
+from vector_backtest import bt_supertrend_direction
+
+
+# ================================= 指标预计算 =================================
+class HaSupertrendIndicators:
+    """
+    Heikin Ashi只计算一次，SuperTrend方向按(周期, 乘数)缓存，一次请求中未缓存的组合批量计算
+    ha_seed:      pandas_ta 与df.ta.ha一致；open 以首根开盘价为HA开盘价种子(bt_ha_supertrend_single)
+    band:         pandas_ta 与ta.supertrend一致(supertrend_batch)；backtrader 为single脚本的自定义SuperTrend
+    trade_prices: raw 按原始开盘/收盘价成交；ha 按HA开盘/收盘价成交
+    """
+    params = ['supertrend_period', 'supertrend_multiplier']
+
+    def __init__(self, bars: pd.DataFrame, ha_seed: str = 'pandas_ta', band: str = 'pandas_ta', trade_prices: str = 'raw'):
+        if ha_seed == 'pandas_ta':
+            ha = heikin_ashi(bars[['open', 'high', 'low', 'close']])
+        else:
+            ha = bars[['open', 'high', 'low', 'close']].astype(float).copy()
+            ha['ha_close'] = (ha['open'] + ha['high'] + ha['low'] + ha['close']) / 4
+            # ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2，ha_open[0] = open[0]
+            ha_close = ha['ha_close'].to_numpy()
+            ha['ha_open'] = lfilter([0.5], [1, -0.5], np.r_[0.0, ha_close[:-1]],
+                                    zi=[ha['open'].iloc[0]])[0] if len(ha) else []
+            ha['ha_high'] = ha[['high', 'ha_open', 'ha_close']].max(axis=1)
+            ha['ha_low'] = ha[['low', 'ha_open', 'ha_close']].min(axis=1)
+        self.index = bars.index
+        self.ha_high = ha['ha_high'].to_numpy(dtype=float)
+        self.ha_low = ha['ha_low'].to_numpy(dtype=float)
+        self.ha_close = ha['ha_close'].to_numpy(dtype=float)
+        open_column, close_column = ('ha_open', 'ha_close') if trade_prices == 'ha' else ('open', 'close')
+        self.trade_open = ha[open_column].to_numpy(dtype=float)
+        self.trade_close = ha[close_column].to_numpy(dtype=float)
+        self.band = band
+        self.directions = {}
+
+    def signals(self, grid: pd.DataFrame) -> dict:
+        keys = list(zip(grid['supertrend_period'].astype(int), grid['supertrend_multiplier'].astype(float)))
+        missing = [key for key in dict.fromkeys(keys) if key not in self.directions]
+        if missing and self.band == 'backtrader':
+            for period, multiplier in missing:
+                self.directions[(period, multiplier)] = bt_supertrend_direction(
+                    self.ha_high, self.ha_low, self.ha_close, period, multiplier)
+        elif missing:
+            batch = supertrend_batch(self.ha_high, self.ha_low, self.ha_close,
+                                     [period for period, _ in missing], [multiplier for _, multiplier in missing])
+            for k, key in enumerate(missing):
+                self.directions[key] = batch[:, k]
+        return {'direction': np.column_stack([self.directions[key] for key in keys])}
+
+
+class MaAdxIndicators:
+    """
+    均线按窗口、ADX(含DI+/DI-)按周期缓存，与calculate_indicators相同的rolling均值和ta.adx；
+    一批参数组合的开仓/平仓条件由缓存的数组拼出，指标为NaN处条件为False；
+    valid为各组合指标均有效的K线(与frame去除的NaN行对应)，有效K线不足 2×最长窗口 的组合整列无效，与原脚本一致
+    """
+    params = ['fast_ma', 'slow_ma', 'adx_period', 'adx_threshold']
+
+    def __init__(self, bars: pd.DataFrame):
+        self.index = bars.index
+        self.high = bars['high'].astype(float)
+        self.low = bars['low'].astype(float)
+        self.close = bars['close'].astype(float)
+        self.trade_open = bars['open'].to_numpy(dtype=float)
+        self.trade_close = self.close.to_numpy()
+        self.volume = bars['volume'].to_numpy(dtype=float) if 'volume' in bars else np.zeros(len(bars))
+        self.mas = {}
+        self.adxs = {}
+
+    def ma(self, window: int) -> np.ndarray:
+        window = int(window)
+        if window not in self.mas:
+            self.mas[window] = self.close.rolling(window=window).mean().to_numpy()
+        return self.mas[window]
+
+    def adx(self, period: int) -> tuple:
+        """(ADX, DI+, DI-)"""
+        period = int(period)
+        if period not in self.adxs:
+            frame = ta.adx(self.high, self.low, self.close, length=period)
+            self.adxs[period] = tuple(frame[[col for col in frame.columns if col.upper().startswith(prefix)][0]].to_numpy()
+                                      for prefix in ('ADX', 'DMP', 'DMN'))
+        return self.adxs[period]
+
+    def frame(self, fast_ma: int, slow_ma: int, adx_period: int) -> pd.DataFrame:
+        """Cerebro数据源(MAData)所需的行情与指标列，去除指标为NaN的K线，保留时间索引"""
+        strength, di_plus, di_minus = self.adx(adx_period)
+        df = pd.DataFrame({'open': self.trade_open, 'high': self.high.to_numpy(), 'low': self.low.to_numpy(),
+                           'close': self.trade_close, 'volume': self.volume,
+                           'ma_fast': self.ma(fast_ma), 'ma_slow': self.ma(slow_ma),
+                           'ADX': strength, 'DI_plus': di_plus, 'DI_minus': di_minus}, index=self.index)
+        return df.dropna(subset=['ADX', 'DI_plus', 'DI_minus', 'ma_fast', 'ma_slow'])
+
+    def signals(self, grid: pd.DataFrame) -> dict:
+        fast = np.column_stack([self.ma(w) for w in grid['fast_ma']])
+        slow = np.column_stack([self.ma(w) for w in grid['slow_ma']])
+        strength, di_plus, di_minus = (np.column_stack([self.adx(p)[i] for p in grid['adx_period']]) for i in range(3))
+        with np.errstate(invalid='ignore'):
+            trending = strength > grid['adx_threshold'].to_numpy(dtype=float)[None, :]
+            entry = (fast > slow) & trending & (di_plus > di_minus)
+            exit_ = (fast < slow) & trending & (di_minus > di_plus)
+        valid = ~(np.isnan(fast) | np.isnan(slow) | np.isnan(strength) | np.isnan(di_plus) | np.isnan(di_minus))
+        required = 2 * grid[['fast_ma', 'slow_ma', 'adx_period']].max(axis=1).to_numpy()
+        valid &= (valid.sum(axis=0) >= required)[None, :]
+        return {'entry': entry, 'exit': exit_, 'valid': valid}
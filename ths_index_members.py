@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
 from common import *
-import tushare as ts
+from tushare_client import get_tushare_client
+from index_membership import record_snapshots
 
 # ================================= 读取配置文件 =================================
 config = load_config()
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
+pro = get_tushare_client(config)
 engine = create_engine(get_pg_connection_string(config))
 
+# ================================= 配置日志 =================================
+logger = setup_logger()
+
+# ================================= 定义初始变量 =================================
+table_name = 'ths_index_members'
+member_columns = ['index_code', 'index_name', 'index_type', 'ts_count', 'list_date', 'ts_code', 'ts_name']
+member_key = ['index_code', 'ts_code']
+
 # ================================= 概念指数,行业指数成分股 =================================
 def get_ths_index_members():
+    """
+    并发获取全部概念/行业指数成分股(经共享tushare客户端限速)
+    Returns:
+        (成分股DataFrame, 成功获取的指数代码集合)，获取失败的指数不参与后续删除比对
+    """
     df_indices = pro.ths_index(exchange='A')
     df_indices = df_indices[
         ~df_indices['name'].isin(['2024三季报预增', '2024年报预增']) &  # 剔除指定指数
@@ -25,10 +38,17 @@ def get_ths_index_members():
         'type': 'index_type'
     })
     
+    logger.info(f"开始并发获取 {len(df_indices)} 个指数的成分股...")
+    futures = [pro.ths_member.submit(ts_code=index_code) for index_code in df_indices['index_code']]
     all_members = []
-    for _, row in df_indices.iterrows():
-        print(f"正在获取指数 {row['index_name']} ({row['index_code']}) 的成分股...")
-        df_members = pro.ths_member(ts_code=row['index_code'])
+    fetched_index_codes = set()
+    for (_, row), future in zip(df_indices.iterrows(), tqdm(futures, desc='获取指数成分股')):
+        try:
+            df_members = future.result()
+        except Exception as e:
+            logger.error(f"获取指数 {row['index_name']} ({row['index_code']}) 的成分股失败: {str(e)}")
+            continue
+        fetched_index_codes.add(row['index_code'])
         if not df_members.empty:
             df_members = df_members.rename(columns={'ts_code': 'index_code', 'con_code': 'ts_code', 'con_name': 'ts_name'})
             df_members['index_code'] = row['index_code']
@@ -36,79 +56,99 @@ def get_ths_index_members():
             df_members['ts_count'] = row['ts_count']
             df_members['list_date'] = row['list_date']
             df_members['index_type'] = row['index_type']
-            df_members = df_members[['index_code', 'index_name', 'index_type', 'ts_count', 'list_date', 'ts_code', 'ts_name']]
-            all_members.append(df_members)
+            all_members.append(df_members[member_columns])
+    pro.log_stats()
     
-    # 合并所有数据并保存
-    if all_members:
-        final_df = pd.concat(all_members, ignore_index=True)
-        final_df.to_csv('同花顺概念行业指数成分.csv', encoding='utf-8-sig', index=False)
-        table_name = 'ths_index_members'
-        tmp_table = 'tmp_ths_index_members'
+    if not all_members:
+        return None, fetched_index_codes
+    final_df = pd.concat(all_members, ignore_index=True).drop_duplicates(member_key)
+    final_df.to_csv('同花顺概念行业指数成分.csv', encoding='utf-8-sig', index=False)
+    return final_df, fetched_index_codes
+
+# ================================= 成分股差异比对 =================================
+def _normalize(df):
+    """表中各列均为varchar，统一转为字符串比较，空值记为空串"""
+    return df[member_columns].astype(object).where(df[member_columns].notna(), '').astype(str)
+
+def diff_index_members(new_df, fetched_index_codes):
+    """
+    与ths_index_members表当前内容做集合差
+    Returns:
+        (upserts, removed): upserts为新增或属性变化的行，removed为本次成功获取的指数中已被剔除的(index_code, ts_code)
+    """
+    current_df = pd.read_sql(f"SELECT {', '.join(member_columns)} FROM {table_name}", engine)
+    merged = _normalize(new_df).merge(_normalize(current_df), on=member_key, how='outer',
+                                      suffixes=('', '_old'), indicator=True)
+    attr_columns = [col for col in member_columns if col not in member_key]
+    changed = (merged[attr_columns].to_numpy() != merged[[f'{col}_old' for col in attr_columns]].to_numpy()).any(axis=1)
+    upserts = merged[(merged['_merge'] == 'left_only') | ((merged['_merge'] == 'both') & changed)][member_columns]
+    removed = merged[(merged['_merge'] == 'right_only') & merged['index_code'].isin(fetched_index_codes)][member_key]
+    n_inserted = int((merged['_merge'] == 'left_only').sum())
+    logger.info(f"成分股差异: 新增 {n_inserted} 条，属性变化 {len(upserts) - n_inserted} 条，剔除 {len(removed)} 条")
+    return upserts, removed
+
+def apply_member_diff(upserts, removed):
+    """只写入差异行：新增/变化的行upsert，被剔除的行删除"""
+    if not upserts.empty:
         insert_sql = f"""
             INSERT INTO {table_name} (index_code, index_name, index_type, ts_count, list_date, ts_code, ts_name)
             SELECT index_code, index_name, index_type, ts_count, list_date, ts_code, ts_name
-            FROM {tmp_table} ON CONFLICT (index_code,ts_code) DO UPDATE 
+            FROM tmp_ths_index_members ON CONFLICT (index_code,ts_code) DO UPDATE 
             SET index_name = EXCLUDED.index_name,
                 index_type = EXCLUDED.index_type,
                 ts_count   = EXCLUDED.ts_count,
                 list_date  = EXCLUDED.list_date,
-                ts_code    = EXCLUDED.ts_code,
                 ts_name    = EXCLUDED.ts_name;
         """
-        upsert_data(final_df, table_name, tmp_table, insert_sql, engine)
-        return final_df
-    return None
+        upsert_data(upserts, table_name, 'tmp_ths_index_members', insert_sql, engine)
+    if not removed.empty:
+        delete_sql = f"""
+            DELETE FROM {table_name} t
+            USING tmp_ths_index_members_removed r
+            WHERE t.index_code = r.index_code AND t.ts_code = r.ts_code;
+        """
+        upsert_data(removed, table_name, 'tmp_ths_index_members_removed', delete_sql, engine)
 
-# ================================= 行业指数成分股聚合 =================================
-def process_industry_index_members(df):
-    industry_df = df[df['index_type'] == '行业指数'].copy()
-    def aggregate_index_names(group):
-        sorted_group = group.sort_values('list_date', ascending=False)
-        return pd.Series({
-            'ts_name': sorted_group['ts_name'].iloc[0],  # 保持一个ts_name
-            'industry_agg': ','.join(sorted_group['index_name']),
-        })
-    
-    industry_grouped = industry_df.groupby('ts_code').apply(aggregate_index_names).reset_index()
-    table_name = 'ths_ts_code_industry_agg'
-    tmp_table = 'tmp_ths_ts_code_industry_agg'
-    insert_sql = f"""
-        INSERT INTO {table_name} (ts_code, ts_name, industry_agg)
-        SELECT ts_code, ts_name, industry_agg
-        FROM {tmp_table} ON CONFLICT (ts_code) DO UPDATE 
+# ================================= 成分股聚合 =================================
+def rebuild_agg_table(index_type, agg_table, agg_column):
+    """在数据库内用string_agg重建股票所属指数聚合表，并删除已不属于任何该类指数的股票"""
+    rebuild_sql = f"""
+        INSERT INTO {agg_table} (ts_code, ts_name, {agg_column})
+        SELECT ts_code,
+               (ARRAY_AGG(ts_name ORDER BY list_date DESC))[1] AS ts_name,
+               STRING_AGG(index_name, ',' ORDER BY list_date DESC) AS {agg_column}
+        FROM {table_name}
+        WHERE index_type = :index_type
+        GROUP BY ts_code
+        ON CONFLICT (ts_code) DO UPDATE 
         SET ts_name = EXCLUDED.ts_name,
-            industry_agg = EXCLUDED.industry_agg;
+            {agg_column} = EXCLUDED.{agg_column};
+
+        DELETE FROM {agg_table} a
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table_name} m WHERE m.ts_code = a.ts_code AND m.index_type = :index_type
+        );
     """
-    upsert_data(industry_grouped, table_name, tmp_table, insert_sql, engine)
-    return industry_grouped
+    with engine.begin() as conn:
+        for statement in rebuild_sql.split(';'):
+            if statement.strip():
+                conn.execute(text(statement), {'index_type': index_type})
+    return pd.read_sql(f"SELECT ts_code, ts_name, {agg_column} FROM {agg_table}", engine)
+
+# ================================= 行业指数成分股聚合 =================================
+def process_industry_index_members():
+    return rebuild_agg_table('行业指数', 'ths_ts_code_industry_agg', 'industry_agg')
 
 # ================================= 概念指数成分股聚合 =================================
-def process_concept_index_members(df):
-    concept_df = df[df['index_type'] == '概念指数'].copy()
-    def aggregate_index_names(group):
-        sorted_group = group.sort_values('list_date', ascending=False)
-        return pd.Series({
-            'ts_name': sorted_group['ts_name'].iloc[0],  # 保持一个ts_name
-            'concept_agg': ','.join(sorted_group['index_name']),
-        })
-    
-    concept_grouped = concept_df.groupby('ts_code').apply(aggregate_index_names).reset_index()
-    table_name = 'ths_ts_code_concept_agg'
-    tmp_table = 'tmp_ths_ts_code_concept_agg'
-    insert_sql = f"""
-        INSERT INTO {table_name} (ts_code, ts_name, concept_agg)
-        SELECT ts_code, ts_name, concept_agg
-        FROM {tmp_table} ON CONFLICT (ts_code) DO UPDATE 
-        SET ts_name     = EXCLUDED.ts_name,
-            concept_agg = EXCLUDED.concept_agg;
-    """
-    upsert_data(concept_grouped, table_name, tmp_table, insert_sql, engine)
-    return concept_grouped
+def process_concept_index_members():
+    return rebuild_agg_table('概念指数', 'ths_ts_code_concept_agg', 'concept_agg')
 
 if __name__ == "__main__":
-    df = get_ths_index_members()
-    # df = pd.read_csv('同花顺概念行业指数成分.csv')
-    industry_grouped = process_industry_index_members(df)
-    concept_grouped = process_concept_index_members(df)
-
+    df, fetched_index_codes = get_ths_index_members()
+    if df is not None:
+        upserts, removed = diff_index_members(df, fetched_index_codes)
+        apply_member_diff(upserts, removed)
+        # 同步记录时点成分历史
+        record_snapshots(engine, df, 'ths', date.today(), fetched_index_codes)
+    industry_grouped = process_industry_index_members()
+    concept_grouped = process_concept_index_members()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+本地交易日历
+
+- 沪深交易所日历持久化到 a_stock_trade_cal 表，每天最多从tushare刷新一次
+- 加载为按自然日排列的布尔数组(是否开市)及其累计和，交易日推算均为O(1)数组下标运算，不再访问网络
+- 提供交易时段内的K线时间辅助函数
+
+用法:
+    cal = get_trade_calendar()
+    cal.is_open('20250102')
+    cal.prev_n('20250102', 3)          # 之前第3个交易日
+    cal.last_n('20250102', 5)          # 截至该日(含)最近5个交易日，升序
+    cal.between('20250101', '20250131')
+    cal.session_bars('20250102', '30m')
+"""
+from common import *
+import threading
+
+
+# ================================= 定义初始变量 =================================
+TABLE_NAME = 'a_stock_trade_cal'
+EXCHANGES = ['SSE', 'SZSE']
+CALENDAR_START = '19900101'
+
+
+# ================================= 日历表维护 =================================
+def create_table_if_not_exists(engine) -> None:
+    """创建交易日历表"""
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+        exchange VARCHAR(10) NOT NULL,
+        cal_date DATE NOT NULL,
+        is_open BOOLEAN NOT NULL,
+        pretrade_date DATE,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (exchange, cal_date)
+    );
+    """
+    with engine.begin() as conn:
+        conn.execute(text(create_table_sql))
+
+def refresh_trade_calendar(engine, force: bool = False) -> bool:
+    """
+    从tushare刷新交易日历(覆盖到明年年底)，当天已刷新过则跳过
+    Returns:
+        bool: 是否执行了刷新
+    """
+    create_table_if_not_exists(engine)
+    if not force:
+        with engine.connect() as conn:
+            updated_at = conn.execute(text(f"SELECT MAX(updated_at) FROM {TABLE_NAME}")).scalar()
+        if updated_at is not None and updated_at.date() >= date.today():
+            return False
+
+    from tushare_client import get_tushare_client
+    pro = get_tushare_client()
+    end_date = f"{date.today().year + 1}1231"
+    results = pro.map('trade_cal', [{'exchange': exchange, 'start_date': CALENDAR_START, 'end_date': end_date}
+                                    for exchange in EXCHANGES])
+    df = pd.concat([r for r in results if not r.empty], ignore_index=True)
+    if df.empty:
+        logger.error("tushare未返回交易日历数据")
+        return False
+
+    df = df[['exchange', 'cal_date', 'is_open', 'pretrade_date']].copy()
+    df['cal_date'] = pd.to_datetime(df['cal_date']).dt.date
+    df['pretrade_date'] = pd.to_datetime(df['pretrade_date'], errors='coerce').dt.date
+    df['is_open'] = df['is_open'].astype(int) == 1
+    df['updated_at'] = datetime.now()
+    return save_to_database(df=df, table_name=TABLE_NAME, conflict_columns=['exchange', 'cal_date'],
+                            data_type='交易日历', engine=engine,
+                            update_columns=['is_open', 'pretrade_date', 'updated_at'])
+
+
+# ================================= 内存交易日历 =================================
+def _to_day(value) -> np.datetime64:
+    """将YYYYMMDD/YYYY-MM-DD字符串、date、datetime、Timestamp转换为datetime64[D]"""
+    if isinstance(value, str) and len(value) == 8 and value.isdigit():
+        return np.datetime64(f"{value[:4]}-{value[4:6]}-{value[6:]}", 'D')
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[D]')
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+
+class TradeCalendar:
+    """
+    内存交易日历
+    open_flags[i]表示第i个自然日是否开市，open_rank[i]为截至第i天(含)的交易日数量，
+    open_days为升序排列的交易日，任意交易日推算都只需一次下标计算
+    """
+
+    def __init__(self, cal_dates, is_open, exchange: str = 'SSE'):
+        cal_dates = np.asarray(cal_dates, dtype='datetime64[D]')
+        order = np.argsort(cal_dates)
+        cal_dates = cal_dates[order]
+        is_open = np.asarray(is_open, dtype=bool)[order]
+
+        self.exchange = exchange
+        self.start = cal_dates[0]
+        self.end = cal_dates[-1]
+        n_days = int((self.end - self.start).astype(int)) + 1
+        self.open_flags = np.zeros(n_days, dtype=bool)
+        self.open_flags[(cal_dates - self.start).astype(int)] = is_open
+        self.open_rank = np.cumsum(self.open_flags)
+        self.open_days = self.start + np.flatnonzero(self.open_flags).astype('timedelta64[D]')
+        self.open_day_strs = np.char.replace(np.datetime_as_string(self.open_days, unit='D'), '-', '').tolist()
+
+    def _index(self, value) -> int:
+        i = int((_to_day(value) - self.start).astype(int))
+        if i < 0 or i >= len(self.open_flags):
+            raise ValueError(f"日期 {value} 超出交易日历范围 {self.start} ~ {self.end}")
+        return i
+
+    def _count_before(self, value) -> int:
+        """严格早于该日的交易日数量"""
+        i = self._index(value)
+        return int(self.open_rank[i]) - int(self.open_flags[i])
+
+    def is_open(self, value) -> bool:
+        """是否为交易日"""
+        return bool(self.open_flags[self._index(value)])
+
+    def prev_n(self, value, n: int = 1) -> Optional[str]:
+        """该日之前(不含)的第n个交易日，YYYYMMDD；超出范围返回None"""
+        k = self._count_before(value) - n
+        return self.open_day_strs[k] if k >= 0 else None
+
+    def next_n(self, value, n: int = 1) -> Optional[str]:
+        """该日之后(不含)的第n个交易日，YYYYMMDD；超出范围返回None"""
+        k = int(self.open_rank[self._index(value)]) + n - 1
+        return self.open_day_strs[k] if k < len(self.open_day_strs) else None
+
+    def last_n(self, value, n: int) -> List[str]:
+        """截至该日(含)最近n个交易日，升序"""
+        k = int(self.open_rank[self._index(value)])
+        return self.open_day_strs[max(0, k - n):k]
+
+    def between(self, start, end) -> List[str]:
+        """两个日期之间(含两端)的交易日，升序"""
+        return self.open_day_strs[self._count_before(start):int(self.open_rank[self._index(end)])]
+
+    def latest(self, value=None) -> Optional[str]:
+        """截至该日(含)最近的交易日，默认今天"""
+        days = self.last_n(value or date.today(), 1)
+        return days[0] if days else None
+
+    # ================================= 交易时段辅助 =================================
+    def session_bars(self, value, freq: str = '30m') -> List[pd.Timestamp]:
+        """该交易日内指定周期的全部K线结束时间，非交易日返回空列表"""
+        if not self.is_open(value):
+            return []
+        day = pd.Timestamp(_to_day(value))
+        return [day + pd.Timedelta(minutes=int(m)) for m in bar_end_minutes(freq)]
+
+    def is_trading_time(self, ts=None) -> bool:
+        """是否处于连续竞价时段(09:30-11:30, 13:00-15:00)"""
+        ts = pd.Timestamp(ts or datetime.now())
+        if not self.is_open(ts):
+            return False
+        minute = ts.hour * 60 + ts.minute
+        return MORNING_OPEN <= minute < MORNING_CLOSE or AFTERNOON_OPEN <= minute < AFTERNOON_CLOSE
+
+    def last_completed_bar(self, ts=None, freq: str = '30m') -> pd.Timestamp:
+        """截至该时刻最近一根已完成K线的结束时间，跨越非交易日和午休"""
+        ts = pd.Timestamp(ts or datetime.now())
+        day = ts.normalize()
+        if self.is_open(day):
+            minute = ts.hour * 60 + ts.minute
+            ends = bar_end_minutes(freq)
+            done = ends[ends <= minute]
+            if len(done):
+                return day + pd.Timedelta(minutes=int(done[-1]))
+        prev_day = pd.Timestamp(_to_day(self.prev_n(day, 1)))
+        return prev_day + pd.Timedelta(minutes=int(bar_end_minutes(freq)[-1]))
+
+
+# ================================= 共享实例 =================================
+_calendars = {}
+_calendar_lock = threading.Lock()
+
+def load_trade_calendar(engine=None, exchange: str = 'SSE', refresh: bool = True) -> TradeCalendar:
+    """从数据库加载交易日历，refresh为True时先按需刷新(每天最多一次)"""
+    if engine is None:
+        config = load_config()
+        engine = create_engine(get_pg_connection_string(config))
+    if refresh:
+        try:
+            refresh_trade_calendar(engine)
+        except Exception as e:
+            logger.warning(f"刷新交易日历失败，使用本地已有数据: {str(e)}")
+    df = pd.read_sql(text(f"SELECT cal_date, is_open FROM {TABLE_NAME} WHERE exchange = :exchange"),
+                     engine, params={'exchange': exchange})
+    if df.empty:
+        raise RuntimeError(f"交易日历表 {TABLE_NAME} 中没有 {exchange} 的数据")
+    return TradeCalendar(pd.to_datetime(df['cal_date']).to_numpy(dtype='datetime64[D]'), df['is_open'].to_numpy(), exchange)
+
+def get_trade_calendar(exchange: str = 'SSE', engine=None) -> TradeCalendar:
+    """获取进程内共享的交易日历，跨天后自动重新加载"""
+    today = date.today()
+    with _calendar_lock:
+        cached = _calendars.get(exchange)
+        if cached is None or cached[0] != today:
+            _calendars[exchange] = (today, load_trade_calendar(engine, exchange))
+        return _calendars[exchange][1]
+
+
+if __name__ == '__main__':
+    setup_logger()
+    config = load_config()
+    engine = create_engine(get_pg_connection_string(config))
+    refresh_trade_calendar(engine, force=True)
+    cal = load_trade_calendar(engine, refresh=False)
+    logger.info(f"交易日历范围 {cal.start} ~ {cal.end}，共 {len(cal.open_days)} 个交易日，最近交易日 {cal.latest()}")
@@ -3,14 +3,13 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, confusion_matrix
-import tushare as ts
+from tushare_client import get_tushare_client
 import joblib
 import os
 
 # ================================= 读取配置文件 =================================
 config = load_config()
-token = config.get('tushare', 'token')
-pro = ts.pro_api(token)
+pro = get_tushare_client(config)
 engine = create_engine(get_pg_connection_string(config))
 
 # ================================= 配置日志 =================================
@@ -31,7 +30,7 @@ class MoneyflowWeightTrainer:
             min_samples (int): 最小样本数量，默认252个交易日(一年)
         """
         self.config = load_config()
-        self.pro = ts.pro_api(self.config.get('tushare', 'token'))
+        self.pro = get_tushare_client(self.config)
         self.engine = create_engine(get_pg_connection_string(self.config))
         self.start_date = start_date
         self.end_date = end_date
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+tushare共享客户端
+
+- 令牌桶限速，速率与账号每分钟调用额度一致(config.ini [tushare] calls_per_minute)
+- 线程池并发请求，同一时刻最多max_workers个在途请求
+- 相同接口+相同参数的请求去重：在途请求共享同一个Future，非空结果在cache_ttl秒内直接复用
+  (写入时清理过期结果，最多保留max_cache_entries条)
+- 按接口统计调用次数、失败次数、去重命中次数及耗时分布(耗时分位数取自固定大小的蓄水池样本)
+
+用法与ts.pro_api一致:
+    pro = get_tushare_client(config)
+    df = pro.moneyflow(trade_date='20250101')                              # 同步调用
+    dfs = pro.map('moneyflow', [{'trade_date': d} for d in trade_dates])  # 并发调用同一接口
+    dfs = pro.gather(func, [{'trade_date': d} for d in trade_dates])      # 并发执行包含多次调用的函数
+"""
+from common import *
+import tushare as ts
+import random
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+# ================================= 令牌桶 =================================
+class TokenBucket:
+    """线程安全的令牌桶，rate为每秒补充的令牌数，capacity为桶容量(允许的突发请求数)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# ================================= 耗时统计 =================================
+class LatencyStats:
+    """单个接口的耗时统计：次数、总和、最大值精确累计，分位数取自最多capacity个的蓄水池样本，内存不随调用次数增长"""
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+        self.rng = random.Random(0)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < self.capacity:
+            self.samples.append(value)
+        else:
+            # 蓄水池抽样：第count个样本以capacity/count的概率替换已有样本
+            slot = self.rng.randrange(self.count)
+            if slot < self.capacity:
+                self.samples[slot] = value
+
+
+# ================================= 接口代理 =================================
+class _Endpoint:
+    """pro.xxx 的代理对象，调用时经过客户端限速/去重"""
+
+    def __init__(self, client, api_name: str):
+        self.client = client
+        self.api_name = api_name
+
+    def __call__(self, **kwargs) -> pd.DataFrame:
+        return self.client.query(self.api_name, **kwargs)
+
+    def submit(self, **kwargs) -> Future:
+        return self.client.submit(self.api_name, **kwargs)
+
+
+# ================================= 共享客户端 =================================
+class TushareClient:
+    """带限速、并发、去重和耗时统计的tushare客户端"""
+
+    def __init__(self, token: str, calls_per_minute: int = 500, max_workers: int = 8,
+                 max_retries: int = 3, retry_wait: float = 1, cache_ttl: float = 60, max_cache_entries: int = 256):
+        """
+        Args:
+            token: tushare token
+            calls_per_minute: 账号每分钟调用额度
+            max_workers: 最大并发在途请求数
+            max_retries: 单次请求失败重试次数
+            retry_wait: 普通失败的重试等待秒数，触发频率限制时等待一分钟
+            cache_ttl: 非空结果的复用时间(秒)，0表示只对在途请求去重
+            max_cache_entries: 复用结果的最大条数，超出时淘汰最早写入的结果
+        """
+        self.pro = ts.pro_api(token)
+        self.bucket = TokenBucket(rate=calls_per_minute / 60.0, capacity=max(1, min(max_workers, calls_per_minute)))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tushare')
+        self.gather_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tushare_gather')
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.cache_ttl = cache_ttl
+        self.max_cache_entries = max_cache_entries
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.cache = OrderedDict()      # 按写入时间排序，过期和超量的结果从头部淘汰
+        self.latencies = defaultdict(LatencyStats)
+        self.counters = defaultdict(lambda: defaultdict(int))
+
+    def __getattr__(self, api_name: str) -> _Endpoint:
+        if api_name.startswith('_'):
+            raise AttributeError(api_name)
+        return _Endpoint(self, api_name)
+
+    @staticmethod
+    def _request_key(api_name: str, kwargs: dict) -> tuple:
+        return (api_name, tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+
+    def _cache_put(self, key: tuple, df: pd.DataFrame) -> None:
+        """写入复用结果并清理过期和超量的结果，调用方需持有self.lock"""
+        now = time.monotonic()
+        self.cache[key] = (now, df)
+        self.cache.move_to_end(key)
+        while self.cache:
+            oldest_key, (cached_at, _) = next(iter(self.cache.items()))
+            if now - cached_at <= self.cache_ttl and len(self.cache) <= self.max_cache_entries:
+                break
+            del self.cache[oldest_key]
+
+    def _call(self, api_name: str, key: tuple, kwargs: dict) -> pd.DataFrame:
+        """实际请求：限速、重试、计时，完成后移出在途表"""
+        try:
+            for retry in range(self.max_retries):
+                self.bucket.acquire()
+                t0 = time.perf_counter()
+                try:
+                    df = self.pro.query(api_name, **kwargs)
+                    with self.lock:
+                        self.latencies[api_name].add(time.perf_counter() - t0)
+                        self.counters[api_name]['calls'] += 1
+                        if df is not None and not df.empty and self.cache_ttl > 0:
+                            self._cache_put(key, df)
+                    return df if df is not None else pd.DataFrame()
+                except Exception as e:
+                    with self.lock:
+                        self.counters[api_name]['errors'] += 1
+                    if retry == self.max_retries - 1:
+                        raise
+                    # 触发每分钟访问次数限制时等待下一个周期
+                    wait = 60 if '每分钟' in str(e) else self.retry_wait
+                    logger.warning(f"tushare {api_name} 请求失败 ({retry + 1}/{self.max_retries})，{wait}秒后重试: {str(e)}")
+                    time.sleep(wait)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def submit(self, api_name: str, **kwargs) -> Future:
+        """提交请求，返回Future；相同请求在途时共享同一个Future"""
+        key = self._request_key(api_name, kwargs)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and time.monotonic() - cached[0] <= self.cache_ttl:
+                self.counters[api_name]['dedup'] += 1
+                future = Future()
+                future.set_result(cached[1].copy())
+                return future
+            if key in self.inflight:
+                self.counters[api_name]['dedup'] += 1
+                return self.inflight[key]
+            future = self.executor.submit(self._call, api_name, key, kwargs)
+            self.inflight[key] = future
+            return future
+
+    def query(self, api_name: str, **kwargs) -> pd.DataFrame:
+        """同步请求，返回DataFrame副本(去重后的结果可能被多个调用方共享)"""
+        return self.submit(api_name, **kwargs).result().copy()
+
+    def map(self, api_name: str, kwargs_list: List[dict]) -> List[pd.DataFrame]:
+        """并发请求同一接口的多组参数，按输入顺序返回结果"""
+        futures = [self.submit(api_name, **kwargs) for kwargs in kwargs_list]
+        return [future.result().copy() for future in futures]
+
+    def gather(self, func: Callable, kwargs_list: List[dict]) -> list:
+        """
+        并发执行内部包含tushare调用的函数(如一次取多个指数)，按输入顺序返回结果
+        func在独立线程池中运行，其内部的请求仍经过本客户端限速，不能在func中再调用gather
+        """
+        futures = [self.gather_executor.submit(func, **kwargs) for kwargs in kwargs_list]
+        return [future.result() for future in futures]
+
+    def get_stats(self) -> pd.DataFrame:
+        """按接口汇总调用次数、失败次数、去重命中次数和耗时(毫秒)"""
+        rows = []
+        with self.lock:
+            api_names = set(self.latencies) | set(self.counters)
+            for api_name in sorted(api_names):
+                stats = self.latencies.get(api_name, LatencyStats())
+                samples = np.array(stats.samples, dtype=float) * 1000
+                counter = self.counters[api_name]
+                rows.append({
+                    'api': api_name,
+                    'calls': counter['calls'],
+                    'errors': counter['errors'],
+                    'dedup': counter['dedup'],
+                    'mean_ms': stats.total / stats.count * 1000 if stats.count else np.nan,
+                    'p50_ms': np.percentile(samples, 50) if len(samples) else np.nan,
+                    'p95_ms': np.percentile(samples, 95) if len(samples) else np.nan,
+                    'max_ms': stats.max * 1000 if stats.count else np.nan,
+                    'total_s': stats.total,
+                })
+        return pd.DataFrame(rows)
+
+    def log_stats(self) -> None:
+        stats_df = self.get_stats()
+        if not stats_df.empty:
+            logger.info(f"tushare接口耗时统计:\n{stats_df.round(1).to_string(index=False)}")
+
+
+# ================================= 共享实例 =================================
+_client = None
+_client_lock = threading.Lock()
+
+def get_tushare_client(config=None) -> TushareClient:
+    """获取进程内共享的tushare客户端，额度和并发数读取config.ini [tushare]"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if config is None:
+                config = load_config()
+            _client = TushareClient(
+                token=config.get('tushare', 'token'),
+                calls_per_minute=config.getint('tushare', 'calls_per_minute', fallback=500),
+                max_workers=config.getint('tushare', 'max_workers', fallback=8),
+            )
+        return _client
@@ -0,0 +1,712 @@
+# -*- coding: utf-8 -*-
+"""
+HA SuperTrend 策略的数组回测引擎
+
+与各 bt_ha_supertrend_* 脚本中 Cerebro + HeikinAshiSuperTrendStrategy 的语义逐笔一致：
+- 空仓且 direction==1 时按当根收盘价计算 int(现金 × 95% / close) 股下单，持仓且 direction==-1 时平仓
+- 市价单在下一根K线开盘价成交(Cerebro默认不cheat-on-close)，最后一根K线的信号不会成交
+- 提交时(按信号K线收盘价)或成交时现金不足(含佣金)则订单被拒，但策略的in_position仍置为True，直到下一个平仓信号
+- 佣金为成交额的0.0003，资产 = 现金 + 持仓 × 当根收盘价
+- returns 与 TimeReturn 分析器一致：按日取最后一根K线的资产，首日相对初始资金
+
+持仓状态由信号前向填充得到，只对成交笔数做循环，单次回测为毫秒级
+
+MA+ADX 这类"开仓条件/平仓条件 + 固定比例止损止盈"的策略由 simulate_entry_exit 撮合，语义同加上notify_order的
+MAAdxStrategy；止损止盈价取决于开仓K线，同样只对成交笔数循环；entry_exit_returns 对同一份K线上的一批参数组合
+共用一个时间循环批量撮合
+
+check_parity / check_entry_exit_parity 用同一份数据分别跑 Cerebro 与本引擎并逐项比对，命令行入口对真实K线批量做一致性校验:
+    python vector_backtest.py --stock 600000.SH --periods 10 50 --multipliers 2 5
+    python vector_backtest.py --strategy ma_adx --stock 600000.SH --fast-ma 5 10 --slow-ma 20 60 --adx-periods 14 --adx-thresholds 25
+--synthetic 用合成K线离线校验(不需要数据库)，--position-ratios 覆盖接近或超过100%仓位时的拒单:
+    python vector_backtest.py --synthetic --seeds 0 1 --position-ratios 0.95 0.999 1.2
+    python vector_backtest.py --synthetic --strategy ma_adx --stop-loss 0.02 0.05 0.1 --position-ratios 0.95 0.999 1.2
+"""
+from common import *
+import argparse
+import itertools
+import scipy.signal
+
+
+# ================================= 定义初始变量 =================================
+INITIAL_CASH = 100000
+COMMISSION = 0.0003
+POSITION_RATIO = 0.95
+ENGINES = ['cerebro', 'vector']
+BAR_TIMES = ['10:00', '10:30', '11:00', '11:30', '13:30', '14:00', '14:30', '15:00']
+
+
+# ================================= 回测结果 =================================
+class VectorBacktestResult:
+    """
+    equity: 每根K线收盘后的资产
+    trades: 成交记录(entry_time/exit_time为成交K线时间，未平仓的exit_*为空)
+    returns: 与TimeReturn一致的日收益
+    """
+
+    def __init__(self, equity: pd.Series, cash: np.ndarray, position: np.ndarray, trades: pd.DataFrame,
+                 initial_cash: float):
+        self.equity = equity
+        self.cash = cash
+        self.position = position
+        self.trades = trades
+        self.initial_cash = initial_cash
+        self.returns = time_return(equity, initial_cash)
+
+    @property
+    def final_value(self) -> float:
+        return float(self.equity.iloc[-1]) if len(self.equity) else self.initial_cash
+
+
+# ================================= 信号与撮合 =================================
+def signal_state(direction) -> np.ndarray:
+    """策略的in_position状态：direction==1置1、==-1置0，其余(含NaN)保持上一根的状态"""
+    direction = np.asarray(direction, dtype=float)
+    event = np.where(direction == 1, 1.0, np.where(direction == -1, 0.0, np.nan))
+    last = np.where(~np.isnan(event), np.arange(len(event)), -1)
+    last = np.maximum.accumulate(last) if len(last) else last
+    return np.where(last >= 0, event[np.maximum(last, 0)], 0.0).astype(np.int8)
+
+def simulate_signals(open_: np.ndarray, close: np.ndarray, direction, initial_cash: float = INITIAL_CASH,
+                     commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> tuple:
+    """
+    按信号撮合
+    Returns:
+        (cash, position, trades): 每根K线成交后的现金与持仓，以及成交记录列表(下标形式)
+    """
+    open_ = np.asarray(open_, dtype=float)
+    close = np.asarray(close, dtype=float)
+    n = len(close)
+    state = signal_state(direction)
+    prev = np.r_[0, state[:-1]]
+    entries = np.flatnonzero((state == 1) & (prev == 0))
+    exits = np.flatnonzero((state == 0) & (prev == 1))
+
+    cash = float(initial_cash)
+    change_bars, cash_levels, pos_levels = [0], [cash], [0]
+    trades = []
+    for k, entry in enumerate(entries):
+        fill = entry + 1
+        if fill >= n:
+            break
+        size = int((cash * position_ratio) / close[entry])
+        if size <= 0:
+            continue
+        # 提交时按信号K线收盘价(check_submitted)、成交时按开盘价检查现金，扣款顺序同BackBroker._execute，不足则被拒(Margin)
+        if cash - size * close[entry] - size * close[entry] * commission < 0.0:
+            continue
+        price = open_[fill]
+        after = cash - size * price - size * price * commission
+        if after < 0.0:
+            continue
+        cash = after
+        entry_comm = size * price * commission
+        change_bars.append(fill)
+        cash_levels.append(cash)
+        pos_levels.append(size)
+
+        exit_signal = exits[k] if k < len(exits) else None
+        if exit_signal is None or exit_signal + 1 >= n:
+            trades.append((fill, None, price, np.nan, size, entry_comm, np.nan))
+            break
+        exit_fill = exit_signal + 1
+        exit_price = open_[exit_fill]
+        exit_comm = size * exit_price * commission
+        cash = cash + size * price + size * (exit_price - price) - exit_comm
+        change_bars.append(exit_fill)
+        cash_levels.append(cash)
+        pos_levels.append(0)
+        trades.append((fill, exit_fill, price, exit_price, size, entry_comm, exit_comm))
+
+    change_bars = np.asarray(change_bars)
+    slot = np.searchsorted(change_bars, np.arange(n), side='right') - 1
+    return np.asarray(cash_levels)[slot], np.asarray(pos_levels)[slot], trades
+
+def run_vector_backtest(df: pd.DataFrame, initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                        position_ratio: float = POSITION_RATIO, open_column: str = 'open',
+                        close_column: str = 'close', direction_column: str = 'direction') -> VectorBacktestResult:
+    """
+    对包含开盘价、收盘价和direction列、以K线时间为索引的DataFrame回测
+    open_column/close_column 对应Cerebro数据源中的open/close(如HA数据源传ha_open/ha_close)
+    """
+    open_ = df[open_column].to_numpy(dtype=float)
+    close = df[close_column].to_numpy(dtype=float)
+    cash, position, trades = simulate_signals(open_, close, df[direction_column].to_numpy(dtype=float),
+                                              initial_cash, commission, position_ratio)
+    return vector_result(df.index, close, cash, position, trades, initial_cash)
+
+def vector_result(index, close: np.ndarray, cash: np.ndarray, position: np.ndarray, trades: list,
+                  initial_cash: float = INITIAL_CASH) -> VectorBacktestResult:
+    """由撮合得到的现金、持仓和成交记录(下标形式)构造回测结果"""
+    index = pd.DatetimeIndex(index)
+    equity = pd.Series(cash + position * close, index=index, name='equity')
+
+    rows = []
+    for fill, exit_fill, price, exit_price, size, entry_comm, exit_comm in trades:
+        closed = exit_fill is not None
+        pnl = size * (exit_price - price) if closed else np.nan
+        rows.append({
+            'entry_time': index[fill],
+            'exit_time': index[exit_fill] if closed else pd.NaT,
+            'entry_price': price,
+            'exit_price': exit_price,
+            'size': size,
+            'commission': entry_comm + (exit_comm if closed else 0.0),
+            'pnl': pnl,
+            'pnlcomm': pnl - entry_comm - exit_comm if closed else np.nan,
+        })
+    trades_df = pd.DataFrame(rows, columns=['entry_time', 'exit_time', 'entry_price', 'exit_price', 'size',
+                                            'commission', 'pnl', 'pnlcomm'])
+    return VectorBacktestResult(equity, cash, position, trades_df, initial_cash)
+
+def time_return(equity: pd.Series, initial_cash: float = INITIAL_CASH) -> pd.Series:
+    """
+    与TimeReturn(数据源为日线周期)一致的收益：每日最后一根K线资产 / 前一日最后一根K线资产 - 1，首日相对初始资金
+    索引为日期(Cerebro的键为当日23:59:59.999999，经脚本按日聚合后相同)
+    """
+    if equity.empty:
+        return pd.Series(dtype=float)
+    days = equity.index.values.astype('datetime64[D]')
+    last = np.r_[np.flatnonzero(days[1:] != days[:-1]), len(days) - 1]
+    day_value = equity.to_numpy()[last]
+    prev_value = np.r_[initial_cash, day_value[:-1]]
+    return pd.Series(day_value / prev_value - 1.0, index=pd.DatetimeIndex(days[last]))
+
+def recent_start(index, fraction: float) -> int:
+    """最近fraction比例K线的起始下标，对齐到当日第一根K线；fraction>=1时为0"""
+    index = pd.DatetimeIndex(index)
+    if fraction >= 1 or len(index) == 0:
+        return 0
+    raw = min(int(len(index) * (1 - fraction)), len(index) - 1)
+    return int(index.searchsorted(index[raw].normalize()))
+
+def time_return_matrix(index, equity: np.ndarray, initial_cash: float = INITIAL_CASH) -> pd.DataFrame:
+    """time_return 的批量版本：(K线数, 参数组数)的资产矩阵 -> 每列的日收益"""
+    days = pd.DatetimeIndex(index).values.astype('datetime64[D]')
+    last = np.r_[np.flatnonzero(days[1:] != days[:-1]), len(days) - 1] if len(days) else np.zeros(0, dtype=int)
+    day_value = equity[last]
+    prev_value = np.vstack([np.full((1, equity.shape[1]), float(initial_cash)), day_value[:-1]])
+    return pd.DataFrame(day_value / prev_value - 1.0, index=pd.DatetimeIndex(days[last]))
+
+def bt_analyzer_stats(result: VectorBacktestResult, riskfreerate: float = 0.01, tann: int = 252) -> dict:
+    """
+    与Cerebro默认参数的SharpeRatio(年度收益)、DrawDown、Returns(rnorm100)分析器一致的统计
+    收益标准差为0时夏普比率为None
+    """
+    equity = result.equity
+    if equity.empty:
+        return {'sharperatio': None, 'drawdown': 0.0, 'rnorm100': 0.0}
+    values = equity.to_numpy()
+    years = equity.index.year.to_numpy()
+    last = np.r_[np.flatnonzero(years[1:] != years[:-1]), len(years) - 1]
+    year_value = values[last]
+    ret_free = year_value / np.r_[result.initial_cash, year_value[:-1]] - 1.0 - riskfreerate
+    retdev = math.sqrt(np.mean((ret_free - ret_free.mean()) ** 2))
+    sharpe = ret_free.mean() / retdev if retdev else None
+
+    peak = np.maximum.accumulate(np.maximum(values, result.initial_cash))
+    drawdown = float(np.max(100.0 * (peak - values) / peak))
+
+    ndays = len(np.unique(equity.index.values.astype('datetime64[D]')))
+    ratio = values[-1] / result.initial_cash
+    ravg = (math.log(ratio) if ratio > 0 else float('-inf')) / ndays
+    rnorm = math.expm1(ravg * tann) if ravg > float('-inf') else ravg
+    return {'sharperatio': sharpe, 'drawdown': drawdown, 'rnorm100': rnorm * 100.0}
+
+def trade_records(trades: pd.DataFrame) -> List[dict]:
+    """转换为脚本中TradeRecorder的记录格式(只含已平仓交易)"""
+    closed = trades.dropna(subset=['exit_time'])
+    return [{
+        'entry_date': row.entry_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'exit_date': row.exit_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'entry_price': row.entry_price,
+        'exit_price': row.exit_price,
+        'size': row.size,
+        'entry_value': row.size * row.entry_price,
+        'exit_value': row.size * row.entry_price + row.pnlcomm,
+        'pnl': row.pnlcomm,
+        'return_pct': row.pnlcomm / (row.size * row.entry_price) * 100,
+        'commission': row.commission,
+    } for row in closed.itertuples()]
+
+
+# ================================= 自定义SuperTrend(bt_ha_supertrend_single) =================================
+def bt_supertrend_direction(high, low, close, period: int, multiplier: float) -> np.ndarray:
+    """
+    bt_ha_supertrend_single 中 SuperTrend 指标 + 策略开平仓条件的数组实现，返回信号：
+    close > supertrend 为1，close < supertrend 为-1，其余及指标最小周期(period+1根)之前为NaN
+    ATR与backtrader一致：TrueRange 的 SMMA，以前period个TR的均值为种子
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    n = len(close)
+    direction = np.full(n, np.nan)
+    if n <= period:
+        return direction
+
+    prev_close = np.r_[np.nan, close[:-1]]
+    tr = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    atr = np.full(n, np.nan)
+    alpha = 1.0 / period
+    seed = math.fsum(tr[1:period + 1]) / period
+    atr[period] = seed
+    if n > period + 1:
+        atr[period + 1:], _ = scipy.signal.lfilter([alpha], [1, -(1.0 - alpha)], tr[period + 1:], zi=[(1.0 - alpha) * seed])
+    hl2 = (high + low) / 2
+    upband = hl2 + atr * multiplier
+    downband = hl2 - atr * multiplier
+
+    # supertrend线在__init__中绑定到upband，next中逐根覆盖；max/min沿用Python内置语义(NaN比较为False)
+    st = upband.tolist()
+    up, down, closes = upband.tolist(), downband.tolist(), close.tolist()
+    uptrend = True
+    for i in range(period, n):
+        if uptrend:
+            st[i] = max(down[i], st[i - 1])
+            if closes[i] < st[i]:
+                uptrend = False
+        else:
+            st[i] = min(up[i], st[i - 1])
+            if closes[i] > st[i]:
+                uptrend = True
+    st = np.asarray(st)
+    direction[period:] = np.where(close[period:] > st[period:], 1.0, np.where(close[period:] < st[period:], -1.0, np.nan))
+    return direction
+
+
+# ================================= 开平仓条件 + 固定比例止损止盈(MAAdxStrategy) =================================
+def _first_stop(close: np.ndarray, start: int, stop: int, stop_loss: float, take_profit: float) -> int:
+    """close[start:stop]中首根收盘价触及止损或止盈的下标，没有则返回stop；按倍增的区块查找，不必扫描到末尾"""
+    block = 64
+    while start < stop:
+        end = min(start + block, stop)
+        segment = close[start:end]
+        hit = np.flatnonzero((segment <= stop_loss) | (segment >= take_profit))
+        if hit.size:
+            return start + int(hit[0])
+        start = end
+        block *= 2
+    return stop
+
+def simulate_entry_exit(open_: np.ndarray, close: np.ndarray, entry, exit_, stop_loss_pct: float = 0.05,
+                        take_profit_pct: float = 0.20, initial_cash: float = INITIAL_CASH,
+                        commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> tuple:
+    """
+    开仓/平仓条件 + 固定比例止损止盈的撮合，与加上notify_order(成交或被拒后清除订单)的MAAdxStrategy逐笔一致：
+    - 空仓且满足开仓条件时按当根收盘价计算 int(现金 × 95% / close) 股，下一根开盘价成交，现金不足则被拒，
+      股数为0时不下单；止损/止盈价以信号K线收盘价为基准
+    - 从成交K线起，收盘价触及止损、止盈或满足平仓条件则下一根开盘价平仓，平仓成交的K线即可再次开仓
+    止损止盈依赖开仓价，无法用信号平移向量化；这里只对成交笔数循环，开仓信号用searchsorted定位，
+    平仓位置取下一个平仓条件与首次触及止损止盈中较早者，单组参数为毫秒级
+    Returns:
+        (cash, position, trades): 同simulate_signals
+    """
+    open_ = np.asarray(open_, dtype=float)
+    close = np.asarray(close, dtype=float)
+    n = len(close)
+    entries = np.flatnonzero(np.asarray(entry, dtype=bool))
+    exits = np.flatnonzero(np.asarray(exit_, dtype=bool))
+
+    cash = float(initial_cash)
+    change_bars, cash_levels, pos_levels = [0], [cash], [0]
+    trades = []
+    i = 0
+    while True:
+        k = np.searchsorted(entries, i)
+        if k >= len(entries):
+            break
+        signal = int(entries[k])
+        fill = signal + 1
+        if fill >= n:
+            break
+        size = int((cash * position_ratio) / close[signal])
+        if size <= 0:
+            i = signal + 1
+            continue
+        price = open_[fill]
+        after = cash - size * price - size * price * commission
+        if cash - size * close[signal] - size * close[signal] * commission < 0.0 or after < 0.0:
+            # 提交或成交时现金不足，订单被拒，成交K线重新判断开仓条件
+            i = fill
+            continue
+        cash = after
+        entry_comm = size * price * commission
+        change_bars.append(fill)
+        cash_levels.append(cash)
+        pos_levels.append(size)
+
+        k = np.searchsorted(exits, fill)
+        exit_signal = int(exits[k]) if k < len(exits) else n
+        exit_signal = _first_stop(close, fill, exit_signal, close[signal] * (1 - stop_loss_pct),
+                                  close[signal] * (1 + take_profit_pct))
+        if exit_signal + 1 >= n:
+            trades.append((fill, None, price, np.nan, size, entry_comm, np.nan))
+            break
+        exit_fill = exit_signal + 1
+        exit_price = open_[exit_fill]
+        exit_comm = size * exit_price * commission
+        cash = cash + size * price + size * (exit_price - price) - exit_comm
+        change_bars.append(exit_fill)
+        cash_levels.append(cash)
+        pos_levels.append(0)
+        trades.append((fill, exit_fill, price, exit_price, size, entry_comm, exit_comm))
+        i = exit_fill
+
+    change_bars = np.asarray(change_bars)
+    slot = np.searchsorted(change_bars, np.arange(n), side='right') - 1
+    return np.asarray(cash_levels)[slot], np.asarray(pos_levels)[slot], trades
+
+def run_entry_exit_backtest(df: pd.DataFrame, entry, exit_, stop_loss_pct: float = 0.05, take_profit_pct: float = 0.20,
+                            initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                            position_ratio: float = POSITION_RATIO, open_column: str = 'open',
+                            close_column: str = 'close') -> VectorBacktestResult:
+    """对以K线时间为索引的DataFrame和逐K线的开仓/平仓条件回测"""
+    close = df[close_column].to_numpy(dtype=float)
+    cash, position, trades = simulate_entry_exit(df[open_column].to_numpy(dtype=float), close, entry, exit_,
+                                                 stop_loss_pct, take_profit_pct, initial_cash, commission,
+                                                 position_ratio)
+    return vector_result(df.index, close, cash, position, trades, initial_cash)
+
+def entry_exit_returns(df: pd.DataFrame, entry: np.ndarray, exit_: np.ndarray, stop_loss_pct: float = 0.05,
+                       take_profit_pct: float = 0.20, initial_cash: float = INITIAL_CASH,
+                       commission: float = COMMISSION, position_ratio: float = POSITION_RATIO) -> pd.DataFrame:
+    """
+    simulate_entry_exit 的批量版本：同一份K线上全部参数组合共用一个时间循环，每根K线对所有组合做数组运算，
+    组合较多时比逐组合撮合更快；entry/exit_形状为(K线数, 参数组数)
+    Returns:
+        与TimeReturn(按日)一致的日收益，行为交易日，列与entry的列对应
+    """
+    open_ = df['open'].to_numpy(dtype=float)
+    close = df['close'].to_numpy(dtype=float)
+    days = pd.DatetimeIndex(df.index).values.astype('datetime64[D]')
+    day_end = np.r_[days[1:] != days[:-1], True]
+    n_combos = entry.shape[1]
+
+    cash = np.full(n_combos, float(initial_cash))
+    position = np.zeros(n_combos)
+    entry_price = np.zeros(n_combos)
+    order_size = np.zeros(n_combos)
+    stop_loss = np.zeros(n_combos)
+    take_profit = np.zeros(n_combos)
+    pending_entry = np.zeros(n_combos, dtype=bool)
+    pending_exit = np.zeros(n_combos, dtype=bool)
+    day_equity = []
+
+    for i in range(len(close)):
+        # 上一根K线的订单在本根开盘成交
+        if pending_entry.any():
+            after = cash - order_size * open_[i] - order_size * open_[i] * commission
+            filled = pending_entry & (after >= 0.0)
+            cash = np.where(filled, after, cash)
+            position = np.where(filled, order_size, position)
+            entry_price = np.where(filled, open_[i], entry_price)
+            pending_entry[:] = False
+        if pending_exit.any():
+            exit_cash = (cash + position * entry_price + position * (open_[i] - entry_price)
+                         - position * open_[i] * commission)
+            cash = np.where(pending_exit, exit_cash, cash)
+            position = np.where(pending_exit, 0.0, position)
+            pending_exit[:] = False
+
+        holding = position > 0
+        buy = ~holding & entry[i]
+        if buy.any():
+            order_size = np.where(buy, np.trunc((cash * position_ratio) / close[i]), order_size)
+            # 股数为0不下单，提交时现金不足被拒
+            buy &= (order_size > 0) & (cash - order_size * close[i] - order_size * close[i] * commission >= 0.0)
+            pending_entry = buy
+            stop_loss = np.where(buy, close[i] * (1 - stop_loss_pct), stop_loss)
+            take_profit = np.where(buy, close[i] * (1 + take_profit_pct), take_profit)
+        pending_exit = holding & ((close[i] <= stop_loss) | (close[i] >= take_profit) | exit_[i])
+
+        if day_end[i]:
+            day_equity.append(cash + position * close[i])
+
+    day_equity = np.asarray(day_equity).reshape(-1, n_combos)
+    prev = np.vstack([np.full((1, n_combos), float(initial_cash)), day_equity[:-1]])
+    return pd.DataFrame(day_equity / prev - 1.0, index=pd.DatetimeIndex(days[day_end]))
+
+
+# ================================= Cerebro对照与一致性校验 =================================
+def run_cerebro_backtest(df: pd.DataFrame, initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                         position_ratio: float = POSITION_RATIO, open_column: str = 'open',
+                         close_column: str = 'close', direction_column: str = 'direction') -> dict:
+    """用Cerebro按脚本中的策略回测同一份数据，返回日收益、成交记录和期末资产"""
+    import backtrader as bt
+
+    class SignalData(bt.feeds.PandasData):
+        lines = ('direction',)
+        params = (
+            ('datetime', None),
+            ('open', open_column),
+            ('high', open_column),
+            ('low', open_column),
+            ('close', close_column),
+            ('volume', None),
+            ('direction', direction_column),
+            ('openinterest', None),
+        )
+
+    class SignalStrategy(bt.Strategy):
+        def __init__(self):
+            self.direction = self.data.lines.direction
+            self.in_position = False
+            self.trades = []
+
+        def notify_trade(self, trade):
+            if trade.justopened:
+                self.trades.append({'entry_time': bt.num2date(trade.dtopen), 'entry_price': trade.price,
+                                    'size': trade.size})
+            if trade.isclosed:
+                self.trades[-1].update({'exit_time': bt.num2date(trade.dtclose), 'commission': trade.commission,
+                                        'pnl': trade.pnl, 'pnlcomm': trade.pnlcomm})
+
+        def next(self):
+            if not self.in_position and self.direction[0] == 1:
+                size = int((self.broker.get_cash() * position_ratio) / self.data.close[0])
+                self.buy(size=size)
+                self.in_position = True
+            elif self.in_position and self.direction[0] == -1:
+                self.close()
+                self.in_position = False
+
+    cerebro = bt.Cerebro()
+    cerebro.adddata(SignalData(dataname=df))
+    cerebro.broker.setcash(initial_cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addstrategy(SignalStrategy)
+    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
+    strat = cerebro.run()[0]
+    returns = pd.Series(strat.analyzers.timereturn.get_analysis())
+    returns.index = pd.to_datetime(returns.index).normalize()
+    return {'returns': returns, 'trades': pd.DataFrame(strat.trades), 'final_value': cerebro.broker.getvalue()}
+
+def run_cerebro_entry_exit(df: pd.DataFrame, entry, exit_, stop_loss_pct: float = 0.05, take_profit_pct: float = 0.20,
+                           initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                           position_ratio: float = POSITION_RATIO, open_column: str = 'open',
+                           close_column: str = 'close') -> dict:
+    """用Cerebro按MAAdxStrategy的下单逻辑回测逐K线的开仓/平仓条件，返回日收益、成交记录和期末资产"""
+    import backtrader as bt
+    df = pd.DataFrame({'open': df[open_column].to_numpy(dtype=float), 'close': df[close_column].to_numpy(dtype=float),
+                       'entry': np.asarray(entry, dtype=float), 'exit': np.asarray(exit_, dtype=float)}, index=df.index)
+
+    class SignalData(bt.feeds.PandasData):
+        lines = ('entry', 'exit',)
+        params = (
+            ('datetime', None),
+            ('open', 'open'),
+            ('high', 'open'),
+            ('low', 'open'),
+            ('close', 'close'),
+            ('volume', None),
+            ('entry', 'entry'),
+            ('exit', 'exit'),
+            ('openinterest', None),
+        )
+
+    class EntryExitStrategy(bt.Strategy):
+        def __init__(self):
+            self.order = None
+            self.stop_loss = None
+            self.take_profit = None
+            self.trades = []
+
+        def notify_order(self, order):
+            if order.status in [order.Completed, order.Canceled, order.Margin, order.Rejected]:
+                self.order = None
+
+        def notify_trade(self, trade):
+            if trade.justopened:
+                self.trades.append({'entry_time': bt.num2date(trade.dtopen), 'entry_price': trade.price,
+                                    'size': trade.size})
+            if trade.isclosed:
+                self.trades[-1].update({'exit_time': bt.num2date(trade.dtclose), 'commission': trade.commission,
+                                        'pnl': trade.pnl, 'pnlcomm': trade.pnlcomm})
+
+        def next(self):
+            if self.order:
+                return
+            close = self.data.close[0]
+            if not self.position:
+                if self.data.entry[0] > 0:
+                    size = int((self.broker.get_cash() * position_ratio) / close)
+                    self.order = self.buy(size=size)
+                    self.stop_loss = close * (1 - stop_loss_pct)
+                    self.take_profit = close * (1 + take_profit_pct)
+            elif close <= self.stop_loss or close >= self.take_profit or self.data.exit[0] > 0:
+                self.order = self.close()
+
+    cerebro = bt.Cerebro()
+    cerebro.adddata(SignalData(dataname=df))
+    cerebro.broker.setcash(initial_cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addstrategy(EntryExitStrategy)
+    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
+    strat = cerebro.run()[0]
+    returns = pd.Series(strat.analyzers.timereturn.get_analysis())
+    returns.index = pd.to_datetime(returns.index).normalize()
+    return {'returns': returns, 'trades': pd.DataFrame(strat.trades), 'final_value': cerebro.broker.getvalue()}
+
+def _parity_report(reference: dict, result: VectorBacktestResult, tol: float, cerebro_s: float, vector_s: float) -> dict:
+    """逐项比对Cerebro与数组引擎的回测结果"""
+    ref_trades = reference['trades']
+    vec_trades = result.trades
+    same_count = len(ref_trades) == len(vec_trades)
+    trades_ok = same_count
+    if same_count and len(vec_trades):
+        trades_ok = (
+            (pd.DatetimeIndex(ref_trades['entry_time']) == pd.DatetimeIndex(vec_trades['entry_time'])).all()
+            and np.allclose(ref_trades['entry_price'], vec_trades['entry_price'], rtol=tol)
+            and (ref_trades['size'].to_numpy() == vec_trades['size'].to_numpy()).all()
+        )
+        closed = vec_trades['exit_time'].notna().to_numpy()
+        if 'exit_time' in ref_trades:
+            trades_ok = trades_ok and np.allclose(ref_trades['pnlcomm'].to_numpy(dtype=float)[closed],
+                                                  vec_trades['pnlcomm'].to_numpy(dtype=float)[closed], rtol=tol, atol=tol)
+
+    returns = reference['returns'].align(result.returns, join='outer')
+    return_diff = float(np.nanmax(np.abs(returns[0].to_numpy() - returns[1].to_numpy()))) if len(returns[0]) else 0.0
+    value_diff = abs(reference['final_value'] - result.final_value) / max(abs(reference['final_value']), 1.0)
+    report = {
+        'trades_cerebro': len(ref_trades),
+        'trades_vector': len(vec_trades),
+        'trades_ok': bool(trades_ok),
+        'return_days': len(returns[0]),
+        'max_return_diff': return_diff,
+        'final_value_cerebro': reference['final_value'],
+        'final_value_vector': result.final_value,
+        'final_value_rel_diff': value_diff,
+        'cerebro_s': cerebro_s,
+        'vector_s': vector_s,
+    }
+    report['ok'] = bool(trades_ok and return_diff <= tol and value_diff <= tol)
+    return report
+
+def check_parity(df: pd.DataFrame, tol: float = 1e-8, **kwargs) -> dict:
+    """
+    Cerebro与数组引擎一致性校验：成交笔数、成交时间/价格/数量、每日收益和期末资产
+    Returns:
+        dict: 比对结果，ok为是否全部一致
+    """
+    t0 = time.perf_counter()
+    reference = run_cerebro_backtest(df, **kwargs)
+    t1 = time.perf_counter()
+    result = run_vector_backtest(df, **kwargs)
+    t2 = time.perf_counter()
+    return _parity_report(reference, result, tol, t1 - t0, t2 - t1)
+
+def check_entry_exit_parity(df: pd.DataFrame, entry, exit_, tol: float = 1e-8, **kwargs) -> dict:
+    """开平仓条件 + 止损止盈策略的一致性校验，比对项同check_parity"""
+    t0 = time.perf_counter()
+    reference = run_cerebro_entry_exit(df, entry, exit_, **kwargs)
+    t1 = time.perf_counter()
+    result = run_entry_exit_backtest(df, entry, exit_, **kwargs)
+    t2 = time.perf_counter()
+    return _parity_report(reference, result, tol, t1 - t0, t2 - t1)
+
+
+# ================================= 合成行情 =================================
+def synthetic_bars(n_days: int = 750, seed: int = 0, start_date: str = '2016-01-04') -> pd.DataFrame:
+    """
+    离线一致性校验用的合成30分钟K线，格式同get_30m_kline_data(trade_time, open, high, low, close, volume)
+    收盘价为几何随机游走，开盘价相对上一根收盘价随机跳空，仓位比例接近1时会出现提交时和成交时的现金不足
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start_date, periods=n_days)
+    trade_time = pd.DatetimeIndex([day + pd.Timedelta(f'{bar_time}:00') for day in days for bar_time in BAR_TIMES])
+    n = len(trade_time)
+    close = 20 * np.exp(np.cumsum(rng.normal(0.0001, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]] * (1 + rng.normal(0, 0.002, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.003, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.003, n)))
+    volume = rng.integers(10000, 1000000, n).astype(float)
+    return pd.DataFrame({'trade_time': trade_time, 'open': open_, 'high': high, 'low': low, 'close': close,
+                         'volume': volume})
+
+
+# ================================= 主函数 =================================
+def load_check_bars(args) -> List[tuple]:
+    """(名称, K线)列表：--synthetic 时为各随机种子的合成K线，否则从数据库读取各股票"""
+    if args.synthetic:
+        return [(f'synthetic_{seed}', synthetic_bars(args.days, seed)) for seed in args.seeds]
+    bars = []
+    for stock_code in args.stock:
+        df = get_30m_kline_data('wfq', stock_code, args.start_date, args.end_date)
+        if df is None or df.empty:
+            logger.warning(f"{stock_code} 没有K线数据，跳过")
+            continue
+        bars.append((stock_code, df))
+    return bars
+
+def check_ma_adx(stock_code: str, df: pd.DataFrame, args) -> List[dict]:
+    """MAAdxStrategy的一致性校验，数据与bt_ma_adx_mult_tscode相同：去除指标为NaN的K线后回测"""
+    from strategy_indicators import MaAdxIndicators
+    indicators = MaAdxIndicators(df)
+    reports = []
+    for fast_ma, slow_ma, adx_period in itertools.product(args.fast_ma, args.slow_ma, args.adx_periods):
+        if fast_ma >= slow_ma:
+            continue
+        frame = indicators.frame(fast_ma, slow_ma, adx_period)
+        for threshold in args.adx_thresholds:
+            entry = ((frame['ma_fast'] > frame['ma_slow']) & (frame['ADX'] > threshold)
+                     & (frame['DI_plus'] > frame['DI_minus'])).to_numpy()
+            exit_ = ((frame['ma_fast'] < frame['ma_slow']) & (frame['ADX'] > threshold)
+                     & (frame['DI_minus'] > frame['DI_plus'])).to_numpy()
+            for stop_loss, take_profit, ratio in itertools.product(args.stop_loss, args.take_profit,
+                                                                   args.position_ratios):
+                report = check_entry_exit_parity(frame, entry, exit_, tol=args.tol, stop_loss_pct=stop_loss,
+                                                 take_profit_pct=take_profit, position_ratio=ratio)
+                reports.append({'stock_code': stock_code, 'fast_ma': fast_ma, 'slow_ma': slow_ma,
+                                'adx_period': adx_period, 'adx_threshold': threshold, 'stop_loss': stop_loss,
+                                'take_profit': take_profit, 'position_ratio': ratio, **report})
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description='数组回测引擎与Cerebro一致性校验')
+    parser.add_argument('--strategy', type=str, choices=['ha_supertrend', 'ma_adx'], default='ha_supertrend', help='策略')
+    parser.add_argument('--stock', type=str, nargs='+', default=['600000.SH'], help='股票代码')
+    parser.add_argument('--start-date', type=str, default='2000-01-01', help='开始日期')
+    parser.add_argument('--end-date', type=str, default='2024-12-31', help='结束日期')
+    parser.add_argument('--periods', type=int, nargs='+', default=[10, 30, 50], help='SuperTrend周期')
+    parser.add_argument('--multipliers', type=float, nargs='+', default=[2, 3, 5], help='SuperTrend乘数')
+    parser.add_argument('--fast-ma', type=int, nargs='+', default=[5, 10], help='MA+ADX快速均线窗口')
+    parser.add_argument('--slow-ma', type=int, nargs='+', default=[20, 60], help='MA+ADX慢速均线窗口')
+    parser.add_argument('--adx-periods', type=int, nargs='+', default=[14], help='MA+ADX的ADX周期')
+    parser.add_argument('--adx-thresholds', type=float, nargs='+', default=[25], help='MA+ADX的ADX阈值')
+    parser.add_argument('--stop-loss', type=float, nargs='+', default=[0.05], help='MA+ADX止损比例')
+    parser.add_argument('--take-profit', type=float, nargs='+', default=[0.20], help='MA+ADX止盈比例')
+    parser.add_argument('--position-ratios', type=float, nargs='+', default=[POSITION_RATIO], help='下单资金比例')
+    parser.add_argument('--synthetic', action='store_true', help='用合成K线离线校验，不读数据库')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1], help='--synthetic 时合成K线的随机种子')
+    parser.add_argument('--days', type=int, default=750, help='--synthetic 时合成K线的交易日数')
+    parser.add_argument('--tol', type=float, default=1e-8, help='允许误差')
+    args = parser.parse_args()
+
+    setup_logger()
+    reports = []
+    for stock_code, df in load_check_bars(args):
+        df['trade_time'] = pd.to_datetime(df['trade_time'])
+        if args.strategy == 'ma_adx':
+            reports.extend(check_ma_adx(stock_code, df.set_index('trade_time'), args))
+            continue
+        df = heikin_ashi(df.set_index('trade_time'))
+        for period, multiplier, ratio in itertools.product(args.periods, args.multipliers, args.position_ratios):
+            multiplier = int(multiplier) if float(multiplier).is_integer() else multiplier
+            report = check_parity(supertrend(df, period, multiplier), tol=args.tol, position_ratio=ratio)
+            reports.append({'stock_code': stock_code, 'period': period, 'multiplier': multiplier,
+                            'position_ratio': ratio, **report})
+
+    reports_df = pd.DataFrame(reports)
+    if reports_df.empty:
+        return
+    logger.info(f"一致性校验结果:\n{reports_df.to_string(index=False)}")
+    speedup = reports_df['cerebro_s'].sum() / max(reports_df['vector_s'].sum(), 1e-9)
+    if reports_df['ok'].all():
+        logger.info(f"全部 {len(reports_df)} 组参数一致，数组引擎提速 {speedup:.0f} 倍")
+    else:
+        logger.error(f"{(~reports_df['ok']).sum()} 组参数不一致")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+SuperTrend / MA+ADX 策略的滚动前推(walk-forward)检验
+
+各优化脚本在2000-2024全区间上拟合一次参数并报告样本内指标，monitor_stocks.csv 中的参数无法判断是否过拟合。
+本模块把历史切成若干(训练, 测试)窗口：训练窗口上选出评分最高的参数，在紧随其后的测试窗口上记录样本外收益，
+拼接各测试窗口得到样本外净值，并统计每只股票各窗口所选参数的稳定性。
+
+指标只在全历史上计算一次，窗口之间不重复计算：
+- supertrend: 按股票分块载入面板(panel_backtest)，每个period一次时间循环算完全部multiplier，得到全网格的日收益矩阵
+- ma_adx:     每个均线窗口、每个ADX周期只计算一次，全部参数组合的开平仓信号由数组拼出，
+              止损止盈等路径相关逻辑在同一个时间循环中对所有组合同时撮合(vector_backtest.entry_exit_returns)
+之后每个窗口只是对日收益矩阵按日期切片，训练/测试窗口的评分对全部参数组合一次批量计算(perf_metrics)
+
+测试窗口的收益取所选参数全历史回测在该窗口内的日收益，即窗口开始时的持仓状态延续自此前的历史，
+相当于实盘中持续运行该组参数；评分口径与优化脚本一致(supertrend为ha_st_score综合评分，ma_adx为夏普比率)
+
+用法:
+    python walk_forward.py --strategy supertrend --train-years 5 --test-years 1
+    python walk_forward.py --strategy ma_adx --stock 600000.SH --train-years 8 --anchored
+结果写入 reports/walk_forward/ 下的 {strategy}_windows.csv、{strategy}_stability.csv、{strategy}_oos_equity.csv
+"""
+from common import *
+from vector_backtest import entry_exit_returns
+from panel_backtest import load_panel, run_panel_length, panel_daily_returns, get_benchmark_returns
+from perf_metrics import compute_metrics, ha_st_score
+import argparse
+import itertools
+
+
+# ================================= 定义初始变量 =================================
+START_DATE = '2000-01-01'
+END_DATE = '2024-12-31'
+STRATEGIES = ['supertrend', 'ma_adx']
+TRAIN_YEARS = 5
+TEST_YEARS = 1
+MIN_TRAIN_DAYS = 30     # 训练窗口至少的交易日数，与MA+ADX优化脚本一致
+WF_CHUNK = 20           # supertrend每块股票数，内存约为 交易日数 × 股票数 × 参数组数 × 8字节
+OUTPUT_DIR = os.path.join('reports', 'walk_forward')
+
+# 与 bt_ha_supertrend_mult_tscode 相同的参数网格
+PERIOD_RANGE = np.arange(10, 110, 10)
+MULTIPLIER_RANGE = np.arange(1, 11, 1)
+
+# 与 bt_ma_adx_mult_tscode 相同的参数网格和止损止盈
+FAST_MA_RANGE = np.arange(5, 35, 5)
+SLOW_MA_RANGE = np.arange(10, 70, 10)
+ADX_PERIOD_RANGE = np.arange(10, 35, 5)
+ADX_THRESH_RANGE = np.arange(20, 45, 5)
+STOP_LOSS_PCT = 0.05
+TAKE_PROFIT_PCT = 0.20
+
+
+# ================================= 窗口划分 =================================
+def walk_forward_windows(dates: pd.DatetimeIndex, train_years: int, test_years: int,
+                         anchored: bool = False) -> List[tuple]:
+    """
+    按自然年划分窗口，返回[(train_start, train_end, test_start, test_end)]，区间左闭右开
+    测试窗口首尾相接地向前推进；anchored=True时训练窗口起点固定为第一个日期(扩张窗口)，否则为滚动窗口
+    """
+    if len(dates) == 0:
+        return []
+    first, last = dates[0], dates[-1]
+    windows = []
+    test_start = first + pd.DateOffset(years=train_years)
+    while test_start <= last:
+        test_end = test_start + pd.DateOffset(years=test_years)
+        train_start = first if anchored else test_start - pd.DateOffset(years=train_years)
+        windows.append((train_start, test_start, test_start, test_end))
+        test_start = test_end
+    return windows
+
+
+# ================================= 评分 =================================
+def supertrend_scores(returns: pd.DataFrame) -> pd.Series:
+    """与bt_ha_supertrend_mult_tscode相同的综合评分"""
+    return ha_st_score(returns)['score']
+
+def ma_adx_scores(returns: pd.DataFrame) -> pd.Series:
+    """与bt_ma_adx_mult_tscode相同的夏普比率(按252年化)，交易日不足MIN_TRAIN_DAYS的组合为-inf"""
+    sharpe = compute_metrics(returns, sharpe_periods=252)['sharpe']
+    return sharpe.where(returns.notna().sum().to_numpy() >= MIN_TRAIN_DAYS, -np.inf)
+
+SCORERS = {'supertrend': supertrend_scores, 'ma_adx': ma_adx_scores}
+
+
+# ================================= 前推检验 =================================
+def walk_forward(returns: pd.DataFrame, grid: pd.DataFrame, scorer: Callable, train_years: int = TRAIN_YEARS,
+                 test_years: int = TEST_YEARS, anchored: bool = False) -> tuple:
+    """
+    对一只股票全网格的日收益做前推检验
+    Args:
+        returns: 日收益矩阵，行为日期，第k列为grid第k行参数的收益，NaN为无数据的日期
+        grid: 参数表，每行一组参数
+        scorer: 对收益矩阵各列批量评分的函数，返回按列顺序的Series
+    Returns:
+        (windows, oos_returns): 每个窗口的所选参数及样本内/样本外评分；拼接后的样本外日收益
+    """
+    returns = returns.dropna(how='all')
+    dates = returns.index
+    rows, oos = [], []
+    for n, (train_start, train_end, test_start, test_end) in enumerate(
+            walk_forward_windows(dates, train_years, test_years, anchored)):
+        train = returns[(dates >= train_start) & (dates < train_end)]
+        test = returns[(dates >= test_start) & (dates < test_end)]
+        if len(train) < MIN_TRAIN_DAYS or test.empty:
+            continue
+        train_scores = scorer(train).to_numpy()
+        finite = np.isfinite(train_scores)
+        if not finite.any():
+            continue
+        # 同分时取参数网格中靠前的组合
+        best = int(np.argmax(np.where(finite, train_scores, -np.inf)))
+        test_scores = scorer(test).to_numpy()
+        chosen = test.iloc[:, best].dropna()
+        valid_test = np.isfinite(test_scores)
+        rows.append({
+            'window': n,
+            'train_start': train_start.date(),
+            'train_end': train_end.date(),
+            'test_start': test_start.date(),
+            'test_end': test_end.date(),
+            **{name: grid[name].iloc[best] for name in grid.columns},
+            'train_score': train_scores[best],
+            'test_score': test_scores[best],
+            # 所选参数在测试窗口全网格中的分位(1为样本外最优)
+            'test_rank_pct': (np.mean(test_scores[valid_test] <= test_scores[best])
+                              if valid_test.any() and np.isfinite(test_scores[best]) else np.nan),
+            'test_return': float(np.prod(1.0 + chosen.to_numpy()) - 1.0),
+            'train_days': len(train),
+            'test_days': len(chosen),
+        })
+        oos.append(pd.DataFrame({'window': n, 'return': chosen}))
+    windows = pd.DataFrame(rows)
+    oos_returns = pd.concat(oos) if oos else pd.DataFrame(columns=['window', 'return'])
+    return windows, oos_returns
+
+def parameter_stability(windows: pd.DataFrame, param_names: list) -> dict:
+    """各窗口所选参数的稳定性：众数及占比、不同参数组数、切换次数、各参数的均值和变异系数"""
+    chosen = windows[param_names].apply(tuple, axis=1)
+    counts = chosen.value_counts(sort=False)
+    mode = counts.idxmax()
+    result = {
+        'windows': len(windows),
+        'mode_params': '/'.join(str(v) for v in mode),
+        'mode_share': counts.max() / len(windows),
+        'distinct_params': len(counts),
+        'param_changes': int((chosen != chosen.shift()).sum() - 1),
+    }
+    for name in param_names:
+        values = windows[name].astype(float)
+        result[f'{name}_mean'] = values.mean()
+        result[f'{name}_cv'] = values.std(ddof=0) / values.mean() if values.mean() else np.nan
+    result['train_score_mean'] = windows['train_score'].mean()
+    result['test_score_mean'] = windows['test_score'].mean()
+    result['test_rank_pct_mean'] = windows['test_rank_pct'].mean()
+    return result
+
+
+# ================================= SuperTrend：面板回测得到全网格日收益 =================================
+def supertrend_grid(periods, multipliers) -> pd.DataFrame:
+    return pd.DataFrame(list(itertools.product(periods, multipliers)), columns=['period', 'multiplier'])
+
+def supertrend_returns(codes: list, start_date: str, end_date: str, periods, multipliers,
+                       benchmark_returns: pd.Series, engine) -> Dict[str, pd.DataFrame]:
+    """一块股票全网格的日收益(与逐只回测口径一致)，列顺序与supertrend_grid相同"""
+    panel = load_panel(codes, start_date, end_date, engine)
+    if not panel.valid.any():
+        return {}
+    blocks = []
+    for period in periods:
+        day_equity = run_panel_length(panel, period, multipliers)
+        returns, dates = panel_daily_returns(panel, day_equity, benchmark_returns)
+        blocks.append(returns)
+    returns = np.concatenate(blocks, axis=2)
+    return {code: pd.DataFrame(returns[:, j, :], index=dates) for j, code in enumerate(panel.codes)
+            if panel.first_day[j] >= 0}
+
+
+# ================================= MA+ADX：指标预计算与批量撮合 =================================
+def ma_adx_grid(fast_range, slow_range, adx_periods, thresholds) -> pd.DataFrame:
+    """与DEAP个体相同的参数空间(fast_ma < slow_ma)"""
+    rows = [(fast, slow, period, threshold)
+            for fast, slow, period, threshold in itertools.product(fast_range, slow_range, adx_periods, thresholds)
+            if fast < slow]
+    return pd.DataFrame(rows, columns=['fast_ma', 'slow_ma', 'adx_period', 'adx_threshold'])
+
+def ma_adx_signals(df: pd.DataFrame, grid: pd.DataFrame) -> tuple:
+    """
+    每个均线窗口、每个ADX周期只计算一次(与calculate_indicators相同的rolling均值和ta.adx)，
+    拼出全部参数组合的开仓/平仓条件，形状均为(K线数, 参数组数)；指标为NaN处条件为False
+    """
+    close = df['close'].astype(float)
+    ma = {window: close.rolling(window=int(window)).mean().to_numpy()
+          for window in np.union1d(grid['fast_ma'].unique(), grid['slow_ma'].unique())}
+    adx = {}
+    for period in grid['adx_period'].unique():
+        frame = ta.adx(df['high'].astype(float), df['low'].astype(float), close, length=int(period))
+        adx[period] = tuple(frame[[col for col in frame.columns if col.upper().startswith(prefix)][0]].to_numpy()
+                            for prefix in ('ADX', 'DMP', 'DMN'))
+
+    fast = np.column_stack([ma[w] for w in grid['fast_ma']])
+    slow = np.column_stack([ma[w] for w in grid['slow_ma']])
+    strength, di_plus, di_minus = (np.column_stack([adx[p][i] for p in grid['adx_period']]) for i in range(3))
+    trending = strength > grid['adx_threshold'].to_numpy(dtype=float)[None, :]
+    with np.errstate(invalid='ignore'):
+        entry = (fast > slow) & trending & (di_plus > di_minus)
+        exit_ = (fast < slow) & trending & (di_minus > di_plus)
+    return entry, exit_
+
+def ma_adx_returns(ts_code: str, start_date: str, end_date: str, grid: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """一只股票全网格的日收益，列顺序与grid相同"""
+    df = get_30m_kline_data('wfq', ts_code, start_date, end_date)
+    if df is None or df.empty:
+        return None
+    df['trade_time'] = pd.to_datetime(df['trade_time'])
+    df = df.set_index('trade_time')
+    entry, exit_ = ma_adx_signals(df, grid)
+    return entry_exit_returns(df, entry, exit_, STOP_LOSS_PCT, TAKE_PROFIT_PCT)
+
+
+# ================================= 主流程 =================================
+def run_walk_forward(strategy: str, ts_codes: list, start_date: str, end_date: str, train_years: int,
+                     test_years: int, anchored: bool, engine) -> tuple:
+    """
+    对一批股票做前推检验
+    Returns:
+        (windows, stability, oos_equity) 三张表
+    """
+    if strategy == 'supertrend':
+        grid = supertrend_grid(PERIOD_RANGE, MULTIPLIER_RANGE)
+        benchmark_returns = get_benchmark_returns(start_date, end_date, engine)
+        chunks = [ts_codes[i:i + WF_CHUNK] for i in range(0, len(ts_codes), WF_CHUNK)]
+        load = lambda codes: supertrend_returns(codes, start_date, end_date, PERIOD_RANGE, MULTIPLIER_RANGE,
+                                                benchmark_returns, engine)
+    else:
+        grid = ma_adx_grid(FAST_MA_RANGE, SLOW_MA_RANGE, ADX_PERIOD_RANGE, ADX_THRESH_RANGE)
+        chunks = [[code] for code in ts_codes]
+        load = lambda codes: {code: ma_adx_returns(code, start_date, end_date, grid) for code in codes}
+    scorer = SCORERS[strategy]
+    param_names = list(grid.columns)
+    logger.info(f"{strategy} 前推检验: {len(ts_codes)} 只股票 × {len(grid)} 组参数，"
+                f"训练 {train_years} 年 / 测试 {test_years} 年，{'扩张' if anchored else '滚动'}窗口")
+
+    windows_list, stability_rows, oos_list = [], [], []
+    for codes in tqdm(chunks, desc='前推检验'):
+        try:
+            frames = load(codes)
+        except Exception as e:
+            logger.error(f"载入 {codes} 失败: {str(e)}")
+            continue
+        for code, returns in frames.items():
+            if returns is None or returns.empty:
+                logger.warning(f"{code} 没有K线数据，跳过")
+                continue
+            windows, oos_returns = walk_forward(returns, grid, scorer, train_years, test_years, anchored)
+            if windows.empty:
+                logger.warning(f"{code} 历史不足一个训练+测试窗口，跳过")
+                continue
+            windows.insert(0, 'ts_code', code)
+            oos_returns.insert(0, 'ts_code', code)
+            windows_list.append(windows)
+            oos_list.append(oos_returns)
+            stability_rows.append({'ts_code': code, **parameter_stability(windows, param_names)})
+
+    if not windows_list:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    windows = pd.concat(windows_list, ignore_index=True)
+    oos = pd.concat(oos_list)
+    oos.index.name = 'trade_date'
+    oos = oos.reset_index()
+    oos['equity'] = oos.groupby('ts_code')['return'].transform(lambda r: (1.0 + r).cumprod())
+
+    # 拼接后样本外收益的指标，全部股票一次计算
+    oos_matrix = oos.pivot(index='trade_date', columns='ts_code', values='return')
+    metrics = compute_metrics(oos_matrix)
+    stability = pd.DataFrame(stability_rows).set_index('ts_code')
+    stability['oos_total_return'] = metrics['compsum'].reindex(stability.index)
+    stability['oos_cagr'] = metrics['cagr'].reindex(stability.index)
+    stability['oos_sharpe'] = metrics['sharpe'].reindex(stability.index)
+    stability['oos_max_drawdown'] = metrics['max_drawdown'].reindex(stability.index)
+    return windows, stability.reset_index(), oos
+
+def load_monitor_codes(path: str = 'monitor_stocks.csv') -> list:
+    """监控标的列表"""
+    try:
+        return pd.read_csv(path, encoding='utf-8')['ts_code'].drop_duplicates().tolist()
+    except FileNotFoundError:
+        logger.error(f"未找到{path}文件")
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description='SuperTrend / MA+ADX 滚动前推检验')
+    parser.add_argument('--strategy', type=str, choices=STRATEGIES, default='supertrend', help='策略')
+    parser.add_argument('--stock', type=str, nargs='+', help='股票代码 (默认: monitor_stocks.csv中的全部股票)')
+    parser.add_argument('--start-date', type=str, default=START_DATE, help='开始日期')
+    parser.add_argument('--end-date', type=str, default=END_DATE, help='结束日期')
+    parser.add_argument('--train-years', type=int, default=TRAIN_YEARS, help=f'训练窗口年数 (默认: {TRAIN_YEARS})')
+    parser.add_argument('--test-years', type=int, default=TEST_YEARS, help=f'测试窗口年数 (默认: {TEST_YEARS})')
+    parser.add_argument('--anchored', action='store_true', help='训练窗口起点固定(扩张窗口)，默认滚动窗口')
+    parser.add_argument('--output-dir', type=str, default=OUTPUT_DIR, help=f'结果目录 (默认: {OUTPUT_DIR})')
+    args = parser.parse_args()
+
+    setup_logger()
+    ts_codes = args.stock or load_monitor_codes()
+    if not ts_codes:
+        return
+    engine = create_engine(get_pg_connection_string(load_config()))
+    t0 = time.time()
+    windows, stability, oos = run_walk_forward(args.strategy, ts_codes, args.start_date, args.end_date,
+                                               args.train_years, args.test_years, args.anchored, engine)
+    if windows.empty:
+        logger.warning("没有可用的前推检验结果")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, table in [('windows', windows), ('stability', stability), ('oos_equity', oos)]:
+        table.to_csv(os.path.join(args.output_dir, f'{args.strategy}_{name}.csv'), index=False, encoding='utf-8-sig')
+    logger.info(f"参数稳定性:\n{stability.to_string(index=False)}")
+    logger.info(f"前推检验完成，耗时 {time.time() - t0:.1f}秒，结果已保存到 {args.output_dir}")
+
+if __name__ == '__main__':
+    main()